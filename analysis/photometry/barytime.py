@@ -0,0 +1,67 @@
+'''
+Barycentric dynamical time (BJD_TDB) for whole light curves, shared by sexphot, sexphot2 and plot-photom
+
+calc_bjd() takes arrays of UTC Julian dates and source positions and converts them in one
+astropy call: one Time array, one SkyCoord (per target, or per frame when the header
+positions differ) and one light-travel-time evaluation, instead of one of each per FITS file.
+The observatory is the fixed location in OBSERVATORY below, so nothing is looked up in the
+astropy site registry (which may need a download).
+
+    bjd = calc_bjd(jd_utc, ra_str, dec_str)       # arrays (or scalars) of JD, header RA [h], Dec [deg]
+    bjd = calc_bjd(jd_utc, target=SkyCoord(...))  # one target for all epochs
+    if not position_valid(ra_str, dec_str): ...    # per frame, to skip frames calc_bjd cannot convert
+
+Refs: http://docs.astropy.org/en/stable/time, Eastman et al. 2010 PASP 122, 935
+'''
+
+import numpy as np
+from astropy import time, coordinates as coord, units as u
+
+# Winer Observatory, Sonoita AZ. The scripts used to take the MMT from the astropy site
+# registry ("close enough to Winer"); the two differ by ~0.1 ms in BJD
+OBSERVATORY = {'lon': '-110d36m06.42s', 'lat': '+31d39m56.08s', 'height': 1500.}  # height [m]
+
+_location = None
+_valid_positions = {}
+
+def observatory_location():
+    global _location
+    if _location is None:
+        _location = coord.EarthLocation.from_geodetic(OBSERVATORY['lon'], OBSERVATORY['lat'], OBSERVATORY['height']*u.m)
+    return _location
+
+def target_coords(ra_str, dec_str):
+    ''' SkyCoord for header RA [hours] and Dec [deg] strings (or numbers), one per epoch or one for
+    all; a scalar SkyCoord if all epochs give the same position'''
+    positions = list(zip(np.atleast_1d(ra_str).tolist(), np.atleast_1d(dec_str).tolist()))
+    unique = sorted(set(positions))
+    if len(unique) == 1:
+        return coord.SkyCoord(unique[0][0], unique[0][1], unit=(u.hourangle, u.deg), frame='icrs')
+    # Parse each distinct position once
+    c = coord.SkyCoord([p[0] for p in unique], [p[1] for p in unique], unit=(u.hourangle, u.deg), frame='icrs')
+    index = dict((p, j) for j, p in enumerate(unique))
+    return c[[index[p] for p in positions]]
+
+def position_valid(ra_str, dec_str):
+    ''' True if target_coords() can parse header RA [hours] and Dec [deg]; check each frame with
+    this before calc_bjd(), where one bad position would stop the whole conversion'''
+    if (ra_str, dec_str) not in _valid_positions:
+        try:
+            target_coords(ra_str, dec_str)
+            _valid_positions[(ra_str, dec_str)] = True
+        except Exception:
+            _valid_positions[(ra_str, dec_str)] = False
+    return _valid_positions[(ra_str, dec_str)]
+
+def calc_bjd(jd_utc, ra_str=None, dec_str=None, target=None, location=None):
+    ''' BJD_TDB for UTC Julian dates jd_utc (scalar or array) of a source at ra_str, dec_str
+    (header strings, scalars or one per epoch) or at SkyCoord target. Returns a float or an array'''
+    if target is None:
+        target = target_coords(ra_str, dec_str)
+    if location is None:
+        location = observatory_location()
+    scalar = np.ndim(jd_utc) == 0
+    times = time.Time(np.atleast_1d(np.asarray(jd_utc, dtype=float)), format='jd', scale='utc', location=location)
+    ltt_bary = times.light_travel_time(target)
+    bjd_tdb = (times.tdb + ltt_bary).value
+    return float(bjd_tdb[0]) if scalar else bjd_tdb
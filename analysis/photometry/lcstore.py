@@ -0,0 +1,228 @@
+'''
+Columnar on-disk light-curve store, shared by sexphot, sexphot2 and plot-photom
+
+A store is a directory holding one flat binary file per column, for two tables:
+
+    frames: one row per FITS frame   bjd, jd_utc, filter, airmass, zp, zperr, exptime, date, file, size, mtime
+    points: one row per star/frame   frame (row in frames), star (index in the star list), mag, err, fwhm, nr
+
+plus meta.json with the row counts, the star list (name, ra, dec) and the widths of the string
+columns (filter, date, file). A string column is widened, into a new file with the width in
+its name, when a longer value is appended, so paths are never cut short. New frames are appended
+to the column files, so a new night costs only its own frames; a frame is recognised by its
+path, size and modification time. Queries read the columns and select with array masks:
+
+    store = LightCurveStore(path)
+    stars = store.star_indices(Objects, Ra_deg, Dec_deg)       # adds new stars
+    changed = store.options_changed({'detect_threshold': 5.0, ...})   # settings differing from the stored ones
+    new = [f for f in Ftsfiles if not store.has_frame(f)]
+    store.append(frames, points)                                # dicts of column arrays
+    fr, mag, err = store.matrix(stars, filter='R', jdmin=..., jdmax=...)  # frames sorted by bjd,
+                                                                # (nframe, nstar) arrays, nan = not measured
+    fr = store.frames(filter='R')                               # frame columns, sorted by bjd
+
+Magnitudes are stored as the scripts measure them (sexphot, sexphot2: instrumental, before
+zero point and extinction; plot-photom: photom differential magnitudes), so calibration
+options can change without re-reading any images. The settings the measurements depend on
+(detection threshold, FWHM limits, match radius; for plot-photom the -b option and the photom
+file) are kept in meta.json when the first frames are stored; scripts stop if they are run on
+the store with other settings. Each script records its own settings, so a store is used by the
+script that made it. A run that is killed while appending
+leaves the store as it was: meta.json is written last and longer column files are cut back
+to its row counts. One writer at a time.
+'''
+
+from __future__ import print_function
+import os, json
+import numpy as np
+
+FRAME_COLUMNS = [('bjd', 'f8'), ('jd_utc', 'f8'), ('filter', 'S8'), ('airmass', 'f8'), ('zp', 'f8'), ('zperr', 'f8'),
+                 ('exptime', 'f8'), ('date', 'S32'), ('file', 'S256'), ('size', 'i8'), ('mtime', 'f8')]
+POINT_COLUMNS = [('frame', 'i4'), ('star', 'i4'), ('mag', 'f8'), ('err', 'f8'), ('fwhm', 'f4'), ('nr', 'i4')]
+STRING_COLUMNS = ['filter', 'date', 'file']
+STRING_WIDTHS = dict((name, int(dtype[1:])) for name, dtype in FRAME_COLUMNS if name in STRING_COLUMNS)  # Initial widths [bytes]
+
+def file_key(ftsfile):
+    ''' (path, size, mtime) identifying a frame; size and mtime are 0 if the file is not there'''
+    path = os.path.realpath(ftsfile)
+    try:
+        st = os.stat(path)
+        return path, st.st_size, st.st_mtime
+    except OSError:
+        return path, 0, 0.
+
+class LightCurveStore(object):
+    def __init__(self, path):
+        ''' Open the store in directory path, creating it if needed'''
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        meta_file = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'version': 1, 'nframes': 0, 'npoints': 0, 'stars': [], 'widths': dict(STRING_WIDTHS)}
+        self._frames = None
+        self._keys = None
+
+    def __len__(self):
+        return self.meta['nframes']
+
+    def column_dtype(self, table, name):
+        if name in STRING_COLUMNS:
+            return 'S%i' % self.meta['widths'][name]
+        return dict(FRAME_COLUMNS if table == 'frames' else POINT_COLUMNS)[name]
+
+    def column_file(self, table, name, dtype=None):
+        if dtype is None: dtype = self.column_dtype(table, name)
+        if dtype[0] == 'S':
+            return os.path.join(self.path, '%s.%s.%s.bin' % (table, name, dtype))
+        return os.path.join(self.path, '%s.%s.bin' % (table, name))
+
+    def read_column(self, table, name):
+        n = self.meta['nframes' if table == 'frames' else 'npoints']
+        dtype = self.column_dtype(table, name)
+        fname = self.column_file(table, name)
+        if n == 0 or not os.path.exists(fname):
+            return np.zeros(0, dtype=dtype)
+        return np.fromfile(fname, dtype=dtype, count=n)
+
+    def read_table(self, table):
+        columns = FRAME_COLUMNS if table == 'frames' else POINT_COLUMNS
+        data = dict((name, self.read_column(table, name)) for name, dtype in columns)
+        for name in STRING_COLUMNS:
+            if name in data: data[name] = np.char.decode(data[name], 'utf-8')    # Written as UTF-8 in append()
+        return data
+
+    def all_frames(self):
+        if self._frames is None:
+            self._frames = self.read_table('frames')
+        return self._frames
+
+    def has_frame(self, ftsfile):
+        ''' True if ftsfile (same path, size and modification time) is in the store'''
+        if self._keys is None:
+            fr = self.all_frames()
+            self._keys = set(zip(fr['file'].tolist(), fr['size'].tolist(), fr['mtime'].tolist()))
+        return file_key(ftsfile) in self._keys
+
+    def star_indices(self, names, ra=None, dec=None):
+        ''' Indices of stars names in the store, adding the ones not yet there (ra, dec [deg] optional)'''
+        index = dict((s['name'], j) for j, s in enumerate(self.meta['stars']))
+        indices = []
+        for j, name in enumerate(names):
+            if name not in index:
+                index[name] = len(self.meta['stars'])
+                self.meta['stars'].append({'name': name, 'ra': None if ra is None else float(ra[j]), 'dec': None if dec is None else float(dec[j])})
+            indices.append(index[name])
+        return np.array(indices, dtype=int)
+
+    def options_changed(self, options):
+        ''' Names of options (dict of measurement settings, JSON numbers, strings or booleans) that differ
+        from the ones the stored frames were measured with; an empty store takes these options'''
+        if len(self) == 0 or 'options' not in self.meta:
+            self.meta['options'] = dict(options)
+            return []
+        return sorted(name for name in options if self.meta['options'].get(name) != options[name])
+
+    def star_names(self):
+        return [s['name'] for s in self.meta['stars']]
+
+    def append(self, frames, points):
+        ''' Append frames (dict of equal-length column sequences; file, size and mtime are filled in
+        from file if missing) and points (dict of columns; frame is the row in frames, 0-based)'''
+        n = len(frames['bjd'])
+        frames = dict(frames)
+        if 'size' not in frames:
+            keys = [file_key(f) for f in frames['file']]
+            frames['file'] = [k[0] for k in keys]; frames['size'] = [k[1] for k in keys]; frames['mtime'] = [k[2] for k in keys]
+        points = dict(points)
+        points['frame'] = np.asarray(points['frame']) + self.meta['nframes']
+        m = len(points['frame'])
+        widths = dict(self.meta['widths']) ; old_files = []
+        for table, columns, data, count in (('frames', FRAME_COLUMNS, frames, n), ('points', POINT_COLUMNS, points, m)):
+            nold = self.meta['nframes' if table == 'frames' else 'npoints']
+            for name, dtype in columns:
+                if name in STRING_COLUMNS:
+                    encoded = [x if isinstance(x, bytes) else x.encode('utf-8') for x in data.get(name, [''] * count)]
+                    width = max([len(x) for x in encoded] + [widths[name]])
+                    if width > widths[name]:
+                        width = max(width, 2*widths[name])
+                        old_files.append(self.widen(table, name, widths[name], width, nold))
+                        widths[name] = width
+                    dtype = 'S%i' % width
+                    values = np.array(encoded, dtype=dtype)
+                elif name in data:
+                    values = np.asarray(data[name]).astype(dtype)
+                else:
+                    values = np.full(count, np.nan if dtype[0] == 'f' else 0, dtype=dtype)
+                if len(values) != count:
+                    raise ValueError('%s column %s has %i values, expected %i' % (table, name, len(values), count))
+                fname = self.column_file(table, name, dtype)
+                with open(fname, 'ab') as f:
+                    # Drop anything past the committed rows (left by an interrupted append)
+                    f.truncate(nold * np.dtype(dtype).itemsize)
+                    values.tofile(f)
+        self.meta['nframes'] += n
+        self.meta['npoints'] += m
+        self.meta['widths'] = widths
+        self.write_meta()
+        for fname in old_files:
+            if os.path.exists(fname): os.remove(fname)
+        self._frames = None ; self._keys = None
+
+    def widen(self, table, name, width, new_width, nrows):
+        ''' Copy the first nrows of string column name to the file for new_width (used once meta.json
+        records it; until then the old file is). Returns the old file name'''
+        old_file = self.column_file(table, name, 'S%i' % width)
+        new_file = self.column_file(table, name, 'S%i' % new_width)
+        if nrows and os.path.exists(old_file):
+            values = np.fromfile(old_file, dtype='S%i' % width, count=nrows)
+        else:
+            values = np.zeros(0, dtype='S%i' % width)
+        values.astype('S%i' % new_width).tofile(new_file + '.tmp')
+        getattr(os, 'replace', os.rename)(new_file + '.tmp', new_file)
+        return old_file
+
+    def write_meta(self):
+        meta_file = os.path.join(self.path, 'meta.json')
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        getattr(os, 'replace', os.rename)(meta_file + '.tmp', meta_file)
+
+    def select(self, filter=None, jdmin=0, jdmax=0):
+        ''' Row numbers of frames with filter (None: any) and jdmin <= bjd <= jdmax (0, 0: any), sorted by bjd'''
+        fr = self.all_frames()
+        ok = np.ones(len(fr['bjd']), dtype=bool)
+        if filter is not None:
+            ok &= fr['filter'] == filter
+        if jdmin != 0 or jdmax != 0:
+            ok &= (fr['bjd'] >= jdmin) & (fr['bjd'] <= jdmax)
+        rows = np.nonzero(ok)[0]
+        return rows[np.argsort(fr['bjd'][rows], kind='stable')]
+
+    def frames(self, filter=None, jdmin=0, jdmax=0):
+        ''' Frame columns (dict of arrays) selected as in select(), sorted by bjd'''
+        rows = self.select(filter, jdmin, jdmax)
+        fr = self.all_frames()
+        return dict((name, fr[name][rows]) for name in fr)
+
+    def matrix(self, stars, filter=None, jdmin=0, jdmax=0, columns=('mag', 'err')):
+        ''' Frames selected as in select() and, for each of columns, an (nframe, nstar) array of the
+        points of stars (indices from star_indices) on those frames, nan where there is none'''
+        rows = self.select(filter, jdmin, jdmax)
+        fr = self.all_frames()
+        position = np.full(len(fr['bjd']), -1)
+        position[rows] = np.arange(len(rows))
+        star_position = np.full(max(len(self.meta['stars']), 1), -1)
+        star_position[np.asarray(stars, dtype=int)] = np.arange(len(stars))
+        frame = self.read_column('points', 'frame'); star = self.read_column('points', 'star')
+        i = position[frame] ; j = star_position[star]
+        ok = (i >= 0) & (j >= 0)
+        result = [dict((name, fr[name][rows]) for name in fr)]
+        for name in columns:
+            values = np.full((len(rows), len(stars)), np.nan)
+            values[i[ok], j[ok]] = self.read_column('points', name)[ok]
+            result.append(values)
+        return tuple(result)
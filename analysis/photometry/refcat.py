@@ -0,0 +1,159 @@
+'''
+Local cache of reference-star photometry (SDSS u,g,r,i,z) for zero-point solutions
+
+The sky is divided into tiles of roughly equal area (HEALPix-style): declination bands
+tile_deg high, each split in right ascension into as many tiles as fit around the band.
+A tile is fetched from the catalog source the first time a field needs it and stored
+as a .npy file under cache_dir, so later images of the same field (and every image when
+offline) are matched against local data. All tiles missing for a field are fetched in
+one request.
+
+Sources are pluggable: SDSSSource queries the SDSS SkyServer (astroquery), FileSource
+reads a local table (CSV, FITS, ...) with columns ra, dec, clean, u, g, r, i, z, e.g. an
+offline dump or a small file for tests.
+'''
+
+import os, tempfile
+import numpy as np
+from starmatch import StarMatcher
+
+FIELDS = ['ra', 'dec', 'clean', 'u', 'g', 'r', 'i', 'z']
+DTYPE = np.dtype([('ra', 'f8'), ('dec', 'f8'), ('clean', 'i2'), ('u', 'f4'), ('g', 'f4'), ('r', 'f4'), ('i', 'f4'), ('z', 'f4')])
+TILE_DEG = 0.5
+
+def tile_of(ra, dec, tile_deg=TILE_DEG):
+    ''' Return (band, index) arrays of the tiles containing positions ra, dec [deg]'''
+    ra = np.mod(np.asarray(ra, dtype=float), 360.)
+    dec = np.clip(np.asarray(dec, dtype=float), -90., 90.)
+    nbands = int(round(180./tile_deg))
+    band = np.minimum(((dec + 90.)/tile_deg).astype(int), nbands - 1)
+    n = tiles_in_band(band, tile_deg)
+    index = np.minimum((ra/(360./n)).astype(int), n - 1)
+    return band, index
+
+def tiles_in_band(band, tile_deg=TILE_DEG):
+    ''' Number of RA tiles in declination band(s) band'''
+    dec_center = -90. + (np.asarray(band) + 0.5)*tile_deg
+    return np.maximum(1, np.round(360.*np.cos(np.radians(dec_center))/tile_deg)).astype(int)
+
+def tile_box(band, index, tile_deg=TILE_DEG):
+    ''' Return (ra_min, ra_max, dec_min, dec_max) of a tile'''
+    n = int(tiles_in_band(band, tile_deg))
+    width = 360./n
+    return index*width, (index + 1)*width, -90. + band*tile_deg, -90. + (band + 1)*tile_deg
+
+class SDSSSource:
+    ''' SDSS SkyServer photometry (PhotoPrimary), fetched with one SQL query per request'''
+    name = 'sdss'
+
+    def __init__(self, timeout=120):
+        self.timeout = timeout
+
+    def fetch(self, boxes):
+        from astroquery.sdss import SDSS
+        where = ' or '.join('(ra between %.6f and %.6f and dec between %.6f and %.6f)' % box for box in boxes)
+        sql = 'select %s from PhotoPrimary where %s' % (', '.join(FIELDS), where)
+        table = SDSS.query_sql(sql, timeout=self.timeout, cache=False)
+        rows = np.zeros(0 if table is None else len(table), dtype=DTYPE)
+        if table is not None:
+            for f in FIELDS: rows[f] = table[f]
+        return rows
+
+class FileSource:
+    ''' Reference stars read from a local table with columns ra, dec, clean, u, g, r, i, z'''
+
+    def __init__(self, path):
+        from astropy.table import Table
+        self.path = path
+        self.name = 'file-' + os.path.splitext(os.path.basename(path))[0]
+        table = Table.read(path)
+        self.rows = np.zeros(len(table), dtype=DTYPE)
+        for f in FIELDS: self.rows[f] = table[f]
+
+    def fetch(self, boxes):
+        keep = np.zeros(len(self.rows), dtype=bool)
+        for ra_min, ra_max, dec_min, dec_max in boxes:
+            keep |= (self.rows['ra'] >= ra_min) & (self.rows['ra'] <= ra_max) & \
+                    (self.rows['dec'] >= dec_min) & (self.rows['dec'] <= dec_max)
+        return self.rows[keep]
+
+class RefCatalog:
+    '''
+    source:    SDSSSource, FileSource or any object with a name and fetch(boxes) -> DTYPE array
+    cache_dir: tiles are stored in cache_dir/<source name>/; if it cannot be created a
+               directory in the system temporary directory is used
+    '''
+    def __init__(self, source, cache_dir, tile_deg=TILE_DEG, verbose=False):
+        self.source = source
+        self.tile_deg = tile_deg
+        self.verbose = verbose
+        self.tile_dir = os.path.join(cache_dir, source.name)
+        try:
+            os.makedirs(self.tile_dir, exist_ok=True)
+        except OSError:
+            self.tile_dir = os.path.join(tempfile.gettempdir(), 'refcat', source.name)
+            os.makedirs(self.tile_dir, exist_ok=True)
+        self.fetched = 0     # number of tiles fetched from the source
+        self.read = 0        # number of tiles read from the cache
+
+    def tile_path(self, band, index):
+        return os.path.join(self.tile_dir, '%.2f_%04d_%04d.npy' % (self.tile_deg, band, index))
+
+    def tiles_near(self, ra, dec, radius_deg):
+        ''' Set of (band, index) of the tiles within radius_deg of any of the positions'''
+        ra = np.asarray(ra, dtype=float); dec = np.asarray(dec, dtype=float)
+        dra = radius_deg/np.maximum(np.cos(np.radians(dec)), 1e-3)
+        tiles = set()
+        for r, d in [(ra, dec), (ra - dra, dec), (ra + dra, dec), (ra, dec - radius_deg), (ra, dec + radius_deg)]:
+            tiles.update(zip(*[x.tolist() for x in tile_of(r, d, self.tile_deg)]))
+        return tiles
+
+    def stars(self, tiles):
+        ''' Return the reference stars in the given tiles, fetching the ones not yet cached
+            in a single request to the source. If the source fails (e.g. offline), the
+            cached tiles are still returned.'''
+        parts = []; missing = []
+        for tile in sorted(tiles):
+            path = self.tile_path(*tile)
+            if os.path.isfile(path):
+                parts.append(np.load(path)); self.read += 1
+            else:
+                missing.append(tile)
+        if missing:
+            boxes = [tile_box(band, index, self.tile_deg) for band, index in missing]
+            try:
+                rows = self.source.fetch(boxes)
+            except Exception as e:
+                print('Reference catalog %s unavailable (%s), using cached tiles only' % (self.source.name, e))
+                rows = None
+            if rows is not None:
+                if self.verbose: print('Fetched %i reference stars in %i tiles from %s' % (len(rows), len(missing), self.source.name))
+                band, index = tile_of(rows['ra'], rows['dec'], self.tile_deg)
+                for tile in missing:
+                    tile_rows = rows[(band == tile[0]) & (index == tile[1])]
+                    tmp = self.tile_path(*tile) + '.tmp.npy'
+                    np.save(tmp, tile_rows)
+                    os.replace(tmp, self.tile_path(*tile))
+                    parts.append(tile_rows); self.fetched += 1
+        if not parts: return np.zeros(0, dtype=DTYPE)
+        return np.concatenate(parts)
+
+    def match(self, ra, dec, radius_deg, mag_limit=('g', 21.0), clean=True):
+        '''
+        Match detections ra, dec [deg] to the nearest reference star within radius_deg.
+        Only clean stars brighter than mag_limit (band, magnitude) are used, since fainter
+        matches are likely wrong IDs. Returns a DTYPE array with one row per detection;
+        unmatched rows have NaN magnitudes.
+        '''
+        ra = np.asarray(ra, dtype=float); dec = np.asarray(dec, dtype=float)
+        out = np.zeros(len(ra), dtype=DTYPE)
+        for band in 'ugriz': out[band] = np.nan
+        if len(ra) == 0: return out
+        ref = self.stars(self.tiles_near(ra, dec, radius_deg))
+        if clean: ref = ref[ref['clean'] == 1]
+        if mag_limit is not None: ref = ref[ref[mag_limit[0]] < mag_limit[1]]
+        if len(ref) == 0: return out
+        j, sepn = StarMatcher(ref['ra'], ref['dec']).nearest(ra, dec, radius_deg)
+        found = j >= 0
+        out[found] = ref[j[found]]
+        return out
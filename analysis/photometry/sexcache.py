@@ -0,0 +1,235 @@
+'''
+Content-addressed cache of sextractor catalogs, shared by sexphot, sexphot2, calc-zmag and find-transients
+
+A catalog is stored once per (image contents, extraction parameters) as a small binary .npz
+file under cache_dir, so re-running any of the scripts on the same images (with the same
+sextractor config and detection threshold) reads the parsed catalog instead of running sex
+again, whatever the image file is called or where it was copied. The image contents are the
+data and the header cards that sex uses (data format, gain, saturation, WCS), so keywords
+added later, e.g. ZMAG by calc-zmag, do not start a new catalog. The parameter key covers the
+config file and the parameter/filter files it names, the -DETECT_THRESH value and the
+sextractor version; editing any of them starts a new set of catalogs.
+
+Images not in the cache are extracted by a pool of nworkers sex processes, in the order given,
+while the caller works on the catalogs already returned:
+
+    sc = SexCache(sex_path, verbose=verbose)
+    for ftsfile, catalog in zip(Ftsfiles, sc.imap(Ftsfiles, detect_threshold)):
+        for row in catalog.tolist(): ...        # one row per detection, columns as in the catalog file
+    catalog = sc.catalog(ftsfile, detect_threshold)   # a single image
+
+A catalog is a 2-d float array (rows = detections, columns in the order of the sextractor
+ASCII_HEAD catalog, names in sc.columns(catalog_key)), or None if sex failed. Image content
+hashes are remembered by path, size and modification time, so an unchanged image is not
+read again to find its key. The cache directory is $SEXCACHE_DIR, default ~/.cache/sexcache;
+it can be deleted at any time.
+'''
+
+from __future__ import print_function
+import os, sys, hashlib, subprocess, sqlite3, tempfile, threading, warnings
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+SEX = 'sex'
+SEX_CONFIG = '/usr/local/sextractor/default.sex'
+CACHE_DIR = os.environ.get('SEXCACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sexcache'))
+FORMAT = 2     # Bump if the stored catalog layout or the image hash changes
+
+# Config keywords naming files that change the catalog contents
+CONFIG_FILES = ['PARAMETERS_NAME', 'FILTER_NAME', 'STARNNW_NAME']
+
+# Header cards that change the catalog: data format, sextractor GAIN_KEY and SATUR_KEY defaults, WCS
+EXTRACTION_KEYS = ('SIMPLE', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'BSCALE', 'BZERO', 'BLANK', 'GAIN', 'SATURATE',
+    'EQUINOX', 'EPOCH', 'RADESYS', 'RADECSYS', 'LONPOLE', 'LATPOLE')
+EXTRACTION_PREFIXES = ('CTYPE', 'CUNIT', 'CRVAL', 'CRPIX', 'CDELT', 'CROTA', 'CD1_', 'CD2_', 'PC1_', 'PC2_', 'PV1_', 'PV2_',
+    'A_', 'B_', 'AP_', 'BP_')
+
+def file_sha1(path, blocksize=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block: break
+            h.update(block)
+    return h.hexdigest()
+
+def image_sha1(path, blocksize=1 << 20):
+    ''' Hash of the primary header cards in EXTRACTION_KEYS (or starting with EXTRACTION_PREFIXES)
+    and of everything after the primary header; the whole file if the header cannot be parsed'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        cards = []
+        while True:
+            block = f.read(2880)
+            if len(block) < 2880:
+                return file_sha1(path, blocksize)      # Not a FITS file, or no END card
+            cards += [block[j:j+80].decode('latin-1') for j in range(0, 2880, 80)]
+            if any(card.rstrip() == 'END' for card in cards[-36:]): break
+        for card in cards:
+            key = card[:8].strip()
+            if key in EXTRACTION_KEYS or key.startswith(EXTRACTION_PREFIXES):
+                h.update((card.rstrip() + '\n').encode('latin-1'))
+        while True:
+            block = f.read(blocksize)
+            if not block: break
+            h.update(block)
+    return h.hexdigest()
+
+def read_catalog(sexname):
+    ''' Parse a sextractor ASCII_HEAD catalog: return (data, columns), data a 2-d float array'''
+    header = []    # (first column, name)
+    with open(sexname, 'r') as fn:
+        for line in fn:
+            if not line.startswith('#'): break
+            words = line.split()
+            if len(words) >= 3: header.append((int(words[1]), words[2]))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')      # Empty catalog
+        data = np.loadtxt(sexname, comments='#', ndmin=2)
+    ncol = data.shape[1] if data.size else (header[-1][0] if header else 0)
+    if data.size == 0:
+        data = np.zeros((0, ncol))
+    # Vector parameters (e.g. FLUX_APER(3)) take several columns but have one header line
+    columns = []
+    for j, (col, name) in enumerate(header):
+        span = (header[j+1][0] if j+1 < len(header) else ncol + 1) - col
+        columns += [name] if span <= 1 else ['%s_%i' % (name, k+1) for k in range(span)]
+    columns += ['COL_%i' % (k+1) for k in range(len(columns), ncol)]
+    return data, columns
+
+class SexCache(object):
+    def __init__(self, config=SEX_CONFIG, sex=SEX, cache_dir=CACHE_DIR, nworkers=None, verbose=False):
+        ''' config: sextractor config file; sex: sextractor command; nworkers: parallel sex
+        processes for cache misses (default: number of CPUs)'''
+        self.config = config
+        self.sex = sex
+        self.cache_dir = cache_dir
+        self.nworkers = nworkers or cpu_count()
+        self.verbose = verbose
+        self.hits = 0 ; self.misses = 0 ; self.failures = 0
+        self.lock = threading.Lock()
+        self._config_key = None
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir): raise
+        # Image hashes of an earlier FORMAT are not reused
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'images%i.sqlite' % FORMAT), timeout=60, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, sha1 TEXT)')
+        self.db.commit()
+
+    def config_key(self):
+        ''' Hash of everything other than the image and threshold that sets the catalog contents'''
+        with self.lock:     # Once, not once per worker thread
+            if self._config_key is None:
+                h = hashlib.sha1(('sexcache %i\n' % FORMAT).encode())
+                h.update(self.sex_version().encode())
+                with open(self.config, 'rb') as f:
+                    text = f.read()
+                h.update(text)
+                # sex looks for named files in the working directory; try the config directory too
+                for line in text.decode('latin-1').splitlines():
+                    words = line.split('#')[0].split()
+                    if len(words) >= 2 and words[0] in CONFIG_FILES:
+                        for path in (words[1], os.path.join(os.path.dirname(self.config), words[1])):
+                            if os.path.isfile(path):
+                                h.update(('%s %s\n' % (words[0], file_sha1(path))).encode())
+                                break
+                self._config_key = h.hexdigest()
+        return self._config_key
+
+    def sex_version(self):
+        try:
+            out = subprocess.Popen([self.sex, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()[0]
+            return out.decode('latin-1').strip()
+        except OSError:
+            return self.sex
+
+    def image_key(self, ftsfile):
+        ''' Hash of the data and extraction header cards of ftsfile (image_sha1), re-read only if
+        its size or modification time changed'''
+        path = os.path.realpath(ftsfile)
+        st = os.stat(path)
+        mtime = int(st.st_mtime * 1e6)
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime, sha1 FROM images WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == mtime:
+            return row[2]
+        sha1 = image_sha1(path)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)', (path, st.st_size, mtime, sha1))
+            self.db.commit()
+        return sha1
+
+    def catalog_key(self, ftsfile, detect_threshold):
+        thresh = '-DETECT_THRESH %.1f' % detect_threshold
+        return hashlib.sha1(('%s %s %s' % (self.image_key(ftsfile), self.config_key(), thresh)).encode()).hexdigest()
+
+    def catalog_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def columns(self, key):
+        with np.load(self.catalog_path(key)) as npz:
+            return [str(x) for x in npz['columns']]
+
+    def catalog(self, ftsfile, detect_threshold):
+        ''' Catalog of ftsfile from the cache, running sextractor if it is not there; None if sex failed'''
+        key = self.catalog_key(ftsfile, detect_threshold)
+        path = self.catalog_path(key)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as npz:
+                    data = npz['data']
+                with self.lock: self.hits += 1
+                if self.verbose: print('Using cached sextractor catalog for %s' % ftsfile)
+                return data
+            except Exception:
+                pass   # Unreadable (e.g. partly written by a killed run): extract again
+        with self.lock: self.misses += 1
+        if self.verbose: print('Running sextractor on %s with detection threshold = %.1f sigma' % (ftsfile, detect_threshold))
+        return self.extract(ftsfile, detect_threshold, path)
+
+    def extract(self, ftsfile, detect_threshold, path):
+        ''' Run sex on ftsfile, store the parsed catalog at path and return it'''
+        fd, sexname = tempfile.mkstemp(suffix='.sexout', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            status = subprocess.call([self.sex, ftsfile, '-c', self.config, '-CATALOG_NAME', sexname,
+                '-DETECT_THRESH', '%.1f' % detect_threshold, '-VERBOSE_TYPE', 'QUIET'])
+            if status != 0 or os.path.getsize(sexname) == 0:
+                raise RuntimeError('sex exit status %i' % status)
+            data, columns = read_catalog(sexname)
+        except Exception as e:
+            with self.lock: self.failures += 1
+            print('Sextractor failed on %s (%s)' % (ftsfile, e), file=sys.stderr)
+            return None
+        finally:
+            os.remove(sexname)
+        # Write under a temporary name and rename, so other processes never see part of a file
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, data=data, columns=np.array(columns))
+        getattr(os, 'replace', os.rename)(tmpname, path)
+        return data
+
+    def imap(self, ftsfiles, detect_threshold):
+        ''' Yield the catalog of each of ftsfiles in order; misses are extracted nworkers at a time'''
+        ftsfiles = list(ftsfiles)
+        pool = ThreadPool(min(self.nworkers, len(ftsfiles))) if len(ftsfiles) > 1 and self.nworkers > 1 else None
+        try:
+            if pool is None:
+                for ftsfile in ftsfiles:
+                    yield self.catalog(ftsfile, detect_threshold)
+            else:
+                for data in pool.imap(lambda ftsfile: self.catalog(ftsfile, detect_threshold), ftsfiles):
+                    yield data
+        finally:
+            if pool is not None: pool.terminate()
+            if self.verbose: print('Sextractor catalogs: %i cached, %i extracted, %i failed' % (self.hits, self.misses - self.failures, self.failures))
@@ -0,0 +1,56 @@
+'''
+Positional cross-matching of star lists, shared by sexphot, find-transients, find-rocks and calc-zmag
+
+Positions are converted to unit vectors and put in a KD-tree (scipy cKDTree), so a match
+of N stars against a list of M stars costs O(N log M) instead of N*M separations. Working
+on the unit sphere takes care of RA wrap-around at 0/360 deg and of the cos(dec) factor;
+separations are true angular distances.
+
+    m = StarMatcher(ra_ref, dec_ref)              # reference list [deg]
+    index, sepn = m.nearest(ra, dec, max_sepn)    # nearest reference star (-1: none within max_sepn)
+    found = m.has_match(ra, dec, max_sepn)        # True where any reference star is within max_sepn
+    lists = m.within(ra, dec, radius)             # indices of all reference stars within radius
+'''
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+def unit_vectors(ra, dec):
+    ''' (N,3) array of unit vectors for ra, dec [deg]'''
+    ra = np.radians(np.asarray(ra, dtype=float)); dec = np.radians(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec*np.cos(ra), cos_dec*np.sin(ra), np.sin(dec)))
+
+def chord(sepn_deg):
+    ''' Straight-line distance between unit vectors separated by sepn_deg'''
+    return 2*np.sin(np.radians(sepn_deg)/2)
+
+def chord_to_deg(d):
+    return np.degrees(2*np.arcsin(np.minimum(np.asarray(d)/2, 1.0)))
+
+class StarMatcher:
+    def __init__(self, ra, dec):
+        ''' Build the search tree for reference positions ra, dec [deg]'''
+        self.n = len(ra)
+        self.tree = cKDTree(unit_vectors(ra, dec)) if self.n > 0 else None
+
+    def nearest(self, ra, dec, max_sepn=180.):
+        ''' For each position return the index of the nearest reference star and its
+            separation [deg]; index is -1 (and separation inf) if none is within max_sepn'''
+        n = len(ra)
+        index = np.full(n, -1); sepn = np.full(n, np.inf)
+        if n == 0 or self.tree is None: return index, sepn
+        d, i = self.tree.query(unit_vectors(ra, dec), distance_upper_bound=chord(max_sepn)*(1 + 1e-12))
+        found = np.isfinite(d)
+        index[found] = i[found]; sepn[found] = chord_to_deg(d[found])
+        return index, sepn
+
+    def has_match(self, ra, dec, max_sepn):
+        ''' Boolean array, True where a reference star lies within max_sepn [deg]'''
+        return self.nearest(ra, dec, max_sepn)[0] >= 0
+
+    def within(self, ra, dec, radius):
+        ''' For each position, the list of indices of all reference stars within radius [deg]'''
+        if len(ra) == 0: return []
+        if self.tree is None: return [[] for x in ra]
+        return self.tree.query_ball_point(unit_vectors(ra, dec), chord(radius))
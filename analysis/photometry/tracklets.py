@@ -0,0 +1,143 @@
+'''
+Linking of moving-object detections across N >= 3 frames into linear tracklets, used by find-rocks
+
+Detections (typically those left after removing stars common to the frames) are projected
+onto a tangent plane about the field center, so RA wrap-around and cos(dec) need no special
+care. A pair of detections in two frames is a seed if the implied rate is below max_rate;
+seeds are found with a KD-tree range search, so the cost grows with the number of
+detections times the number of plausible partners rather than as N^3. Each seed predicts
+where the object should be in the other frames and the nearest detection to the prediction
+is looked up in that frame's KD-tree. Candidates found in enough frames get a least-squares
+linear-motion fit; those with rms residual below tol are tracklets.
+
+    tracks = link(ra, dec, t, max_rate=300/3600.*24, tol=1/3600.)   # lists of per-frame arrays [deg], t [days]
+    for tr in tracks:
+        tr.index        # detection index in each frame (-1: not found)
+        tr.ra_rate      # fitted motion [deg/day], RA on the sky (i.e. times cos dec)
+        tr.residuals    # per-frame residual of the fit [deg] (nan where not found)
+'''
+
+from collections import namedtuple
+import numpy as np
+from scipy.spatial import cKDTree
+from starmatch import unit_vectors
+
+Tracklet = namedtuple('Tracklet', 'index ra dec ra_rate dec_rate rms residuals')
+Tracklet.__doc__ = ''' Linear tracklet: index - detection index per frame (-1 where not found);
+    ra, dec - fitted position at t[0] [deg]; ra_rate, dec_rate - motion on the sky [deg/day];
+    rms - rms residual [deg]; residuals - per-frame residual [deg] (nan where not found)'''
+
+class TangentPlane:
+    ''' Gnomonic projection about a center ra0, dec0 [deg]; plane coordinates in deg'''
+    def __init__(self, ra0, dec0):
+        self.center = unit_vectors([ra0], [dec0])[0]
+        ra0 = np.radians(ra0); dec0 = np.radians(dec0)
+        self.e_ra = np.array([-np.sin(ra0), np.cos(ra0), 0.])
+        self.e_dec = np.array([-np.sin(dec0)*np.cos(ra0), -np.sin(dec0)*np.sin(ra0), np.cos(dec0)])
+
+    def project(self, ra, dec):
+        ''' (N,2) array of plane coordinates [deg]'''
+        v = unit_vectors(ra, dec)
+        w = v @ self.center
+        return np.degrees(np.column_stack((v @ self.e_ra / w, v @ self.e_dec / w)))
+
+    def deproject(self, xy):
+        ''' ra, dec [deg] of plane coordinates xy [deg]'''
+        xy = np.radians(np.atleast_2d(xy))
+        v = self.center + xy[:, :1]*self.e_ra + xy[:, 1:2]*self.e_dec
+        v /= np.linalg.norm(v, axis=1)[:, None]
+        return np.mod(np.degrees(np.arctan2(v[:, 1], v[:, 0])), 360.), np.degrees(np.arcsin(v[:, 2]))
+
+def fit_linear(t, xy, found):
+    ''' Least-squares linear motion for many candidates at once.
+        t: (F,) times; xy: (C,F,2) positions; found: (C,F) bool.
+        Returns positions at t[0] (C,2), rates (C,2) and residuals (C,F) [nan where not found]'''
+    w = found.astype(float)
+    dt = t - t[0]
+    n = w.sum(axis=1); st = w @ dt; stt = w @ dt**2
+    sx = np.einsum('cf,cfk->ck', w, np.nan_to_num(xy))
+    stx = np.einsum('cf,f,cfk->ck', w, dt, np.nan_to_num(xy))
+    det = n*stt - st**2
+    rate = (n[:, None]*stx - st[:, None]*sx)/det[:, None]
+    pos0 = (sx - st[:, None]*rate)/n[:, None]
+    model = pos0[:, None, :] + rate[:, None, :]*dt[None, :, None]
+    residuals = np.where(found, np.hypot(*(xy - model).transpose(2, 0, 1)), np.nan)
+    return pos0, rate, residuals
+
+def link(ra, dec, t, max_rate, tol, min_frames=None, min_rate=0., unique=True):
+    '''
+    Find linear tracklets in detections ra[f], dec[f] [deg] of frames f taken at times t [days]
+    max_rate, min_rate: bounds on the motion [deg/day]
+    tol:        astrometric tolerance [deg]: search radius about the predicted positions
+                and the largest rms residual of an accepted fit
+    min_frames: a tracklet must be detected in at least this many frames (default: all)
+    unique:     each detection is used by at most one tracklet (best fits are kept first)
+    Returns a list of Tracklet, best (smallest rms) first.
+    '''
+    nframes = len(t)
+    t = np.asarray(t, dtype=float)
+    if min_frames is None: min_frames = nframes
+    if nframes < 3 or min_frames < 3 or min_frames > nframes:
+        raise ValueError('need at least 3 frames and 3 <= min_frames <= %i' % nframes)
+    allra = np.concatenate([np.asarray(r, dtype=float) for r in ra])
+    alldec = np.concatenate([np.asarray(d, dtype=float) for d in dec])
+    if len(allra) == 0: return []
+    c = unit_vectors(allra, alldec).mean(axis=0)
+    plane = TangentPlane(np.degrees(np.arctan2(c[1], c[0])), np.degrees(np.arcsin(c[2]/np.linalg.norm(c))))
+    xy = [plane.project(r, d) if len(r) else np.zeros((0, 2)) for r, d in zip(ra, dec)]
+    trees = [cKDTree(p) if len(p) else None for p in xy]
+
+    # Seed pairs (a, b); a tracklet found in min_frames frames has a seed among the
+    # first nframes - min_frames + 2 frames in which it was detected
+    nseed = nframes - min_frames + 2
+    candidates = []
+    for a in range(nseed):
+        for b in range(a + 1, nseed):
+            if trees[a] is None or trees[b] is None: continue
+            dt = t[b] - t[a]
+            near = trees[b].query_ball_point(xy[a], max_rate*abs(dt) + tol)
+            ia = np.repeat(np.arange(len(xy[a])), [len(n) for n in near])
+            if len(ia) == 0: continue
+            ib = np.concatenate(near).astype(int)
+            rate = (xy[b][ib] - xy[a][ia])/dt
+            speed = np.hypot(rate[:, 0], rate[:, 1])
+            keep = (speed <= max_rate) & (speed >= min_rate)
+            ia = ia[keep]; ib = ib[keep]; rate = rate[keep]
+
+            # Predict and look up the other frames; the prediction error grows with
+            # the extrapolation (frac: fractional distance from frame a to frame b)
+            index = np.full((len(ia), nframes), -1)
+            index[:, a] = ia; index[:, b] = ib
+            for f in range(nframes):
+                if f == a or f == b or trees[f] is None: continue
+                frac = (t[f] - t[a])/dt
+                pred = xy[a][ia] + rate*(t[f] - t[a])
+                d, i = trees[f].query(pred, distance_upper_bound=tol*(abs(1 - frac) + abs(frac) + 1))
+                index[np.isfinite(d), f] = i[np.isfinite(d)]
+            candidates.append(index[(index >= 0).sum(axis=1) >= min_frames])
+    if not candidates: return []
+
+    # Fit all candidates at once (a candidate can be seeded by more than one pair)
+    index = np.unique(np.concatenate(candidates), axis=0)
+    if len(index) == 0: return []
+    found = index >= 0
+    pts = np.full(index.shape + (2,), np.nan)
+    for f in range(nframes):
+        pts[found[:, f], f] = xy[f][index[found[:, f], f]]
+    pos0, rate, residuals = fit_linear(t, pts, found)
+    rms = np.sqrt(np.nanmean(residuals**2, axis=1))
+    ok = rms <= tol
+    order = np.argsort(rms[ok])
+    index = index[ok][order]; pos0 = pos0[ok][order]; rate = rate[ok][order]
+    residuals = residuals[ok][order]; rms = rms[ok][order]
+
+    ra0, dec0 = plane.deproject(pos0) if len(pos0) else (np.zeros(0), np.zeros(0))
+    tracks = []
+    used = [np.zeros(len(p), dtype=bool) for p in xy]
+    for k in range(len(index)):
+        if unique:
+            if any(used[f][i] for f, i in enumerate(index[k]) if i >= 0): continue
+            for f, i in enumerate(index[k]):
+                if i >= 0: used[f][i] = True
+        tracks.append(Tracklet(index[k], ra0[k], dec0[k], rate[k, 0], rate[k, 1], rms[k], residuals[k]))
+    return tracks
@@ -0,0 +1,111 @@
+"""
+Benchmark the coordinate conversions in one PinPoint centering attempt.
+
+Compares:
+  - the old sequence: save the solved image to a temporary FITS file, then
+    radec_to_xy() and xy_to_radec(), each opening the file and building a
+    WCS (the image save is simulated by writing a 4096x4096 16-bit image)
+  - building one WCS from the solution keywords held in memory (as read
+    from MaxIm with get_fits_keys(), values given as strings) and
+    converting with it
+
+The in-memory results are checked against the file-based ones, for
+CDELT/CROTA and CD matrix solutions.
+"""
+
+import relimport # Update PYTHONPATH to find iotalib
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from iotalib import astropy_wcs
+
+#### SETTINGS #####################
+
+NUM_ATTEMPTS = 20
+IMAGE_SIZE = 4096
+BINNING = 1
+TARGET_PIXEL = (2048, 2048)
+
+#### END SETTINGS #################
+
+def solved_header(cd_matrix):
+    "Header with a plate solution like the ones PinPoint writes"
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = IMAGE_SIZE
+    header['NAXIS2'] = IMAGE_SIZE
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = 83.8221
+    header['CRVAL2'] = -5.3911
+    header['CRPIX1'] = 2048.5
+    header['CRPIX2'] = 2048.5
+    header['EPOCH'] = 2000.0
+    if cd_matrix:
+        header['CD1_1'] = -1.5e-4
+        header['CD1_2'] = 3.1e-6
+        header['CD2_1'] = -3.0e-6
+        header['CD2_2'] = -1.5e-4
+    else:
+        header['CDELT1'] = -1.5e-4
+        header['CDELT2'] = 1.5e-4
+        header['CROTA1'] = 1.2
+        header['CROTA2'] = 1.2
+    return header
+
+def old_attempt(header, data, tempfilename, target_ra_hrs, target_dec_deg):
+    fits.writeto(tempfilename, data, header, overwrite=True) # observatory.camera.save_image_as_fits()
+    x, y = astropy_wcs.radec_to_xy(tempfilename, str(target_ra_hrs), str(target_dec_deg))
+    ra, dec = astropy_wcs.xy_to_radec(tempfilename, TARGET_PIXEL[0]/float(BINNING), TARGET_PIXEL[1]/float(BINNING))
+    return x, y, ra, dec
+
+def new_attempt(maxim_keys, target_ra_hrs, target_dec_deg):
+    w = astropy_wcs.wcs_from_header(maxim_keys)
+    x, y = astropy_wcs.wcs_radec_to_xy(w, target_ra_hrs, target_dec_deg)
+    ra, dec = astropy_wcs.wcs_xy_to_radec(w, TARGET_PIXEL[0]/float(BINNING), TARGET_PIXEL[1]/float(BINNING))
+    return x, y, ra, dec
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        tempfilename = os.path.join(temp_dir, 'center_pixel.fits')
+        data = np.zeros((IMAGE_SIZE, IMAGE_SIZE), dtype=np.uint16)
+        target_ra_hrs, target_dec_deg = 5.5893, -5.3761
+
+        for cd_matrix in (False, True):
+            header = solved_header(cd_matrix)
+            maxim_keys = dict((key, str(header[key])) for key in astropy_wcs.WCS_KEYWORDS if key in header)
+
+            start = time.time()
+            for i in range(NUM_ATTEMPTS):
+                old = old_attempt(header, data, tempfilename, target_ra_hrs, target_dec_deg)
+            old_secs = (time.time() - start) / NUM_ATTEMPTS
+
+            start = time.time()
+            for i in range(NUM_ATTEMPTS):
+                new = new_attempt(maxim_keys, target_ra_hrs, target_dec_deg)
+            new_secs = (time.time() - start) / NUM_ATTEMPTS
+
+            max_pixel_diff = max(abs(old[0] - new[0]), abs(old[1] - new[1]))
+            max_arcsec_diff = max(abs(old[2] - new[2])*15*3600, abs(old[3] - new[3])*3600)
+            print("%s solution, %d attempts:" % ("CD matrix" if cd_matrix else "CDELT/CROTA", NUM_ATTEMPTS))
+            print("  temp FITS file + 2 WCS builds: %8.2f ms per attempt" % (old_secs*1000))
+            print("  WCS from header in memory:     %8.2f ms per attempt (%.0fx)" % (new_secs*1000, old_secs/new_secs))
+            print("  max difference: %.2e pixels, %.2e arcsec" % (max_pixel_diff, max_arcsec_diff))
+
+        incomplete = dict(maxim_keys)
+        del incomplete['CRVAL1']
+        with_sip = dict(maxim_keys, A_ORDER='2')
+        print("Falls back to the FITS file when keywords are missing: %s, with SIP terms: %s" % (
+            astropy_wcs.wcs_from_header(incomplete) is None, astropy_wcs.wcs_from_header(with_sip) is None))
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
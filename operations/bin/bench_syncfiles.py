@@ -0,0 +1,141 @@
+"""
+Benchmark image transfers from syncfiles, using LocalTransport as the
+archive host: every psftp/plink/pscp session costs SESSION_SECONDS and
+the link is limited to LINK_BYTES_PER_SECOND.
+
+Compares:
+  - the old copy_images(): one pscp session per image, one image at a time
+    (not counting its 60 second sleeps)
+  - TransferEngine with TRANSFER_WORKERS workers and TRANSFER_BATCH_SIZE
+    images per batch
+
+Then checks that an interrupted upload is resumed, that a corrupt partial
+upload is sent again from the start, and that the queue file lets a new
+engine pick up the pending images.
+"""
+
+import relimport # Update PYTHONPATH to find iotalib
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from iotalib import transfer
+
+#### SETTINGS #####################
+
+NUM_IMAGES = 60
+IMAGE_BYTES = 2*1024*1024
+SESSION_SECONDS = 0.5           # Starting pscp/psftp/plink and opening a connection
+LINK_BYTES_PER_SECOND = 20e6
+TRANSFER_WORKERS = 3
+TRANSFER_BATCH_SIZE = 4
+VALID_EXTENSIONS = [".fts", ".fits", ".fit"]
+
+#### END SETTINGS #################
+
+def write_images(image_dir, count):
+    for i in range(count):
+        with open(os.path.join(image_dir, "bench%04d.fts" % i), "wb") as f:
+            f.write(os.urandom(IMAGE_BYTES))
+    # Older than settle_seconds
+    old = time.time() - 60
+    for name in os.listdir(image_dir):
+        os.utime(os.path.join(image_dir, name), (old, old))
+
+def make_engine(work_dir, transport):
+    image_dir = os.path.join(work_dir, "images")
+    return transfer.TransferEngine(
+        transport,
+        transfer.TransferQueue(os.path.join(image_dir, "transfer_queue.json")),
+        image_dir,
+        os.path.join(image_dir, "transferred"),
+        os.path.join(image_dir, "duplicate"),
+        VALID_EXTENSIONS,
+        workers=TRANSFER_WORKERS,
+        batch_size=TRANSFER_BATCH_SIZE
+        )
+
+def legacy_copy(image_dir, transport):
+    "The old copy_images() loop, one session per image; returns seconds"
+    start_time = time.time()
+    for name in sorted(os.listdir(image_dir)):
+        if name.endswith(".fts"):
+            transport.upload([(os.path.join(image_dir, name), name, False)])
+    return time.time() - start_time
+
+def run_engine(engine):
+    "Scan once and transfer until the queue is empty; returns seconds"
+    start_time = time.time()
+    engine.scan()
+    while True:
+        engine.submit_ready()
+        if not engine.busy() and len(engine.queue) == 0:
+            break
+        engine.wait(1.0)
+    return time.time() - start_time
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    work_dir = tempfile.mkdtemp()
+    try:
+        image_dir = os.path.join(work_dir, "images")
+        remote_dir = os.path.join(work_dir, "remote")
+        os.makedirs(image_dir)
+        transport = transfer.LocalTransport(remote_dir, session_seconds=SESSION_SECONDS, bytes_per_second=LINK_BYTES_PER_SECOND)
+
+        write_images(image_dir, NUM_IMAGES)
+        print("%d images of %.1f MB, %.1f s per session, %.0f MB/s link" % (
+            NUM_IMAGES, IMAGE_BYTES/1e6, SESSION_SECONDS, LINK_BYTES_PER_SECOND/1e6))
+        print()
+
+        legacy_seconds = legacy_copy(image_dir, transport)
+        print("Old copy_images(), one pscp per image: %7.1f s (%.1f images/min)" % (
+            legacy_seconds, 60.0*NUM_IMAGES/legacy_seconds))
+        shutil.rmtree(remote_dir)
+
+        # A link shared by several workers is no faster than one worker's link
+        transport.bytes_per_second = LINK_BYTES_PER_SECOND / TRANSFER_WORKERS
+        engine = make_engine(work_dir, transport)
+        engine_seconds = run_engine(engine)
+        print("TransferEngine, %d workers x %d images: %7.1f s (%.1f images/min)" % (
+            TRANSFER_WORKERS, TRANSFER_BATCH_SIZE, engine_seconds, 60.0*NUM_IMAGES/engine_seconds))
+        engine.shutdown()
+        assert len(os.listdir(os.path.join(image_dir, "transferred"))) == NUM_IMAGES
+        assert sorted(os.listdir(remote_dir)) == sorted(os.listdir(os.path.join(image_dir, "transferred")))
+        print()
+
+        # Interrupted and corrupt uploads
+        shutil.rmtree(image_dir)
+        shutil.rmtree(remote_dir)
+        os.makedirs(image_dir)
+        os.makedirs(remote_dir)
+        write_images(image_dir, 2)
+        transport = transfer.LocalTransport(remote_dir)
+        engine = make_engine(work_dir, transport)
+        engine.queue.retry_seconds = 0
+        engine.scan()
+        with open(os.path.join(image_dir, "bench0000.fts"), "rb") as f:
+            data = f.read()
+        with open(os.path.join(remote_dir, "bench0000.fts.part"), "wb") as f:
+            f.write(data[:IMAGE_BYTES//2])   # Upload broke off half way
+        with open(os.path.join(remote_dir, "bench0001.fts.part"), "wb") as f:
+            f.write(b"x" * (IMAGE_BYTES//2)) # Corrupt partial upload
+        for name in ("bench0000.fts", "bench0001.fts"):
+            engine.queue.failed(name, False)  # Next attempt resumes
+
+        # A new engine reads the same queue file
+        engine = make_engine(work_dir, transport)
+        engine.queue.retry_seconds = 0
+        run_engine(engine)
+        engine.shutdown()
+        for name in ("bench0000.fts", "bench0001.fts"):
+            assert transfer.file_md5(os.path.join(remote_dir, name)) == transfer.file_md5(os.path.join(image_dir, "transferred", name))
+        print("Interrupted upload resumed, corrupt upload sent again, queue reloaded: OK")
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
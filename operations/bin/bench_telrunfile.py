@@ -0,0 +1,162 @@
+"""
+Benchmark telrun.sls loading and status updates on a large synthetic file.
+
+Compares:
+  - reading every scan with read_next_sls() (how TelrunFile used to load)
+    against TelrunFile's one-pass index, first access to one scan, and
+    parsing every scan
+  - writing one status code per scan by opening, seeking and writing the
+    file each time (the old update_status_code) against the memory-mapped
+    StatusWriter
+  - status updates made by a second process, read back without reopening
+    the file
+
+The parsed scans are checked against read_next_sls() and the final
+file contents against the per-write version.
+"""
+
+import relimport # Update PYTHONPATH to find iotalib
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from iotalib import telrunfile
+
+#### SETTINGS #####################
+
+NUM_SCANS = 10000
+RANDOM_SEED = 1
+
+#### END SETTINGS #################
+
+KEYS = ['status', 'Start JD', 'lstdelta, mins', 'schedfn', 'title', 'observer', 'comment', 'EDB', 'RAOffset', 'DecOffset',
+    'frame position', 'frame size', 'binning', 'duration, secs', 'shutter', 'ccdcalib', 'filter', 'cmosmode', 'Positioning',
+    'interrupt_allowed', 'priority', 'pathname']
+
+def write_synthetic_sls(path):
+    "Write NUM_SCANS scans in the format schedtel writes"
+    random.seed(RANDOM_SEED)
+    with open(path, "w") as f:
+        for i in range(NUM_SCANS):
+            jd = 2461330.5 + i*60/86400.0
+            vals = ['N',
+                '%13.5f (2026/10/18 00:00:00 UTC)' % jd,
+                '360',
+                'bench.sch',
+                'Target %d' % i,
+                'observer@example.edu',
+                'None',
+                'T%05d,f|M|x,%02d:%02d:00,%+03d:00:00,10.0,2000' % (i, random.randint(0, 23), random.randint(0, 59), random.randint(-30, 80)),
+                '00:00:00.0',
+                '00:00:00.0',
+                '0+0',
+                '4096x4096',
+                '1x1',
+                '%d' % random.randint(10, 300),
+                'Open',
+                'CATALOG',
+                random.choice('RVBI'),
+                '3',
+                random.choice(['None', '2048x2048']),
+                random.choice(['0', '1']),
+                '10',
+                '/usr/local/telescope/user/images/ben%05d.fts' % i]
+            for j in range(22):
+                f.write('%2i %17s: %s\n' % (j, KEYS[j], vals[j]))
+
+def read_all_sls(path):
+    scans = []
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            result, scan, offset = telrunfile.read_next_sls(f)
+            if result == 0:
+                scan.status_offset = offset
+                scans.append(scan)
+            elif result == -2:
+                break
+    return scans
+
+def reopen_and_write(path, scans, code):
+    for scan in scans:
+        f = open(path, "r+")
+        f.seek(scan.status_offset, 0)
+        f.write(code)
+        f.close()
+
+def scan_fields(scan):
+    return (scan.status, scan.starttm, scan.startdt, scan.title, scan.raw_edb, scan.sx, scan.sw, scan.binx,
+        scan.dur, scan.filter, scan.cmosmode, scan.posx, scan.interrupt_allowed, scan.priority,
+        scan.imagedn, scan.imagefn, scan.status_offset)
+
+def timed(func):
+    start_time = time.time()
+    result = func()
+    return result, time.time() - start_time
+
+def child_process(path, first, last):
+    "Run in a separate process: mark scans first..last-1 as done"
+    telrun_file = telrunfile.TelrunFile(path)
+    for i in range(first, last):
+        telrun_file.update_status_code(telrun_file.scans[i], telrunfile.STATUS_DONE)
+    telrun_file.close()
+
+def main():
+    work_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(work_dir, "telrun.sls")
+        write_synthetic_sls(path)
+        print("Synthetic telrun.sls: %d scans, %.1f MB" % (NUM_SCANS, os.path.getsize(path)/1e6))
+        print()
+
+        legacy_scans, legacy_seconds = timed(lambda: read_all_sls(path))
+        print("read_next_sls, all scans:     %7.3f s" % legacy_seconds)
+
+        telrun_file, index_seconds = timed(lambda: telrunfile.TelrunFile(path))
+        print("TelrunFile index:             %7.3f s" % index_seconds)
+        scan, first_seconds = timed(lambda: telrun_file.scans[NUM_SCANS//2])
+        print("  + one scan:                 %7.3f s" % first_seconds)
+        new_scans, all_seconds = timed(lambda: list(telrun_file.scans))
+        print("  + all remaining scans:      %7.3f s" % all_seconds)
+
+        assert len(new_scans) == len(legacy_scans) == NUM_SCANS
+        for (a, b) in zip(legacy_scans, new_scans):
+            assert scan_fields(a) == scan_fields(b), (scan_fields(a), scan_fields(b))
+
+        print()
+        copy_path = os.path.join(work_dir, "telrun_copy.sls")
+        shutil.copy(path, copy_path)
+        _, reopen_seconds = timed(lambda: reopen_and_write(copy_path, legacy_scans, "D"))
+        print("%d status writes, reopening the file:  %7.3f s" % (NUM_SCANS, reopen_seconds))
+
+        def write_all():
+            for scan in new_scans:
+                telrun_file.update_status_code(scan, telrunfile.STATUS_DONE)
+            telrun_file.flush()
+        _, writer_seconds = timed(write_all)
+        print("%d status writes, StatusWriter:        %7.3f s" % (NUM_SCANS, writer_seconds))
+        telrun_file.close()
+
+        with open(path, "rb") as f1, open(copy_path, "rb") as f2:
+            assert f1.read() == f2.read()
+
+        # Let another process update half of the scans while this one has the file open
+        print()
+        write_synthetic_sls(path)
+        telrun_file = telrunfile.TelrunFile(path)
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), "--child", path, "0", str(NUM_SCANS//2)])
+        num_done = sum(1 for i in range(NUM_SCANS) if telrun_file.read_status_code(i) == telrunfile.STATUS_DONE)
+        print("Scans marked done by a second process, seen without reopening: %d of %d" % (num_done, NUM_SCANS//2))
+        telrun_file.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        child_process(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,192 @@
+"""
+Compare telrun's serial and pipelined acquisition modes against simulated
+devices, and estimate how much open-shutter time per night pipelining
+recovers.
+
+Only the part of each scan where the shutter is closed is simulated:
+slew, filter change and focus offset, readout, PinPoint solve, saving the
+frame and adding the FITS headers. Exposures take the same time in both
+modes, so they are left out. Device times are multiplied by TIME_SCALE so
+a run takes well under a minute. The FITS files and headers are real and
+are written by iotalib.telrun_pipeline.ImageWriter, in the foreground
+(serial) or background (pipelined).
+
+For the pipelined run, the estimate telrun logs (from PipelineStats) is
+printed next to the time actually saved.
+"""
+
+import relimport # Update PYTHONPATH to find iotalib
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits as pyfits
+
+from iotalib import telrun_pipeline
+
+#### SETTINGS #####################
+
+NUM_SCANS = 20
+SCANS_PER_NIGHT = 150              # Used to scale the results to a full night
+
+SLEW_SECONDS = (10, 60)            # Random range of slew times (real seconds)
+SAME_TARGET_FRACTION = 0.3         # Fraction of scans that need no slew
+FILTER_SECONDS = (2, 8)            # Random range of filter change + focus offset times
+SETTLE_SECONDS = 2                 # Settle time after each slew
+READOUT_SECONDS = 4                # Camera readout
+SOLVE_SECONDS = (5, 20)            # Random range of PinPoint solve times
+SAVE_SECONDS = 1                   # Maxim save_image_as_fits
+
+TIME_SCALE = 0.02                  # Multiply all device times by this
+IMAGE_SIZE = 1024                  # Size of the simulated frames (pixels per side)
+
+RANDOM_SEED = 1
+
+#### END SETTINGS #################
+
+
+class SimMount:
+    def __init__(self):
+        self.ready_time = 0
+
+    def slew(self, seconds):
+        self.ready_time = time.time() + seconds*TIME_SCALE
+
+    def is_slewing(self):
+        return time.time() < self.ready_time
+
+    def wait(self):
+        while self.is_slewing():
+            time.sleep(0.005)
+
+def sim_sleep(seconds, preslew=None):
+    "Sleep for scaled device time, noting preslew progress as telrun's waits do"
+    end_time = time.time() + seconds*TIME_SCALE
+    while time.time() < end_time:
+        if preslew is not None:
+            preslew.check()
+        time.sleep(0.005)
+
+def make_scans():
+    scans = []
+    for i in range(NUM_SCANS):
+        if i > 0 and random.random() < SAME_TARGET_FRACTION:
+            slew = 0
+        else:
+            slew = random.uniform(*SLEW_SECONDS)
+        scans.append({
+            "index": i,
+            "slew": slew,
+            "filter": random.uniform(*FILTER_SECONDS),
+            "solve": random.uniform(*SOLVE_SECONDS),
+            })
+    return scans
+
+def header_cards(scan):
+    return [("OBJECT", "T%03d" % scan["index"], "Object name"),
+            ("COMMENT", "Simulated scan", None),
+            ("AIRMASS", 1.2, "Kasten-Young airmass computation")]
+
+def save_frame(image_dir, scan, data):
+    "Stand-in for save_image_as_fits: write the raw frame to a .tmp file"
+    final_path = os.path.join(image_dir, "sim%03d.fts" % scan["index"])
+    tmp_path = final_path + ".tmp"
+    pyfits.PrimaryHDU(data).writeto(tmp_path, overwrite=True)
+    sim_sleep(SAVE_SECONDS)
+    return tmp_path, final_path
+
+def position(mount, scan, preslew=None):
+    if scan["slew"] > 0:
+        mount.slew(scan["slew"])
+    sim_sleep(scan["filter"], preslew)
+
+def run_scans(scans, image_dir, pipelined):
+    """
+    Run the closed-shutter part of each scan. Returns (elapsed seconds,
+    PipelineStats, set of scan indices whose frames were completed)
+    """
+    mount = SimMount()
+    writer = telrun_pipeline.ImageWriter(pipelined)
+    stats = telrun_pipeline.PipelineStats(writer)
+    data = np.zeros((IMAGE_SIZE, IMAGE_SIZE), dtype=np.uint16)
+    done = set()
+
+    start_time = time.time()
+    preslew = None
+    for (i, scan) in enumerate(scans):
+        if preslew is not None and preslew.scan is scan:
+            stats.record_preslew(preslew)
+        else:
+            position(mount, scan)
+        preslew = None
+
+        mount.wait()
+        if scan["slew"] > 0:
+            sim_sleep(SETTLE_SECONDS)
+
+        # (exposure)
+        sim_sleep(READOUT_SECONDS)
+
+        # Solve in progress; in pipelined mode start moving to the next scan
+        solve_end_time = time.time() + scan["solve"]*TIME_SCALE
+        if pipelined and i+1 < len(scans):
+            next_scan = scans[i+1]
+            preslew = telrun_pipeline.Preslew(next_scan, mount.is_slewing)
+            position(mount, next_scan, preslew)
+        while time.time() < solve_end_time:
+            if preslew is not None:
+                preslew.check()
+            time.sleep(0.005)
+
+        tmp_path, final_path = save_frame(image_dir, scan, data)
+        writer.submit(tmp_path, final_path, header_cards(scan),
+                lambda success, index=i: success and done.add(index))
+
+    writer.wait_until_idle()
+    return time.time() - start_time, stats, done
+
+def check_frames(image_dir, scans):
+    "Make sure every frame was renamed into place with its headers"
+    for scan in scans:
+        path = os.path.join(image_dir, "sim%03d.fts" % scan["index"])
+        header = pyfits.getheader(path)
+        assert header["OBJECT"] == "T%03d" % scan["index"], path
+    assert not [fn for fn in os.listdir(image_dir) if fn.endswith(".tmp")]
+
+def main():
+    random.seed(RANDOM_SEED)
+    scans = make_scans()
+
+    print("Simulating %d scans (device times x %g)..." % (NUM_SCANS, TIME_SCALE))
+    elapsed = {}
+    for mode in ["serial", "pipelined"]:
+        image_dir = tempfile.mkdtemp()
+        try:
+            (elapsed[mode], stats, done) = run_scans(scans, image_dir, mode == "pipelined")
+            check_frames(image_dir, scans)
+        finally:
+            shutil.rmtree(image_dir)
+        assert len(done) == NUM_SCANS
+
+        print("%-9s closed-shutter time per scan: %.3f s (%.1f s unscaled)" % (
+            mode, elapsed[mode]/NUM_SCANS, elapsed[mode]/NUM_SCANS/TIME_SCALE))
+
+    saved_seconds = elapsed["serial"] - elapsed["pipelined"]
+    estimated_seconds = stats.positioning_seconds + stats.image_writer.write_seconds
+    print()
+    print("Time saved by pipelining: %.3f s measured, %.3f s estimated by PipelineStats" % (
+        saved_seconds, estimated_seconds))
+    print("(%d preslews overlapped %.3f s of positioning; %d images written in the background in %.3f s)" % (
+        stats.preslews, stats.positioning_seconds, stats.image_writer.images_written, stats.image_writer.write_seconds))
+    print()
+    print("Open-shutter time recovered per night of %d scans: %.0f s (%.1f minutes)" % (
+        SCANS_PER_NIGHT,
+        saved_seconds/NUM_SCANS/TIME_SCALE*SCANS_PER_NIGHT,
+        saved_seconds/NUM_SCANS/TIME_SCALE*SCANS_PER_NIGHT/60))
+
+if __name__ == "__main__":
+    main()
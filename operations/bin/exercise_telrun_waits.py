@@ -0,0 +1,164 @@
+"""
+Run telrun's device waits against simulated devices and measure how much time
+each scan loses to waiting overhead, i.e. the time between a device actually
+finishing (slew done, exposure read out, plate solve done) and telrun noticing.
+
+Two wait strategies are compared on the same random sequence of scans:
+  legacy: the fixed time.sleep(0.1) polling loops telrun used to use
+  waiter: iotalib.telrun_wait.Waiter with the intervals configured below
+
+The script also drops a telrun.new file in the middle of an idle wait and
+measures how long each strategy takes to notice it.
+
+No hardware or COM objects are needed; device timings are scaled down so
+a run takes a minute or two.
+"""
+
+import relimport # Update PYTHONPATH to find iotalib
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from iotalib import telrun_wait
+
+#### SETTINGS #####################
+
+NUM_SCANS = 10
+
+SLEW_SECONDS = (0.5, 3.0)          # Random range of simulated slew times
+EXPOSURE_SECONDS = (0.5, 2.0)      # Random range of simulated exposure times
+READOUT_SECONDS = 0.3              # Simulated camera readout after each exposure
+SOLVE_SECONDS = (0.2, 1.0)         # Random range of simulated PinPoint solve times
+
+LEGACY_POLL_SECONDS = 0.1          # time.sleep() used by the old loops
+LEGACY_IDLE_SECONDS = 6            # Idle sleep of the old loops (60 in telrun; scaled down)
+
+SLEW_POLL_SECONDS = 0.05           # Waiter poll intervals to test
+CAMERA_POLL_SECONDS = 0.05
+PINPOINT_POLL_SECONDS = 0.05
+WATCH_FALLBACK_SECONDS = 0.1       # Waiter telrun.new check interval without pywin32
+
+RANDOM_SEED = 1
+
+#### END SETTINGS #################
+
+
+class SimDevice:
+    "A device that becomes ready at a known time"
+    def __init__(self):
+        self.ready_time = 0
+
+    def start(self, seconds):
+        self.ready_time = time.time() + seconds
+
+    def is_ready(self):
+        return time.time() >= self.ready_time
+
+
+def legacy_wait(device):
+    while not device.is_ready():
+        time.sleep(LEGACY_POLL_SECONDS)
+    return time.time() - device.ready_time
+
+def waiter_wait(waiter, device, interval_seconds, name, not_before=None):
+    waiter.wait_for(device.is_ready, interval_seconds, name, not_before=not_before)
+    return time.time() - device.ready_time
+
+def run_scans(mode, scans, waiter):
+    """
+    Simulate slew, exposure and plate solve for each scan.
+    Return a list of per-scan overhead seconds
+    """
+    mount = SimDevice()
+    camera = SimDevice()
+    pinpoint = SimDevice()
+
+    overheads = []
+    for (slew, exposure, solve) in scans:
+        overhead = 0
+
+        mount.start(slew)
+        if mode == "legacy":
+            overhead += legacy_wait(mount)
+        else:
+            overhead += waiter_wait(waiter, mount, SLEW_POLL_SECONDS, "slew")
+
+        camera.start(exposure + READOUT_SECONDS)
+        expected_end_time = time.time() + exposure
+        if mode == "legacy":
+            overhead += legacy_wait(camera)
+        else:
+            overhead += waiter_wait(waiter, camera, CAMERA_POLL_SECONDS, "exposure", not_before=expected_end_time)
+
+        pinpoint.start(solve)
+        if mode == "legacy":
+            overhead += legacy_wait(pinpoint)
+        else:
+            overhead += waiter_wait(waiter, pinpoint, PINPOINT_POLL_SECONDS, "pinpoint")
+
+        overheads.append(overhead)
+    return overheads
+
+def drop_file_later(path, delay_seconds, drop_times):
+    def drop():
+        time.sleep(delay_seconds)
+        open(path, "w").close()
+        drop_times.append(time.time())
+    thread = threading.Thread(target=drop)
+    thread.daemon = True
+    thread.start()
+
+def new_schedule_latency(mode, schedule_dir):
+    "Drop telrun.new partway through an idle wait; return seconds until it is noticed"
+    new_path = os.path.join(schedule_dir, "telrun.new")
+    if os.path.isfile(new_path):
+        os.remove(new_path)
+
+    drop_times = []
+    drop_file_later(new_path, random.uniform(0.5, LEGACY_IDLE_SECONDS - 0.5), drop_times)
+
+    if mode == "legacy":
+        while not os.path.isfile(new_path):
+            time.sleep(LEGACY_IDLE_SECONDS)
+    else:
+        waiter = telrun_wait.Waiter(new_path, WATCH_FALLBACK_SECONDS)
+        waiter.start_watching()
+        while waiter.sleep(LEGACY_IDLE_SECONDS, "idle") != telrun_wait.NEW_SCHEDULE:
+            pass
+
+    latency = time.time() - drop_times[0]
+    os.remove(new_path)
+    return latency
+
+def main():
+    random.seed(RANDOM_SEED)
+    scans = [(random.uniform(*SLEW_SECONDS), random.uniform(*EXPOSURE_SECONDS), random.uniform(*SOLVE_SECONDS))
+        for i in range(NUM_SCANS)]
+
+    print("Simulating %d scans..." % NUM_SCANS)
+    waiter = telrun_wait.Waiter()
+    for mode in ["legacy", "waiter"]:
+        overheads = run_scans(mode, scans, waiter)
+        print("%-7s overhead per scan: mean %.3f s, max %.3f s" % (mode, sum(overheads)/len(overheads), max(overheads)))
+
+    print()
+    print("Polls by the waiter:")
+    for name in sorted(waiter.stats):
+        (count, seconds, polls) = waiter.stats[name]
+        print("  %-9s %3d waits, %5d polls, %.1f s" % (name, count, polls, seconds))
+
+    print()
+    print("Dropping telrun.new during an idle wait...")
+    schedule_dir = tempfile.mkdtemp()
+    try:
+        for mode in ["legacy", "waiter"]:
+            print("%-7s noticed telrun.new after %.3f s" % (mode, new_schedule_latency(mode, schedule_dir)))
+    finally:
+        shutil.rmtree(schedule_dir)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
+"""
+Copy telrun.sls between the telescope computer and the archive host, and
+send new images to the archive host.
+
+Images are sent by an iotalib.transfer.TransferEngine: batches over one
+shared SSH connection from a pool of worker threads, MD5 checked on the
+remote host, with a queue of pending files that survives a restart.
+
+Usage: python syncfiles-new.py [--local DIR]
+  --local DIR: "send" images to the local directory DIR instead of the
+    archive host (for testing)
+"""
+
 import relimport # Set up our path so that iotalib can be found
 
 # Built-in Python imports
+import argparse
 import glob
 import logging
 import os
@@ -13,6 +27,7 @@ from iotalib import config # to get path to config folder
 from iotalib import logutil
 from iotalib import ssh
 from iotalib import paths
+from iotalib import transfer
 
 # Configuration. TODO - move this to a config file
 remote_username = "talon"
@@ -24,6 +39,7 @@ identity_file = paths.config_path("pyscope_chronos.ppk")
 
 pscp_exe = paths.putty_path("pscp.exe")
 plink_exe = paths.putty_path("plink.exe")
+psftp_exe = paths.putty_path("psftp.exe")
 
 local_image_dir = paths.image_dir()
 local_transferred_image_dir = os.path.join(paths.image_dir(), "transferred")
@@ -32,18 +48,64 @@ remote_image_dir = "/usr/local/telescope/user/images"
 
 valid_file_extensions = [".fts", ".fits", ".fit"]
 
+transfer_workers = 3            # Batches sent at once
+transfer_batch_size = 4         # Images per psftp session
+transfer_queue_path = os.path.join(paths.image_dir(), "transfer_queue.json") # Pending images, kept across restarts
+telrun_check_interval_seconds = 30 # Check for a new telrun.sls this often
+rescan_interval_seconds = 60    # Rescan the image directory at least this often (e.g. for retries)
+
 # Keep track of the last time we sent telrun.sls to the remote server
 # so that we don't re-send it too frequently
 last_telrun_send_time = 0
 
 def main():
+    parser = argparse.ArgumentParser(description="Sync telrun.sls and images with the archive host")
+    parser.add_argument("--local", metavar="DIR", help="send images to this local directory instead of the archive host")
+    args = parser.parse_args()
+
+    if args.local is not None:
+        transport = transfer.LocalTransport(args.local)
+    else:
+        transport = transfer.SshTransport(
+            remote_username,
+            remote_host,
+            remote_image_dir,
+            remote_port=remote_port,
+            identity_file=identity_file,
+            sftp_executable=psftp_exe,
+            ssh_executable=plink_exe
+            )
+
+    engine = transfer.TransferEngine(
+        transport,
+        transfer.TransferQueue(transfer_queue_path),
+        local_image_dir,
+        local_transferred_image_dir,
+        local_duplicate_image_dir,
+        valid_file_extensions,
+        workers=transfer_workers,
+        batch_size=transfer_batch_size
+        )
+    transfer.DirectoryWatcher(local_image_dir, engine.notify).start()
+
+    next_telrun_check_time = 0
     while True:
         try:
-            copy_telrun()
-            have_more_images = copy_images(3)
-
-            if not have_more_images:
-                time.sleep(60)
+            if args.local is None and time.time() >= next_telrun_check_time:
+                copy_telrun()
+                next_telrun_check_time = time.time() + telrun_check_interval_seconds
+
+            engine.scan()
+            engine.submit_ready()
+
+            # Sleep until new images land, a batch finishes, an unfinished image
+            # has settled, or it is time to check telrun.sls
+            timeout = rescan_interval_seconds
+            if engine.unsettled > 0:
+                timeout = engine.settle_seconds
+            if args.local is None:
+                timeout = min(timeout, next_telrun_check_time - time.time())
+            engine.wait(timeout)
         except Exception as ex:
             logging.exception("Error!!! Trying to sleep it off...")
             time.sleep(10)
@@ -122,97 +184,6 @@ def copy_telrun():
                 last_telrun_send_time = time.time()
 
 
-def copy_images(max_image_count):
-    """
-    Copy images to remote server.
-    Return after copying max_image_count images (e.g. so that we can 
-    periodically check for a new .sls file)
-
-    Returns True if more images remain to be copied when this function
-    returns, or False if all images have been copied.
-    """
-    
-    files = []
-    
-    for file_or_dir in os.listdir(paths.image_dir()):
-        file_or_dir = os.path.join(paths.image_dir(), file_or_dir)
-        if not os.path.isfile(file_or_dir):
-            continue
-        filepath = file_or_dir
-
-        # Only consider files containing one of the valid file extensions
-        for file_extension in valid_file_extensions:
-            if filepath.endswith(file_extension):
-                files.append(filepath)
-                break
-        
-    num_files = len(files)
-    for i, filepath in enumerate(files):
-        if i >= max_image_count:
-            return True # More images need to be copied, but return for now to check on other things
-
-        logging.info("File %s of %s (%s images remain)", i+1, min(num_files, max_image_count), num_files)
-        
-        logging.info("Copying %s", filepath)
-        
-        filename = os.path.basename(filepath)
-        remote_file = os.path.join(remote_image_dir, filename)
-        scp_return_code = ssh.secure_copy(
-            filepath,
-            remote_username + "@" + remote_host + ":" + remote_file + '.part', 
-            remote_port=remote_port,
-            scp_executable=pscp_exe,
-            identity_file=identity_file
-            )
-
-        if scp_return_code != 0:
-            logging.info("Error transferring image")
-            continue
-        else:
-            logging.info("Renaming remote %s to %s", remote_file + '.part', remote_file)
-            ssh_return_code = ssh.ssh_command(
-                move_command,
-                remote_username,
-                remote_host,
-                remote_port=remote_port,
-                ssh_executable=plink_exe,
-                identity_file=identity_file
-                )
-            if ssh_return_code != 0:
-                logging.info("Remote file NOT renamed successfully")
-        
-        if not os.path.exists(local_transferred_image_dir):
-            logging.info("Creating %s", local_transferred_image_dir)
-            os.makedirs(local_transferred_image_dir)
-
-        if not os.path.exists(local_duplicate_image_dir):
-            logging.info("Creating %s", local_duplicate_image_dir)
-            os.makedirs(local_duplicate_image_dir)
-            
-        dest_filepath_transferred = os.path.join(local_transferred_image_dir, filename)
-        dest_filepath_duplicate = os.path.join(local_duplicate_image_dir, filename)
-        logging.info("local_transferred_image_dir = %s", local_transferred_image_dir)
-        logging.info("local_duplicate_image_dir = %s", local_duplicate_image_dir)
-        logging.info("filepath = %s", filepath)
-        logging.info("filename = %s", filename)
-        logging.info("dest_filepath_transferred = %s", dest_filepath_transferred)
-        logging.info("dest_filepath_duplicate = %s", dest_filepath_duplicate)
-
-        if os.path.exists(dest_filepath_transferred):
-            logging.warn("File %s already exists", dest_filepath_transferred)
-            for i in range(999):
-                dest_filepath_duplicate_unique = dest_filepath_duplicate + "." + str(i)
-                if not os.path.exists(dest_filepath_duplicate_unique):
-                    break
-            logging.warn("Moving to %s", dest_filepath_duplicate_unique)
-            shutil.move(filepath, dest_filepath_duplicate_unique)
-        else:
-            logging.info("Moving to %s", local_transferred_image_dir)
-            shutil.move(filepath, local_transferred_image_dir)
-
-    return False # No more images to copy
-    
-        
 if __name__ == "__main__":
     logutil.setup_log("syncfiles.log")
     main()
@@ -1,6 +1,91 @@
 from astropy import wcs, units as u
 from astropy.coordinates import SkyCoord
 from astropy.io import fits
+import numpy as np
+
+# Header keywords that describe a linear (TAN) plate solution such as the one
+# PinPoint writes. Enough to build the WCS without the image file.
+WCS_KEYWORDS = ['NAXIS1', 'NAXIS2', 'CTYPE1', 'CTYPE2', 'CUNIT1', 'CUNIT2',
+    'CRVAL1', 'CRVAL2', 'CRPIX1', 'CRPIX2', 'CDELT1', 'CDELT2', 'CROTA1', 'CROTA2',
+    'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2', 'PC1_1', 'PC1_2', 'PC2_1', 'PC2_2',
+    'LONPOLE', 'LATPOLE', 'RADESYS', 'EQUINOX', 'EPOCH', 'A_ORDER', 'B_ORDER']
+
+def _header_value(value):
+    # FITS keyword values may come back from MaxIm as strings
+    if not isinstance(value, str):
+        return value
+    value = value.strip().strip("'").strip()
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+def wcs_from_header(header):
+    """
+    Build an astropy WCS from a FITS header, or from a dict of keyword values
+    (e.g. read from the image held by MaxIm, see WCS_KEYWORDS).
+
+    Return None if the keywords do not give a celestial linear plate solution
+    (no solution, or distortion terms that are not in the dict); use the FITS
+    file in that case.
+    """
+
+    if not isinstance(header, fits.Header):
+        values = dict((key, _header_value(value)) for key, value in header.items() if value not in (None, ''))
+        if 'A_ORDER' in values or 'B_ORDER' in values:
+            return None # SIP coefficients are not in WCS_KEYWORDS
+        if not all(key in values for key in ('CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2', 'CRPIX1', 'CRPIX2')):
+            return None
+        header = fits.Header()
+        for key in WCS_KEYWORDS:
+            if key in values and key not in ('A_ORDER', 'B_ORDER'):
+                header[key] = values[key]
+    try:
+        w = wcs.WCS(header, naxis=2)
+    except Exception:
+        return None
+    if not w.has_celestial:
+        return None
+    return w
+
+def wcs_from_file(filename):
+    """
+    Build an astropy WCS from the primary header of a FITS file.
+
+    Raises an exception if there was a problem
+    """
+
+    try:
+        return wcs.WCS(fits.getheader(filename), naxis=2)
+    except Exception as ex:
+        raise Exception("Error reading WCS from '%s': %s" % (filename, ex))
+
+def wcs_xy_to_radec(w, x, y):
+    """
+    Convert (x, y) pixel positions (scalars or arrays) to J2000 RA and Dec
+    with the WCS w, in one call.
+
+    Return a tuple containing (RA in hours, Dec in degrees), scalars or arrays
+    """
+
+    coord = w.pixel_to_world(x, y)
+    return coord.ra.hour, coord.dec.deg
+
+def wcs_radec_to_xy(w, ra_hours, dec_degs):
+    """
+    Convert J2000 RA [hours] and Dec [degrees] (numbers, strings or arrays)
+    to X,Y image pixel positions with the WCS w, in one call.
+
+    Return a tuple containing (x, y), floats for scalar input, otherwise arrays
+    """
+
+    coord = SkyCoord(ra_hours, dec_degs, unit=(u.hourangle, u.deg))
+    pixels = w.world_to_pixel(coord)
+    if np.ndim(pixels[0]) == 0:
+        return float(pixels[0]), float(pixels[1])
+    return np.asarray(pixels[0]), np.asarray(pixels[1])
 
 def xy_to_radec(filename, x, y):
     """
@@ -11,12 +96,8 @@ def xy_to_radec(filename, x, y):
 
     Raises an exception if there was a problem
     """
-    try: 
-        hdulist = fits.open(filename)
-        w = wcs.WCS(hdulist[0].header)
-        coord = w.pixel_to_world(x, y)
-        
-        return coord.ra.hour, coord.dec.deg
+    try:
+        return wcs_xy_to_radec(wcs_from_file(filename), x, y)
     except Exception as ex:
         raise Exception("Error calculating output '%s'" % ex)
 
@@ -30,12 +111,7 @@ def radec_to_xy(filename, ra_hours, dec_degs):
     Raises an exception if there was a problem
     """
 
-    try: 
-        hdulist = fits.open(filename)
-        w = wcs.WCS(hdulist[0].header)
-        coord = SkyCoord(ra_hours, dec_degs, unit=(u.hourangle, u.deg))
-        pixels = w.world_to_pixel(coord)
-
-        return float(pixels[0]), float(pixels[1])
+    try:
+        return wcs_radec_to_xy(wcs_from_file(filename), ra_hours, dec_degs)
     except Exception as ex:
-        raise Exception("Error calculating output '%s'" % ex)
\ No newline at end of file
+        raise Exception("Error calculating output '%s'" % ex)
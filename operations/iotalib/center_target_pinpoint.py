@@ -8,6 +8,7 @@
 # # Patch Notes
 # 31 May 2021 WWG | Notebook version, general cleanup for better compatability with telrun
 # 17 Mar 2022 WWG | Pinpoint used to generate WCS headers instead of old WCS routine
+# 17 Oct 2026 | WCS built once per attempt from the solved header held by MaxIm, temp FITS file only as fallback
 
 from datetime import datetime
 import logging,os,time,tempfile,math
@@ -29,6 +30,25 @@ def parse_filepath_template(template):
     return template
 
 
+# ##### Function to get the WCS of the latest solved image
+# Read the plate solution keywords straight from the image in the camera software,
+# so the image does not have to be written to disk and read back. Falls back to
+# saving a temporary FITS file if the keywords do not give a usable WCS.
+def get_solved_image_wcs():
+    try:
+        header = observatory.camera.get_fits_keys(astropy_wcs.WCS_KEYWORDS)
+        w = astropy_wcs.wcs_from_header(header)
+        if w is not None:
+            return w
+        logging.info('Solved header incomplete in camera software, reading WCS from a temporary FITS file')
+    except Exception as exception:
+        logging.info('Unable to read solved header from camera software (%s), reading WCS from a temporary FITS file' % exception)
+    
+    tempfilename = os.path.join(tempfile.gettempdir(), 'center_pixel.fits')
+    observatory.camera.save_image_as_fits(tempfilename)
+    return astropy_wcs.wcs_from_file(tempfilename)
+
+
 # ##### Main function, default parameters used as standalone
 # Take one or more images at a target, solve with WCS, and tweak the telescope pointing
 # to put a particular RA/Dec near a particular pixel on the CCD.
@@ -118,13 +138,12 @@ def center_coordinates_on_pixel(target_ra_j2k_hrs=0, # ra coordinates of target
             logging.info("Pinpoint error: %s" % exception)
             continue
         
-        tempfilename = os.path.join(tempfile.gettempdir(), 'center_pixel.fits')
-        observatory.camera.save_image_as_fits(tempfilename)
+        solved_wcs = get_solved_image_wcs()
         
-        target_radec_x_pixel,target_radec_y_pixel = astropy_wcs.radec_to_xy(tempfilename, str(target_ra_j2k_hrs),
-                                                        str(target_dec_j2k_deg))
+        target_radec_x_pixel,target_radec_y_pixel = astropy_wcs.wcs_radec_to_xy(solved_wcs, target_ra_j2k_hrs,
+                                                        target_dec_j2k_deg)
         
-        ra_at_target_pixel_j2k_hrs,dec_at_target_pixel_j2k_deg = astropy_wcs.xy_to_radec(tempfilename,
+        ra_at_target_pixel_j2k_hrs,dec_at_target_pixel_j2k_deg = astropy_wcs.wcs_xy_to_radec(solved_wcs,
                                                                     target_pixel_x_unbinned/float(binning),
                                                                     target_pixel_y_unbinned/float(binning))
         
@@ -39,6 +39,13 @@ def read():
     values.require_int("recenter_exposure_binning")
     values.require_bool("recenter_using_sync")
     values.require("recenter_if_returns_true", types.FunctionType)
+    values.require_float("idle_check_interval_seconds", min_value=1)
+    values.require_float("slew_poll_interval_seconds", min_value=0.01)
+    values.require_float("slew_timeout_seconds")
+    values.require_float("camera_poll_interval_seconds", min_value=0.01)
+    values.require_float("pinpoint_poll_interval_seconds", min_value=0.01)
+    values.require_float("pinpoint_timeout_seconds")
+    values.require_bool("pipeline_scans")
 
     valid_config = True
 
@@ -113,6 +113,24 @@ def verify_latest_exposure():
 def save_image_as_fits(filepath):
     _camera.SaveImage(filepath)
 
+def get_fits_keys(keywords):
+    """
+    Return a dict with the values of the FITS keywords in the image currently
+    held by Maxim (e.g. the WCS written by PinPointSolve()), without saving the
+    image to disk. Keywords that are not in the header are left out.
+    """
+
+    image = _camera.Document
+    values = {}
+    for keyword in keywords:
+        try:
+            value = image.GetFITSKey(keyword)
+        except Exception:
+            continue # Keyword not present
+        if value is not None and value != "":
+            values[keyword] = value
+    return values
+
 def get_filter_names():
     """
     Return a tuple containing the string name of each filter in
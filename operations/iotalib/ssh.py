@@ -5,7 +5,9 @@ program that comes with PuTTY
 
 # Built-in Python imports
 import logging
+import os
 import subprocess
+import tempfile
 
 
 def secure_copy(source_file, dest_file, remote_port=22, scp_executable="pscp", password=None, identity_file=None):
@@ -101,6 +103,76 @@ def ssh_command(remote_command, remote_user, remote_host, remote_port=22, ssh_ex
 
     return return_code
 
+def _session_args(executable, remote_port, password, identity_file, share):
+    "Common PuTTY command line arguments for ssh_session(), ssh_command_output() and sftp_batch()"
+    args = [executable, "-C", "-P", str(remote_port)]
+    if password is not None:
+        args += ["-pw", password]
+    if identity_file is not None:
+        args += ["-i", identity_file]
+    if share:
+        args.append("-share")
+    args.append("-batch")
+    return args
+
+def ssh_session(remote_user, remote_host, remote_port=22, ssh_executable="plink", password=None, identity_file=None):
+    """
+    Start a background ssh process that only holds a connection open (no remote
+    command). Later ssh_command_output() and sftp_batch() calls with share=True
+    are multiplexed over this connection (PuTTY connection sharing) instead of
+    each opening and authenticating a new one.
+
+    Returns the subprocess.Popen object; terminate() it to close the connection.
+    """
+    args = _session_args(ssh_executable, remote_port, password, identity_file, True)
+    args += ["-N", remote_user + "@" + remote_host]
+
+    logging.debug("subprocess.Popen(%s)", args)
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def ssh_command_output(remote_command, remote_user, remote_host, remote_port=22, ssh_executable="plink", password=None, identity_file=None, share=False):
+    """
+    Like ssh_command(), but also returns what the remote command printed.
+
+    share: if True, use the shared connection started by ssh_session() if there is one
+
+    Returns (return code, standard output as a string)
+    """
+    args = _session_args(ssh_executable, remote_port, password, identity_file, share)
+    args += [remote_user + "@" + remote_host, remote_command]
+
+    logging.debug("subprocess.run(%s)", args)
+    result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, universal_newlines=True)
+    logging.debug("return code = %s", result.returncode)
+
+    return result.returncode, result.stdout
+
+def sftp_batch(commands, remote_user, remote_host, remote_port=22, sftp_executable="psftp", password=None, identity_file=None, share=False):
+    """
+    Run a list of sftp commands (e.g. "cd /dir", 'put "file" "name"') in a
+    single psftp session. A failed command does not stop the rest of the
+    batch, so callers should check the results themselves.
+
+    share: if True, use the shared connection started by ssh_session() if there is one
+
+    Returns the psftp return code
+    """
+    (fd, batch_path) = tempfile.mkstemp(suffix=".sftp", text=True)
+    try:
+        with os.fdopen(fd, "w") as batch_file:
+            batch_file.write("\n".join(commands) + "\nquit\n")
+
+        args = _session_args(sftp_executable, remote_port, password, identity_file, share)
+        args += ["-be", "-b", batch_path, remote_user + "@" + remote_host]
+
+        logging.debug("subprocess.call(%s) with %d commands", args, len(commands))
+        return_code = subprocess.call(args, stdin=subprocess.DEVNULL)
+        logging.debug("return code = %s", return_code)
+    finally:
+        os.remove(batch_path)
+
+    return return_code
+
 def test():
     logging.basicConfig(level=logging.DEBUG)
 
@@ -11,6 +11,7 @@ import os
 import shutil
 import signal
 import sys
+import threading
 import time
 
 # Third-party imports
@@ -37,9 +38,18 @@ from . import observatory
 from . import paths
 from . import telrunfile
 from . import telrun_gui
+from . import telrun_pipeline
+from . import telrun_plan
 from . import telrun_status
+from . import telrun_wait
 from . import check_roof
 
+waiter = None  # telrun_wait.Waiter used for all timed waits; created by run()
+image_writer = None  # telrun_pipeline.ImageWriter that adds FITS headers to saved frames; created by run()
+pipeline_stats = None  # telrun_pipeline.PipelineStats for the current run through a telrun file
+scan_plan = None  # telrun_plan.TelrunPlan for the loaded telrun file; created by check_telrun_file()
+status_lock = threading.Lock()  # Serializes telrun.sls status updates from the main and image writer threads
+
 def read_configs():
     config_observatory.read()
     config_focus_offsets.read()
@@ -104,6 +114,9 @@ def exit_handler():
         logging.exception("Error stopping focuser during shutdown")
 
 def run():
+    global waiter
+    global image_writer
+
     # email_warnings_thread.start()   -- 6/21/21 WWG - TODO: fix permissions problems
 
     telrun_gui.start_gui_in_thread()
@@ -113,6 +126,13 @@ def run():
     read_configs()
     setup_observatory_connections()
 
+    waiter = telrun_wait.Waiter(paths.telrun_sls_path("telrun.new"))
+    waiter.start_watching()
+
+    image_writer = telrun_pipeline.ImageWriter(config_telrun.values.pipeline_scans)
+    if config_telrun.values.pipeline_scans:
+        logging.info("Pipelined acquisition enabled")
+
     # Verify the overscan region is either on or off
     if (max(observatory.camera.get_ccd_width_pixels(), observatory.camera.get_ccd_height_pixels()) > 
         config_telrun.values.max_camera_dimension): 
@@ -176,18 +196,28 @@ def query_jpl(object_id, id_type = None):
         #print(obj.ephemerides())
         return None
 
+def release_telrun_file(telrun_file):
+    # Close telrun_file (unmapping telrun.sls, so telrun.new can replace it) and return None,
+    # the "no active telrun file" value that main_operation_loop returns once a file is done with
+    if telrun_file is not None:
+        telrun_file.close()
+    return None
+
 def main_operation_loop(telrun_file):
-    if os.path.isfile(paths.telrun_sls_path("telrun.new")):
+    # Returns the telrun file to use on the next pass, or None (after closing it) if it is done with
+    if waiter.new_schedule_pending():
         logging.info("Found telrun.new; renaming to telrun.sls")
+        telrun_file = release_telrun_file(telrun_file) # Release the old telrun.sls so it can be replaced
         shutil.move(paths.telrun_sls_path("telrun.new"), paths.telrun_sls_path("telrun.sls"))
+        waiter.new_schedule_pending() # Reset the wake-up event now that telrun.new is gone
         logging.info("Loading telrun.sls")
         telrun_file = telrunfile.TelrunFile(paths.telrun_sls_path("telrun.sls"))
         check_telrun_file(telrun_file)
 
     if telrun_file is None:
         logging.debug("No active telrun file; sleeping...")
-        time.sleep(60)
-        return   
+        waiter.sleep(config_telrun.values.idle_check_interval_seconds, "telrun file")
+        return None
 
     # Check on roof status    
     if config_telrun.values.check_roof_value:
@@ -200,7 +230,9 @@ def main_operation_loop(telrun_file):
                     logging.info("Roof is not open, waiting...")
             except Exception as ex:
                     logging.exception("Error refreshing roof info")
-            time.sleep(60)
+            if waiter.sleep(config_telrun.values.idle_check_interval_seconds, "roof") == telrun_wait.NEW_SCHEDULE:
+                logging.info("Found telrun.new while waiting for roof")
+                return release_telrun_file(telrun_file)
     '''
     # Wait for CCD temperature regulation
     cooler_warning_sent = False
@@ -234,10 +266,20 @@ def main_operation_loop(telrun_file):
         logging.info("Sun altitude: %.3f degs (above limit of %s)", 
                 observatory.get_sun_altitude_degs(),
                 config_observatory.max_sun_altitude_degs)
-        time.sleep(60)
+        if waiter.sleep(config_telrun.values.idle_check_interval_seconds, "sun") == telrun_wait.NEW_SCHEDULE:
+            logging.info("Found telrun.new while waiting for sunset")
+            return release_telrun_file(telrun_file)
     else:
         logging.info("Sun altitude: %.3f (below limit; starting scans)", observatory.get_sun_altitude_degs())
-        telrun_file_finished = run_scans(telrun_file)
+        try:
+            telrun_file_finished = run_scans(telrun_file)
+        finally:
+            # Frames must be in place and their status codes written
+            # before telrun.sls can be replaced
+            image_writer.wait_until_idle()
+            telrun_file.flush()
+        waiter.log_stats()
+        pipeline_stats.log_stats()
     
     # Check return code from run_scans
     if telrun_file_finished:
@@ -250,12 +292,14 @@ def main_operation_loop(telrun_file):
         parkfunc = observatory.mount.Park
         if hasattr(parkfunc, '__call__'):
             parkfunc()
-        return
+        return release_telrun_file(telrun_file)
     else:
         logging.info("run_scans returned False, new telrun file found!")
-        return
+        return release_telrun_file(telrun_file)
 
 def check_telrun_file(telrun_file):
+    global scan_plan
+
     logging.info("Performing sanity checks on telrun.sls file...")
 
     unique_filenames = {} # Dictionary where key is unique filename and value is 1
@@ -324,6 +368,18 @@ def check_telrun_file(telrun_file):
         logging.info("Pausing for 10 seconds...")
         time.sleep(10)
 
+    # Precompute target and sky positions for the whole night
+    scan_plan = telrun_plan.TelrunPlan(telrun_file.scans)
+    if config_telrun.values.wait_for_scan_start_time:
+        if config_telrun.values.wait_for_sun:
+            max_sun_alt_degs = config_observatory.max_sun_altitude_degs
+        else:
+            max_sun_alt_degs = None
+        num_doomed = scan_plan.flag_doomed_scans(config_observatory.values.min_telescope_altitude_degs, max_sun_alt_degs)
+        if num_doomed > 0:
+            logging.warn("%d scans cannot be observed at their scheduled start time and will be skipped", num_doomed)
+    scan_plan.log_table()
+
 def run_scans(telrun_file):
     """
     Iterate through the scans in a telrun file.
@@ -331,6 +387,9 @@ def run_scans(telrun_file):
     or False if scans were interrupted for some other reason (such as the sun coming up)
     """
 
+    global pipeline_stats
+    pipeline_stats = telrun_pipeline.PipelineStats(image_writer)
+
     # Home the mount if needed
     if config_telrun.values.home_mount_at_start:
         logging.info("Homing mount")
@@ -356,9 +415,11 @@ def run_scans(telrun_file):
     num_scans = len(telrun_file.scans)
     telrun_status.total_scan_count = num_scans
 
+    preslew = None # telrun_pipeline.Preslew started during the previous scan, if any
+
     for scan_index in range(num_scans):
         # Check 1: New telrun file?
-        if os.path.isfile(paths.telrun_sls_path("telrun.new")):
+        if waiter.new_schedule_pending():
             logging.info("Found telrun.new, ending early")
             return False
 
@@ -390,6 +451,15 @@ def run_scans(telrun_file):
         
         # Check 2: Do we ignore the scan time? If not, wait until preslew_wait_seconds before scan to continue
         seconds_until_starttm = scan.starttm - time.time()
+        doomed_reason = scan_plan.doomed_reason(scan)
+        if seconds_until_starttm > 0 and doomed_reason is not None:
+            logging.info("Skipping scan %s (%s) without waiting; at its start time: %s",
+                scan.title,
+                scan.observer,
+                doomed_reason)
+            set_scan_status(telrun_file, scan, "F")
+            telrun_status.skipped_scan_count += 1
+            continue
         if not config_telrun.values.wait_for_scan_start_time:
             logging.info("Ignoring scan start time, starting immediately. Set by config telrun values")
         elif seconds_until_starttm < config_telrun.values.seconds_until_starttm:
@@ -404,12 +474,13 @@ def run_scans(telrun_file):
                 seconds_until_starttm,
                 seconds_until_starttm/3600.0)
             
-        while seconds_until_starttm > config_telrun.values.preslew_wait_seconds and config_telrun.values.wait_for_scan_start_time:
-            time.sleep(0.1)
+        if seconds_until_starttm > config_telrun.values.preslew_wait_seconds and config_telrun.values.wait_for_scan_start_time:
+            if waiter.sleep_until(scan.starttm - config_telrun.values.preslew_wait_seconds, "scan start") == telrun_wait.NEW_SCHEDULE:
+                logging.info("Found telrun.new, ending early")
+                return False
             seconds_until_starttm = scan.starttm - time.time()
-        else:
-            if seconds_until_starttm > 0:
-                logging.info("Scan start time is now %.2f seconds away", seconds_until_starttm)
+        if seconds_until_starttm > 0:
+            logging.info("Scan start time is now %.2f seconds away", seconds_until_starttm)
         
         # Check 3: Roof status
         if config_telrun.values.check_roof_value:
@@ -426,7 +497,7 @@ def run_scans(telrun_file):
                 continue
 
         # Check 4: Solar altitude
-        sun_alt_degs = observatory.get_sun_altitude_degs()
+        sun_alt_degs = scan_plan.sun_altitude_degs()
         logging.info("Sun altitude: %.3f degrees", sun_alt_degs)
         if config_telrun.values.wait_for_sun and sun_alt_degs > config_observatory.max_sun_altitude_degs:
             logging.info("Sun is above limit of %s. Skipping scan...", config_observatory.max_sun_altitude_degs)
@@ -445,12 +516,13 @@ def run_scans(telrun_file):
             telrun_status.autofocus_state = "Idle"
 
         # Check 6: Object altitude
-        scan.obj.compute(observatory.get_site_now())
-        if math.degrees(scan.obj.alt) < config_observatory.values.min_telescope_altitude_degs:
+        position_time = time.time()
+        position = scan_plan.position(scan, position_time)
+        if position.alt_degs < config_observatory.values.min_telescope_altitude_degs:
             logging.info("Skipping scan %s (%s); altitude %s below telescope limit", 
                 scan.title,
                 scan.observer,
-                scan.obj.alt)
+                convert.to_dms(position.alt_degs))
             telrun_status.skipped_scan_count += 1
             set_scan_status(telrun_file, scan, "F")
             continue
@@ -479,14 +551,14 @@ def run_scans(telrun_file):
                 convert.to_dms(convert.rads_to_degs(scan.obj.g_dec))
                 ))'''
             logging.info("Object ra, dec: %s, %s" % (
-                convert.to_dms(convert.rads_to_hours(scan.obj.ra)),
-                convert.to_dms(convert.rads_to_degs(scan.obj.dec))
+                convert.to_dms(position.ra_hours),
+                convert.to_dms(position.dec_degs)
                 ))
         except:
             logging.info("Error while logging debug coordinates. Continuing...")
         
-        target_ra_app_hours = convert.rads_to_hours(scan.obj.g_ra)
-        target_dec_app_degs = convert.rads_to_degs(scan.obj.g_dec)
+        target_ra_app_hours = position.app_ra_hours
+        target_dec_app_degs = position.app_dec_degs
 
         (target_ra_j2000_hours, target_dec_j2000_degs) = convert.jnow_to_j2000(target_ra_app_hours, target_dec_app_degs)
 
@@ -507,12 +579,20 @@ def run_scans(telrun_file):
                 (target_ra_app_hours, target_dec_app_degs) = convert.j2000_to_jnow(target_ra_j2000_hours, target_dec_j2000_degs)
         
         try: 
-            do_slew = (convert.to_dms(convert.rads_to_hours(previous_scan.obj.ra)) != convert.to_dms(convert.rads_to_hours(scan.obj.ra))
-                or convert.to_dms(convert.rads_to_hours(previous_scan.obj.dec)) != convert.to_dms(convert.rads_to_hours(scan.obj.dec))
+            previous_position = scan_plan.position(previous_scan, position_time)
+            do_slew = (convert.to_dms(previous_position.ra_hours) != convert.to_dms(position.ra_hours)
+                or convert.to_dms(previous_position.dec_degs) != convert.to_dms(position.dec_degs)
                 or auto_done or previous_scan.status == telrunfile.STATUS_FAIL)
             logging.info('Initial slew: %s' % str(do_slew))
         except: do_slew = True
 
+        # In pipelined mode, positioning for this scan may already have been
+        # started while the previous frame was being processed
+        preslewed = preslew is not None and preslew.scan is scan and not auto_done
+        if preslewed:
+            pipeline_stats.record_preslew(preslew)
+        preslew = None
+
         centering_result = False
         if scan.posx is not None and scan.posy is not None:
             logging.info("Refining telescope pointing for this scan...")
@@ -548,6 +628,10 @@ def run_scans(telrun_file):
                 logging.info("Recentering failed. Continuing...")
             else:
                 logging.info("Recentering succeeded. Continuing...")
+        elif do_slew and preslewed:
+            logging.info("Slew to J2000 RA %s, Dec %s already started",
+                    convert.to_dms(target_ra_j2000_hours),
+                    convert.to_dms(target_dec_j2000_degs))
         elif do_slew:
             # Normal blind slew
             logging.info("Slewing to J2000 RA %s, Dec %s", 
@@ -581,8 +665,14 @@ def run_scans(telrun_file):
             set_scan_status(telrun_file, scan, "F")
             continue
             
-        while observatory.mount.Slewing:
-                time.sleep(0.1)
+        try:
+            waiter.wait_for(lambda: not observatory.mount.Slewing,
+                    config_telrun.values.slew_poll_interval_seconds, "slew",
+                    deadline=telrun_wait.deadline_after(config_telrun.values.slew_timeout_seconds))
+        except telrun_wait.WaitTimeout as ex:
+            logging.error("%s; skipping scan...", ex)
+            set_scan_status(telrun_file, scan, "F")
+            continue
 
         telrun_status.mount_state = "SETTLING"
         logging.info("Settling for %d seconds", config_observatory.values.settle_time_secs)
@@ -608,27 +698,26 @@ def run_scans(telrun_file):
         seconds_until_starttm = scan.starttm - time.time()
         if seconds_until_starttm > 0 and config_telrun.values.wait_for_scan_start_time:
             logging.info("Waiting %d seconds until start time", seconds_until_starttm)
-            time.sleep(seconds_until_starttm)
+            if waiter.sleep_until(scan.starttm, "scan start") == telrun_wait.NEW_SCHEDULE:
+                logging.info("Found telrun.new, ending early")
+                return False
 
         # Record information that will later be inserted into FITS header
         start_exp_camera_temp = observatory.camera.get_ccd_temperature_celsius()
         start_exp_guider_camera_temp = observatory.camera.get_ccd_guider_temperature_celsius()
-        start_exp_lst_hours = convert.rads_to_hours(observatory.get_site_now().sidereal_time())
-        scan.obj.compute(observatory.get_site_now())
-        start_exp_alt_degs = convert.rads_to_degs(scan.obj.alt)
-        start_exp_azm_degs = convert.rads_to_degs(scan.obj.az)
+        start_exp_position = scan_plan.position(scan)
+        start_exp_lst_hours = start_exp_position.lst_hours
+        start_exp_alt_degs = start_exp_position.alt_degs
+        start_exp_azm_degs = start_exp_position.az_degs
         start_exp_ha_hours = start_exp_lst_hours - target_ra_app_hours
         if start_exp_ha_hours < -12:
             start_exp_ha_hours += 24
         if start_exp_ha_hours > 12:
             start_exp_ha_hours -= 24
-        start_exp_airmass = airmass.compute_airmass(start_exp_alt_degs)
+        start_exp_airmass = start_exp_position.airmass
         start_exp_focuspos = observatory.focuser.Position
-    
-        moon = ephem.Moon()
-        moon.compute(observatory.get_site_now())
-        start_exp_moon_separation_degs = convert.rads_to_degs(ephem.separation((scan.obj.az, scan.obj.alt), (moon.az, moon.alt)))
-        start_exp_moon_phase = moon.phase
+        start_exp_moon_separation_degs = start_exp_position.moon_separation_degs
+        start_exp_moon_phase = start_exp_position.moon_phase
         
         logging.info("Starting %.3f second exposure",
                 scan.dur)
@@ -637,11 +726,13 @@ def run_scans(telrun_file):
         expected_exposure_end_time = time.time() + scan.dur
 
         logging.info("Waiting for image...")
-        while not observatory.camera.is_exposure_finished():
-            if time.time() - expected_exposure_end_time > config_telrun.values.camera_timeout_seconds:
-                raise Exception("Timed out waiting for exposure from camera. Make sure there are no File Open/Save windows open in Maxim DL.")
-
-            time.sleep(0.1)
+        try:
+            waiter.wait_for(observatory.camera.is_exposure_finished,
+                    config_telrun.values.camera_poll_interval_seconds, "exposure",
+                    not_before=expected_exposure_end_time,
+                    deadline=expected_exposure_end_time + config_telrun.values.camera_timeout_seconds)
+        except telrun_wait.WaitTimeout:
+            raise Exception("Timed out waiting for exposure from camera. Make sure there are no File Open/Save windows open in Maxim DL.")
         telrun_status.camera_state = "Idle"
 
         # In some cases when the camera connection has failed, Maxim will not throw an
@@ -651,18 +742,10 @@ def run_scans(telrun_file):
         observatory.camera.verify_latest_exposure()
         
         # check if grism image, if not, run pinpoint solution
-        logging.info("Attempting a plate solve via Pinpoint...")
-        if (observatory.camera.get_filter_names()[observatory.camera.get_active_filter()] != '6'):
+        solve_image = observatory.camera.get_filter_names()[observatory.camera.get_active_filter()] != '6'
+        if solve_image:
+            logging.info("Attempting a plate solve via Pinpoint...")
             observatory.camera.run_pinpoint()
-            try:
-                while observatory.camera.pinpoint_status() == 3:
-                    time.sleep(0.1)
-                if observatory.camera.pinpoint_status() == 2:
-                    logging.info("Pinpoint solution found! Continuing...")
-                else:
-                    logging.info("Pinpoint solution failed, continuing...")
-            except Exception as exception:
-                logging.info("Pinpoint error: %s" % exception)
         
         #Store offset rates for adding to FITS Header before changing 
         RA_rate_offset = observatory.mount.RightAscensionRate / 0.9972695677 
@@ -676,6 +759,23 @@ def run_scans(telrun_file):
             observatory.mount.DeclinationRate = 0
             logging.info("Switching to Sidereal Tracking Rate")
 
+        # Pipelined mode: start moving to the next scan while Maxim solves this frame
+        if image_writer.background:
+            autofocus_due = do_periodic_autofocus and time.time() > next_autofocus_time
+            preslew = start_preslew(telrun_file, scan_index, autofocus_due)
+
+        if solve_image:
+            try:
+                waiter.wait_for(telrun_pipeline.checking_preslew(preslew, lambda: observatory.camera.pinpoint_status() != 3),
+                        config_telrun.values.pinpoint_poll_interval_seconds, "pinpoint",
+                        deadline=telrun_wait.deadline_after(config_telrun.values.pinpoint_timeout_seconds))
+                if observatory.camera.pinpoint_status() == 2:
+                    logging.info("Pinpoint solution found! Continuing...")
+                else:
+                    logging.info("Pinpoint solution failed, continuing...")
+            except Exception as exception:
+                logging.info("Pinpoint error: %s" % exception)
+
         image_file_path_final = os.path.abspath(os.path.join(paths.image_dir(), scan.imagefn))
         image_file_path_tmp = image_file_path_final + ".tmp" # Camera writes raw image to this file (before Talon-style headers have been added)
         #image_file_path_after_headers = image_file_path_final + ".after_headers" # FITS library writes modified image to this file (after Talon-style headers have been added)
@@ -730,73 +830,120 @@ def run_scans(telrun_file):
             wxage = weather_reading.age_seconds()
 
 
-        hdulist = pyfits.open(image_file_path_tmp, mode="update")
-        header = hdulist[0].header
-        header.set("OBJECT", scan.obj.name, "Object name")
-        header.set("TELESCOP", config_observatory.values.telescope_name, "Telescope used to acquire image")
-        header.set("OBSERVER", scan.observer, "Investigator(s)")
-        header.set("OFFSET1", scan.sx, "Camera upper left frame x") # TODO: Is this in binned or unbinned coordinates?
-        header.set("OFFSET2", scan.sy, "Camera upper left frame y") # TODO: Is this in binned or unbinned coordinates?
-        header.set("XFACTOR", scan.binx, "Camera x binning factor")
-        header.set("YFACTOR", scan.biny, "Camera y binning factor")
-        header.set("ORIGIN", config_observatory.values.origin, "")
-        header["COMMENT"] = scan.title
-        header.set("PRIORITY", scan.priority, "Scheduling priority")
-        header.set("CDELT1", cdelt1, "RA step right, degrees/pixel")
-        header.set("CDELT2", cdelt2, "Dec step down, degrees/pixel")
-        header.set("RA", convert.to_dms(tele_ra_j2000_hours), "Nominal center J2000 RA")
-        header.set("DEC", convert.to_dms(tele_dec_j2000_degs), "Nominal center J2000 Dec")
-        header.set("RAEOD", convert.to_dms(tele_ra_app_hours), "Nominal center Apparent RA")
-        header.set("DECEOD", convert.to_dms(tele_dec_app_degs), "Nominal center Apparent Dec")
-        header.set("OBJRA", convert.to_dms(target_ra_j2000_hours), "Target center J2000 RA")
-        header.set("OBJDEC", convert.to_dms(target_dec_j2000_degs), "Target center J2000 Dec")
-        header.set("RARATE", RA_rate_offset, "Mount RA Offset arcsec/sec")
-        header.set("DECRATE", DEC_rate_offset, "Mount DEC Offset arcsec/sec")
-        header.set("EPOCH", 2000, "RA/Dec epoch, years (obsolete)")
-        header.set("EQUINOX", 2000, "RA/Dec equinox, years")
-        header.set("LATITUDE", convert.to_dms(config_observatory.values.latitude_degs), "Site Latitude, degrees +N")
-        header.set("LONGITUD", convert.to_dms(config_observatory.values.longitude_degs), "Site Longitude, degrees +E")
-        header.set("ELEVATIO", convert.to_dms(start_exp_alt_degs), "Degrees above horizon")
-        header.set("AZIMUTH", convert.to_dms(start_exp_azm_degs), "Degrees E of N")
-        header.set("HA", convert.to_dms(start_exp_ha_hours), "Local Hour Angle")
-        header.set("AIRMASS", start_exp_airmass, "Kasten-Young airmass computation")
-        header.set("MOONANGL", start_exp_moon_separation_degs, "Angular separation to Moon, Degrees")
-        header.set("MOONPHAS", start_exp_moon_phase, "Percentage of full moon")
-        header.set("LST", convert.to_dms(start_exp_lst_hours), "Local sidereal time at exposure start")
-        header.set("CAMTEMP", start_exp_camera_temp, "Camera temp, C")
-        header.set("FOCUSPOS", start_exp_focuspos, "Focus position from home, um")
-        header.set("WXTEMP", wxtemp, "Ambient air temp, C")
-        header.set("WXPRES", wxpres, "Atm pressure, mB")
-        header.set("WXWNDSPD", wxwndspd, "Wind speed, kph")
-        header.set("WXWNDDIR", wxwnddir, "Wind dir, degs E of N")
-        header.set("WXHUMID", wxhumid, "Outdoor humidity, percent")
-        header.set("WXAGE", wxage, "Age of weather readings, seconds")
-        header.set("CENTER", centering_result, "Result of recentering attempt")
-
-        hdulist.flush()
-        hdulist.close()
-
-        # Move modified FITS file into final location, replacing any file
-        # that may already be there. By writing to another file and then
-        # renaming it at the last second, we make sure that other processed
-        # (like the file transfer daemon) don't see incomplete, partially-written
-        # files
-        remove_file_if_needed(image_file_path_final)
-        os.rename(image_file_path_tmp, image_file_path_final)
-        logging.info("Final file saved to %s", image_file_path_final)
-
-        set_scan_status(telrun_file, scan, "D")
+        header_cards = [
+            ("OBJECT", scan.obj.name, "Object name"),
+            ("TELESCOP", config_observatory.values.telescope_name, "Telescope used to acquire image"),
+            ("OBSERVER", scan.observer, "Investigator(s)"),
+            ("OFFSET1", scan.sx, "Camera upper left frame x"), # TODO: Is this in binned or unbinned coordinates?
+            ("OFFSET2", scan.sy, "Camera upper left frame y"), # TODO: Is this in binned or unbinned coordinates?
+            ("XFACTOR", scan.binx, "Camera x binning factor"),
+            ("YFACTOR", scan.biny, "Camera y binning factor"),
+            ("ORIGIN", config_observatory.values.origin, ""),
+            ("COMMENT", scan.title, None),
+            ("PRIORITY", scan.priority, "Scheduling priority"),
+            ("CDELT1", cdelt1, "RA step right, degrees/pixel"),
+            ("CDELT2", cdelt2, "Dec step down, degrees/pixel"),
+            ("RA", convert.to_dms(tele_ra_j2000_hours), "Nominal center J2000 RA"),
+            ("DEC", convert.to_dms(tele_dec_j2000_degs), "Nominal center J2000 Dec"),
+            ("RAEOD", convert.to_dms(tele_ra_app_hours), "Nominal center Apparent RA"),
+            ("DECEOD", convert.to_dms(tele_dec_app_degs), "Nominal center Apparent Dec"),
+            ("OBJRA", convert.to_dms(target_ra_j2000_hours), "Target center J2000 RA"),
+            ("OBJDEC", convert.to_dms(target_dec_j2000_degs), "Target center J2000 Dec"),
+            ("RARATE", RA_rate_offset, "Mount RA Offset arcsec/sec"),
+            ("DECRATE", DEC_rate_offset, "Mount DEC Offset arcsec/sec"),
+            ("EPOCH", 2000, "RA/Dec epoch, years (obsolete)"),
+            ("EQUINOX", 2000, "RA/Dec equinox, years"),
+            ("LATITUDE", convert.to_dms(config_observatory.values.latitude_degs), "Site Latitude, degrees +N"),
+            ("LONGITUD", convert.to_dms(config_observatory.values.longitude_degs), "Site Longitude, degrees +E"),
+            ("ELEVATIO", convert.to_dms(start_exp_alt_degs), "Degrees above horizon"),
+            ("AZIMUTH", convert.to_dms(start_exp_azm_degs), "Degrees E of N"),
+            ("HA", convert.to_dms(start_exp_ha_hours), "Local Hour Angle"),
+            ("AIRMASS", start_exp_airmass, "Kasten-Young airmass computation"),
+            ("MOONANGL", start_exp_moon_separation_degs, "Angular separation to Moon, Degrees"),
+            ("MOONPHAS", start_exp_moon_phase, "Percentage of full moon"),
+            ("LST", convert.to_dms(start_exp_lst_hours), "Local sidereal time at exposure start"),
+            ("CAMTEMP", start_exp_camera_temp, "Camera temp, C"),
+            ("FOCUSPOS", start_exp_focuspos, "Focus position from home, um"),
+            ("WXTEMP", wxtemp, "Ambient air temp, C"),
+            ("WXPRES", wxpres, "Atm pressure, mB"),
+            ("WXWNDSPD", wxwndspd, "Wind speed, kph"),
+            ("WXWNDDIR", wxwnddir, "Wind dir, degs E of N"),
+            ("WXHUMID", wxhumid, "Outdoor humidity, percent"),
+            ("WXAGE", wxage, "Age of weather readings, seconds"),
+            ("CENTER", centering_result, "Result of recentering attempt")
+            ]
+
+        # The image writer adds the headers and moves the file into place;
+        # in pipelined mode this happens in the background
+        image_writer.submit(image_file_path_tmp, image_file_path_final, header_cards,
+                lambda success, scan=scan: set_scan_status(telrun_file, scan, "D" if success else "F"))
 
         if scan.filter in ['6', 'W', 'R', 'I']:
             logging.info('Taking flushing images...')
             for i in range(5):
                 observatory.camera.start_exposure(2, False)
-                while not observatory.camera.is_exposure_finished():
-                    time.sleep(0.1)
+                waiter.wait_for(telrun_pipeline.checking_preslew(preslew, observatory.camera.is_exposure_finished),
+                        config_telrun.values.camera_poll_interval_seconds, "flush exposure",
+                        not_before=time.time() + 2)
 
     return True # Full telrun file has been processed
         
 
+def start_preslew(telrun_file, scan_index, autofocus_due):
+    """
+    Pipelined mode: start slewing to the next scan and set its filter and
+    focus offset while the frame from scan_index is still being processed.
+    Return a telrun_pipeline.Preslew, or None if the next scan will be
+    positioned the normal way when its turn comes.
+    """
+
+    scan = telrun_file.scans[scan_index]
+    if not scan.interrupt_allowed:
+        return None
+
+    next_scan = None
+    for candidate in telrun_file.scans[scan_index+1:]:
+        if candidate.status == telrunfile.STATUS_NEW:
+            next_scan = candidate
+            break
+    if next_scan is None:
+        return None
+
+    if autofocus_due and next_scan.interrupt_allowed:
+        return None # Autofocus will move the telescope first
+    if next_scan.posx is not None and next_scan.posy is not None:
+        return None # Recentering does its own slews and exposures
+    if next_scan.comment == "LUNARTRACKINGRATE" or next_scan.comment.lower() == "nonsidereal":
+        return None # Coordinates come from JPL Horizons
+    if (config_telrun.values.wait_for_scan_start_time and
+            next_scan.starttm - time.time() > config_telrun.values.preslew_wait_seconds):
+        return None # Too early to slew
+
+    position_time = time.time()
+    position = scan_plan.position(scan, position_time)
+    next_position = scan_plan.position(next_scan, position_time)
+    if next_position.alt_degs < config_observatory.values.min_telescope_altitude_degs:
+        return None
+
+    same_target = (convert.to_dms(position.ra_hours) == convert.to_dms(next_position.ra_hours)
+        and convert.to_dms(position.dec_degs) == convert.to_dms(next_position.dec_degs))
+
+    if same_target:
+        preslew = telrun_pipeline.Preslew(next_scan, lambda: False)
+    else:
+        target_ra_app_hours = next_position.app_ra_hours
+        target_dec_app_degs = next_position.app_dec_degs
+        logging.info("Preslewing to apparent RA %s, Dec %s for next scan",
+                convert.to_dms(target_ra_app_hours),
+                convert.to_dms(target_dec_app_degs))
+
+        preslew = telrun_pipeline.Preslew(next_scan, lambda: observatory.mount.Slewing)
+        telrun_status.mount_state = "SLEWING"
+        observatory.mount.SlewToCoordinatesAsync(target_ra_app_hours, target_dec_app_degs)
+
+    observatory.set_filter_and_offset_focuser(next_scan.filter)
+    return preslew
+
 def remove_file_if_needed(filepath):
     if os.path.exists(filepath):
         try:
@@ -847,7 +994,8 @@ def set_scan_status(telrun_file, scan, code):
 
     logging.info("Setting status code to '%s'", code)
     try:
-        telrun_file.update_status_code(scan, code)
+        with status_lock:
+            telrun_file.update_status_code(scan, code)
     except Exception as ex:
         logging.warn("Error updating telrun status code: %s", str(ex))
 
@@ -0,0 +1,206 @@
+"""
+Pipelined acquisition for telrun.
+
+In serial mode, everything that follows an exposure (PinPoint solve, saving
+the frame, adding the telrun FITS headers, renaming the file into place,
+flushing images) happens before telrun starts moving to the next scan.
+In pipelined mode the work is overlapped:
+  - An ImageWriter thread adds the FITS headers to each saved frame, renames
+    it into place and updates the scan status in telrun.sls.
+  - While MaxIm is still solving the frame, the main thread starts the slew
+    to the next scan and sets its filter and focus offset (a Preslew).
+
+PinPoint, the mount, the filter wheel and the focuser are COM objects and
+can only be used from the main thread, so only the file work is handed to
+the ImageWriter thread.
+
+PipelineStats adds up how much of each night the overlap saves, i.e. how
+much more time the shutter can be open compared with serial mode.
+"""
+
+# Built-in Python imports
+import logging
+import os
+import queue
+import threading
+import time
+
+# Third-party imports
+from astropy.io import fits as pyfits
+
+class ImageWriter:
+    def __init__(self, background):
+        """
+        background: if True, headers are written by a separate thread and
+          submit() returns immediately. If False, submit() writes the
+          headers before returning (serial mode).
+        """
+        self.background = background
+        self._queue = queue.Queue()
+        self._thread = None
+
+        self.images_written = 0
+        self.write_seconds = 0.0
+
+    def submit(self, tmp_path, final_path, cards, on_done=None):
+        """
+        Add cards to the FITS file at tmp_path and rename it to final_path.
+
+        cards: list of (keyword, value, comment) tuples. A "COMMENT" keyword
+          adds a COMMENT card with the given value.
+        on_done: if given, called as on_done(success) once the file is in
+          place (or writing it has failed)
+
+        In serial mode any error is raised to the caller. In background mode
+        errors are logged and reported through on_done(False).
+        """
+        job = (tmp_path, final_path, cards, on_done)
+        if not self.background:
+            self._write(job)
+            if on_done is not None:
+                on_done(True)
+            return
+
+        if self._thread is None:
+            logging.info("Starting image writer thread")
+            self._thread = threading.Thread(target=self._thread_loop)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(job)
+
+    def pending(self):
+        "Return the number of images waiting to be written"
+        return self._queue.unfinished_tasks
+
+    def wait_until_idle(self):
+        "Block until every submitted image has been written"
+        if self.pending() > 0:
+            logging.info("Waiting for %d image(s) to be written", self.pending())
+        self._queue.join()
+
+    def _thread_loop(self):
+        """
+        Runs in a separate thread, and writes queued images
+        """
+        while True:
+            job = self._queue.get()
+            on_done = job[3]
+            try:
+                self._write(job)
+                success = True
+            except Exception as ex:
+                logging.exception("Error writing FITS headers to %s", job[0])
+                success = False
+
+            try:
+                if on_done is not None:
+                    on_done(success)
+            except Exception as ex:
+                logging.exception("Error updating status of %s", job[1])
+            finally:
+                self._queue.task_done()
+
+    def _write(self, job):
+        (tmp_path, final_path, cards, on_done) = job
+        start_time = time.time()
+
+        hdulist = pyfits.open(tmp_path, mode="update")
+        try:
+            header = hdulist[0].header
+            for (keyword, value, comment) in cards:
+                if keyword == "COMMENT":
+                    header["COMMENT"] = value
+                else:
+                    header.set(keyword, value, comment)
+            hdulist.flush()
+        finally:
+            hdulist.close()
+
+        # Move modified FITS file into final location, replacing any file
+        # that may already be there. By writing to another file and then
+        # renaming it at the last second, we make sure that other processes
+        # (like the file transfer daemon) don't see incomplete, partially-written
+        # files
+        os.replace(tmp_path, final_path)
+        logging.info("Final file saved to %s", final_path)
+
+        self.images_written += 1
+        self.write_seconds += time.time() - start_time
+
+class Preslew:
+    """
+    Positioning (slew, filter, focus offset) for a scan that was started
+    while the previous scan's frame was still being processed
+    """
+    def __init__(self, scan, is_slewing):
+        """
+        scan: the TelrunScan being moved to
+        is_slewing: function returning True while the mount is still moving
+        """
+        self.scan = scan
+        self.is_slewing = is_slewing
+        self.start_time = time.time()
+        self.done_time = None
+
+    def check(self):
+        """
+        Record the time positioning finished, if it has.
+        Call from the main thread whenever convenient (e.g. in the
+        condition of a wait); returns True once positioning is done.
+        """
+        if self.done_time is None and not self.is_slewing():
+            self.done_time = time.time()
+        return self.done_time is not None
+
+def checking_preslew(preslew, condition):
+    """
+    Wrap a wait condition so that each poll also records whether
+    preslew (which may be None) has finished
+    """
+    def wrapped():
+        if preslew is not None:
+            preslew.check()
+        return condition()
+    return wrapped
+
+class PipelineStats:
+    def __init__(self, image_writer):
+        "Collect statistics for one run through a telrun file"
+        self.image_writer = image_writer
+        self.preslews = 0
+        self.positioning_seconds = 0.0
+
+        # Writer totals at the start of the run
+        self._images_written = image_writer.images_written
+        self._write_seconds = image_writer.write_seconds
+
+    def record_preslew(self, preslew):
+        """
+        Call when the main loop reaches the point where serial mode would
+        have started positioning for preslew.scan. The time between the
+        start of the preslew and the earlier of now and the end of
+        positioning is time the shutter can stay open that serial mode
+        would have spent waiting for the mount.
+        """
+        now = time.time()
+        preslew.check()
+        end_time = now
+        if preslew.done_time is not None:
+            end_time = min(end_time, preslew.done_time)
+        self.preslews += 1
+        self.positioning_seconds += max(0, end_time - preslew.start_time)
+
+    def log_stats(self):
+        """
+        Write a summary of the time saved by pipelining to the log.
+        Call after the image writer is idle.
+        """
+        if not self.image_writer.background:
+            return
+        images_written = self.image_writer.images_written - self._images_written
+        write_seconds = self.image_writer.write_seconds - self._write_seconds
+        logging.info("Pipelined acquisition: %d preslews overlapped %.1f seconds of positioning; "
+                "%d images written in the background in %.1f seconds",
+                self.preslews, self.positioning_seconds, images_written, write_seconds)
+        logging.info("Open-shutter time recovered versus serial mode: %.1f seconds",
+                self.positioning_seconds + write_seconds)
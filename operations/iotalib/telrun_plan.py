@@ -0,0 +1,264 @@
+"""
+Load-time visibility and ephemeris table for a telrun file.
+
+When a telrun.sls file is loaded, TelrunPlan computes the position of every
+target, the Sun and the Moon once on a grid of times spanning the night
+(one shared ephem.Observer, one compute per target per node). During the
+run, everything telrun needs at a given moment (target altitude, azimuth
+and apparent coordinates, airmass, LST, Moon separation and phase, Sun
+altitude) is a linear interpolation between two nodes. Times outside the
+grid fall back to an exact ephem computation.
+
+From the same table a compact per-scan summary is made at the scheduled
+start times (altitude, airmass, Moon separation, Sun altitude, slew
+distance from the previous scan). Scans that cannot possibly be observed
+at their scheduled time are flagged so telrun can skip them without
+waiting for their start time.
+"""
+
+# Built-in Python imports
+import logging
+import math
+import time
+
+# Third-party imports
+import ephem
+import numpy as np
+
+# iotalib imports
+from . import airmass
+from . import config_observatory
+from . import convert
+from . import telrunfile
+
+NODE_SECONDS = 120          # Spacing of the interpolation grid
+MARGIN_SECONDS = 3600       # Extend the grid this far before/after the scheduled scans
+MAX_SPAN_SECONDS = 36*3600  # Never build a grid longer than this
+
+# Columns of the per-target tables. Angles that can wrap are unwrapped
+# along the grid before interpolating.
+ALT, AZ, RA, DEC, APP_RA, APP_DEC, MOON_SEP = range(7)
+NUM_TARGET_COLUMNS = 7
+WRAPPED_TARGET_COLUMNS = [AZ, RA, APP_RA]
+
+def unix_to_ephem_date(unix_time):
+    "Convert time.time() style seconds to an ephem.Date"
+    return ephem.Date(unix_time/86400.0 + 25567.5)
+
+def make_site(unix_time):
+    "Return an ephem.Observer at the configured site at the given time (same settings as observatory.get_site_now())"
+    site = ephem.Observer()
+    site.lat = math.radians(config_observatory.values.latitude_degs)
+    site.lon = math.radians(config_observatory.values.longitude_degs)
+    site.date = unix_to_ephem_date(unix_time)
+    return site
+
+class ScanPosition:
+    """
+    Where a target is at a given time, and the sky conditions at that time.
+    Angles are in degrees except for right ascension and LST, which are in hours.
+    """
+    def __init__(self, target_values, lst_hours, sun_alt_degs, moon_phase):
+        self.alt_degs = target_values[ALT]
+        self.az_degs = target_values[AZ] % 360
+        self.ra_hours = (target_values[RA] % 360) / 15.0
+        self.dec_degs = target_values[DEC]
+        self.app_ra_hours = (target_values[APP_RA] % 360) / 15.0
+        self.app_dec_degs = target_values[APP_DEC]
+        self.moon_separation_degs = target_values[MOON_SEP]
+        self.airmass = airmass.compute_airmass(self.alt_degs)
+        self.lst_hours = lst_hours % 24
+        self.sun_alt_degs = sun_alt_degs
+        self.moon_phase = moon_phase
+
+class ScanPlan:
+    "One row of the per-scan summary, computed at the scan's scheduled start time"
+    def __init__(self, scan, position, slew_degs):
+        self.scan = scan
+        self.position = position
+        self.slew_degs = slew_degs
+        self.doomed_reason = None # Set if the scan cannot be observed at its start time
+
+class TelrunPlan:
+    def __init__(self, scans):
+        """
+        scans: list of TelrunScan. Only scans with status N are planned.
+        """
+        start_time = time.time()
+
+        self.target_index = {} # raw EDB line -> row in the target tables
+        self.bodies = []       # ephem body for each row
+        for scan in scans:
+            if scan.status != telrunfile.STATUS_NEW:
+                continue
+            if scan.raw_edb not in self.target_index:
+                self.target_index[scan.raw_edb] = len(self.bodies)
+                self.bodies.append(telrunfile.edb_line_to_body(scan.raw_edb))
+
+        new_scans = [scan for scan in scans if scan.status == telrunfile.STATUS_NEW]
+        if len(new_scans) > 0:
+            first_time = min(scan.starttm for scan in new_scans) - MARGIN_SECONDS
+            last_time = max(scan.starttm + scan.dur for scan in new_scans) + MARGIN_SECONDS
+            last_time = min(last_time, first_time + MAX_SPAN_SECONDS)
+            num_nodes = int(math.ceil((last_time - first_time) / NODE_SECONDS)) + 1
+            self.node_times = first_time + NODE_SECONDS*np.arange(num_nodes)
+        else:
+            self.node_times = np.zeros(0)
+
+        self._compute_nodes()
+
+        self.rows = []
+        self._row_by_scan = {} # id(scan) -> ScanPlan
+        previous_position = None
+        for scan in new_scans:
+            position = self.position(scan, scan.starttm)
+            if previous_position is None:
+                slew_degs = None
+            else:
+                slew_degs = math.degrees(ephem.separation(
+                    (math.radians(previous_position.ra_hours*15), math.radians(previous_position.dec_degs)),
+                    (math.radians(position.ra_hours*15), math.radians(position.dec_degs))))
+            row = ScanPlan(scan, position, slew_degs)
+            self.rows.append(row)
+            self._row_by_scan[id(scan)] = row
+            previous_position = position
+
+        logging.info("Planned %d scans (%d targets, %d nodes) in %.2f seconds",
+                len(self.rows), len(self.bodies), len(self.node_times), time.time() - start_time)
+
+    def _compute_nodes(self):
+        num_nodes = len(self.node_times)
+        self.targets = np.zeros((len(self.bodies), num_nodes, NUM_TARGET_COLUMNS))
+        self.lst = np.zeros(num_nodes)
+        self.sun_alt = np.zeros(num_nodes)
+        self.moon_phase = np.zeros(num_nodes)
+
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        for (n, node_time) in enumerate(self.node_times):
+            site = make_site(node_time)
+            sun.compute(site)
+            moon.compute(site)
+            self.lst[n] = convert.rads_to_hours(site.sidereal_time())
+            self.sun_alt[n] = math.degrees(sun.alt)
+            self.moon_phase[n] = moon.phase
+            for (i, body) in enumerate(self.bodies):
+                self.targets[i, n] = self._target_values(body, site, moon)
+
+        # Unwrap angles so neighbouring nodes never straddle 0/360 (or 0/24 h)
+        if num_nodes > 1:
+            self.lst = np.degrees(np.unwrap(np.radians(self.lst*15))) / 15
+            for column in WRAPPED_TARGET_COLUMNS:
+                self.targets[:, :, column] = np.degrees(np.unwrap(np.radians(self.targets[:, :, column]), axis=1))
+
+    def _target_values(self, body, site, moon):
+        body.compute(site)
+        values = np.zeros(NUM_TARGET_COLUMNS)
+        values[ALT] = math.degrees(body.alt)
+        values[AZ] = math.degrees(body.az)
+        values[RA] = math.degrees(body.ra)
+        values[DEC] = math.degrees(body.dec)
+        values[APP_RA] = math.degrees(body.g_ra)
+        values[APP_DEC] = math.degrees(body.g_dec)
+        values[MOON_SEP] = math.degrees(ephem.separation((body.az, body.alt), (moon.az, moon.alt)))
+        return values
+
+    def _node(self, unix_time):
+        """
+        Return (n, fraction) such that unix_time lies fraction of the way
+        from node n to node n+1, or None if unix_time is outside the grid
+        """
+        if len(self.node_times) < 2:
+            return None
+        if unix_time < self.node_times[0] or unix_time >= self.node_times[-1]:
+            return None
+        n = int((unix_time - self.node_times[0]) // NODE_SECONDS)
+        return (n, (unix_time - self.node_times[n]) / NODE_SECONDS)
+
+    def position(self, scan, unix_time=None):
+        """
+        Return a ScanPosition for the scan's target at unix_time (default: now)
+        """
+        if unix_time is None:
+            unix_time = time.time()
+
+        i = self.target_index.get(scan.raw_edb)
+        node = self._node(unix_time)
+        if i is None or node is None:
+            return self._exact_position(scan, unix_time)
+
+        (n, f) = node
+        target_values = self.targets[i, n] + f*(self.targets[i, n+1] - self.targets[i, n])
+        return ScanPosition(target_values,
+                self.lst[n] + f*(self.lst[n+1] - self.lst[n]),
+                self.sun_alt[n] + f*(self.sun_alt[n+1] - self.sun_alt[n]),
+                self.moon_phase[n] + f*(self.moon_phase[n+1] - self.moon_phase[n]))
+
+    def sun_altitude_degs(self, unix_time=None):
+        "Return the Sun's altitude at unix_time (default: now)"
+        if unix_time is None:
+            unix_time = time.time()
+
+        node = self._node(unix_time)
+        if node is None:
+            sun = ephem.Sun()
+            sun.compute(make_site(unix_time))
+            return math.degrees(sun.alt)
+
+        (n, f) = node
+        return self.sun_alt[n] + f*(self.sun_alt[n+1] - self.sun_alt[n])
+
+    def _exact_position(self, scan, unix_time):
+        site = make_site(unix_time)
+        sun = ephem.Sun()
+        sun.compute(site)
+        moon = ephem.Moon()
+        moon.compute(site)
+        target_values = self._target_values(scan.obj, site, moon)
+        return ScanPosition(target_values,
+                convert.rads_to_hours(site.sidereal_time()),
+                math.degrees(sun.alt),
+                moon.phase)
+
+    def flag_doomed_scans(self, min_alt_degs, max_sun_alt_degs=None):
+        """
+        Mark scans that cannot be observed at their scheduled start time:
+        the target is below min_alt_degs, or (if max_sun_alt_degs is given)
+        the Sun is above max_sun_alt_degs. Returns the number of doomed scans.
+        """
+        num_doomed = 0
+        for row in self.rows:
+            row.doomed_reason = None
+            if row.position.alt_degs < min_alt_degs:
+                row.doomed_reason = "altitude %.1f below telescope limit" % row.position.alt_degs
+            elif max_sun_alt_degs is not None and row.position.sun_alt_degs > max_sun_alt_degs:
+                row.doomed_reason = "sun altitude %.1f above limit" % row.position.sun_alt_degs
+            if row.doomed_reason is not None:
+                num_doomed += 1
+        return num_doomed
+
+    def doomed_reason(self, scan):
+        "Return why scan cannot be observed at its start time, or None"
+        row = self._row_by_scan.get(id(scan))
+        if row is None:
+            return None
+        return row.doomed_reason
+
+    def log_table(self):
+        "Write the per-scan summary to the log"
+        logging.info("%-20s %-19s %6s %7s %7s %7s %7s  %s",
+                "Image", "Start (UTC)", "Alt", "Airmass", "MoonSep", "SunAlt", "Slew", "")
+        for row in self.rows:
+            if row.slew_degs is None:
+                slew_str = "-"
+            else:
+                slew_str = "%.1f" % row.slew_degs
+            logging.info("%-20s %-19s %6.1f %7.2f %7.1f %7.1f %7s  %s",
+                    row.scan.imagefn,
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(row.scan.starttm)),
+                    row.position.alt_degs,
+                    row.position.airmass,
+                    row.position.moon_separation_degs,
+                    row.position.sun_alt_degs,
+                    slew_str,
+                    row.doomed_reason or "")
@@ -0,0 +1,191 @@
+"""
+Timed and event-driven waits for telrun.
+
+Every wait in the telrun main loop (scan start times, roof and sun checks,
+mount slews, camera exposures, PinPoint solves) goes through a single
+Waiter. A wait sleeps until the earliest of:
+  - the requested wake-up time,
+  - the next poll of a device condition (each wait has its own interval),
+  - a deadline, after which WaitTimeout is raised,
+  - the arrival of a new telrun.new schedule (preemptible waits only).
+
+A background thread watches the schedules directory for telrun.new, using
+Windows change notifications when pywin32 is available and a 1 second
+stat() loop otherwise, so a new schedule interrupts a 60 second roof or
+sun wait immediately instead of at the end of the sleep.
+
+Device conditions are always polled from the calling thread, since the
+ASCOM and MaxIm COM objects cannot be shared with other threads.
+"""
+
+# Built-in Python imports
+import logging
+import os
+import threading
+import time
+
+# Wait results
+READY = "ready"                 # Condition met / wake-up time reached
+NEW_SCHEDULE = "new_schedule"   # Preempted by telrun.new
+
+class WaitTimeout(Exception):
+    "Raised when a device condition is still not met at its deadline"
+    pass
+
+class Waiter:
+    def __init__(self, new_schedule_path=None, fallback_interval_seconds=1.0):
+        """
+        new_schedule_path: path to telrun.new. Preemptible waits return
+          NEW_SCHEDULE as soon as this file exists.
+        fallback_interval_seconds: how often to stat() for the file if
+          Windows change notifications are not available
+        """
+        self.new_schedule_path = new_schedule_path
+        self.fallback_interval_seconds = fallback_interval_seconds
+        self._wakeup = threading.Event()
+
+        # Per-wait-name statistics: name -> [number of waits, seconds waited, polls]
+        self.stats = {}
+
+    def start_watching(self):
+        "Launch the thread that watches for telrun.new"
+        if self.new_schedule_path is None:
+            return
+
+        logging.info("Watching for %s", self.new_schedule_path)
+        thread = threading.Thread(target=self._watch_loop)
+        thread.daemon = True
+        thread.start()
+
+    def new_schedule_pending(self):
+        "Return True if a telrun.new file is waiting to be loaded"
+        if self.new_schedule_path is not None and os.path.isfile(self.new_schedule_path):
+            self._wakeup.set()
+            return True
+        self._wakeup.clear()
+        return False
+
+    def notify(self):
+        "Wake up any preemptible wait (e.g. from a file notification)"
+        self._wakeup.set()
+
+    def sleep_until(self, wake_time, name="sleep", preempt=True):
+        """
+        Sleep until time.time() >= wake_time.
+        Returns READY, or NEW_SCHEDULE if preempt is True and telrun.new arrived first.
+        """
+        start_time = time.time()
+        try:
+            return self._sleep_until(wake_time, preempt)
+        finally:
+            self._record(name, time.time() - start_time, 0)
+
+    def sleep(self, seconds, name="sleep", preempt=True):
+        "Sleep for the given number of seconds; see sleep_until()"
+        return self.sleep_until(time.time() + seconds, name, preempt)
+
+    def wait_for(self, condition, interval_seconds, name="wait", not_before=None, deadline=None, preempt=False):
+        """
+        Poll condition() every interval_seconds until it returns True.
+
+        not_before: if given, do not start polling until this time (e.g. the
+          expected end of an exposure)
+        deadline: if given, raise WaitTimeout if the condition is still False
+          at this time
+        preempt: if True, return NEW_SCHEDULE as soon as telrun.new arrives
+
+        Returns READY or NEW_SCHEDULE.
+        """
+        start_time = time.time()
+        polls = 0
+        try:
+            if not_before is not None:
+                if self._sleep_until(not_before, preempt) == NEW_SCHEDULE:
+                    return NEW_SCHEDULE
+
+            while True:
+                polls += 1
+                if condition():
+                    return READY
+                if preempt and self.new_schedule_pending():
+                    return NEW_SCHEDULE
+
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    raise WaitTimeout("Timed out after %.1f seconds waiting for %s" % (now - start_time, name))
+
+                next_poll = now + interval_seconds
+                if deadline is not None:
+                    next_poll = min(next_poll, deadline)
+                self._sleep(next_poll - now, preempt)
+        finally:
+            self._record(name, time.time() - start_time, polls)
+
+    def log_stats(self):
+        "Write a summary of time spent in each kind of wait to the log"
+        for name in sorted(self.stats):
+            (count, seconds, polls) = self.stats[name]
+            logging.info("Waits for %s: %d waits, %.1f seconds, %d polls", name, count, seconds, polls)
+
+    def _sleep_until(self, wake_time, preempt):
+        while True:
+            if preempt and self.new_schedule_pending():
+                return NEW_SCHEDULE
+            remaining = wake_time - time.time()
+            if remaining <= 0:
+                return READY
+            self._sleep(remaining, preempt)
+
+    def _sleep(self, seconds, preempt):
+        if seconds <= 0:
+            return
+        if preempt:
+            self._wakeup.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _record(self, name, seconds, polls):
+        entry = self.stats.setdefault(name, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += polls
+
+    def _watch_loop(self):
+        """
+        Runs in a separate thread, and wakes up any preemptible wait when
+        telrun.new appears
+        """
+        watch_dir = os.path.dirname(os.path.abspath(self.new_schedule_path))
+
+        try:
+            import win32con
+            import win32event
+            import win32file
+            handle = win32file.FindFirstChangeNotification(watch_dir, False,
+                win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        except Exception as ex:
+            logging.info("Directory change notifications not available (%s); checking for %s every %.1f seconds",
+                ex, self.new_schedule_path, self.fallback_interval_seconds)
+            handle = None
+
+        while True:
+            try:
+                if os.path.isfile(self.new_schedule_path):
+                    self._wakeup.set()
+
+                if handle is None:
+                    time.sleep(self.fallback_interval_seconds)
+                else:
+                    # Time out occasionally anyway, in case a notification is missed
+                    result = win32event.WaitForSingleObject(handle, int(self.fallback_interval_seconds*1000))
+                    if result == win32event.WAIT_OBJECT_0:
+                        win32file.FindNextChangeNotification(handle)
+            except Exception as ex:
+                logging.exception("Error watching for %s", self.new_schedule_path)
+                time.sleep(self.fallback_interval_seconds)
+
+def deadline_after(timeout_seconds):
+    "Return the deadline for a wait of timeout_seconds, or None (no deadline) if timeout_seconds <= 0"
+    if timeout_seconds <= 0:
+        return None
+    return time.time() + timeout_seconds
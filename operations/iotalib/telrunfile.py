@@ -4,8 +4,11 @@ Routines for parsing telrun.sls files
 
 import logging
 import math
+import mmap
 import os
 import re
+import threading
+import time
 
 import ephem
 
@@ -67,6 +70,8 @@ class CCDCalib(object):
     The CCDCalib struct, from libmisc/scan.h
     """
 
+    __slots__ = ("newc", "data")
+
     def __init__(self):
         self.newc = CT_NONE # Which new cal files to take, if any (one of the CT_* constants)
         self.data = CD_NONE # How to process new data, if any (one of the CD_* constants)
@@ -76,6 +81,14 @@ class TelrunScan(object):
     Represent a single entry (called a "Scan" in Talon) in a telrun file.
     """
 
+    # A telrun file can hold thousands of scans, so don't give each one a __dict__
+    __slots__ = ("schedfn", "imagefn", "imagedn",
+        "comment", "title", "observer", "obj", "raw_edb", "rao", "deco", "extcmd",
+        "ccdcalib", "cmosmode", "sx", "sy", "sw", "sh", "binx", "biny", "posx", "posy",
+        "interrupt_allowed", "dur", "shutter", "filter",
+        "priority", "running", "starttm", "startdt", "status",
+        "status_offset")
+
     def __init__(self):
         # Set up the fields found in a Scan.
         # Mirrors the layout of the Scan struct (from libmisc/scan.h)
@@ -90,6 +103,7 @@ class TelrunScan(object):
         self.title = ""    # TITLE header
         self.observer = "" # OBSERVER header
         self.obj = None    # definition of the target object, read from the DB line (an instance of ephem.Body)
+        self.raw_edb = ""   # the DB line itself
         self.rao = 0        # additional ra offset, in rads
         self.deco = 0       # additional dec offset, in rads
         self.extcmd = ""    # open-ended extension hook that changes the ext. stuff more
@@ -160,34 +174,425 @@ class TelrunScan(object):
         return result
 
 class TelrunFile(object):
-    def __init__(self, filename):
-        self.filename = filename
-        self.scans = []
+    """
+    A telrun.sls file.
 
-        f = open(filename, "r", encoding='utf-8')
+    Opening the file makes one pass over it to build a byte-offset index
+    of the scans it contains; the body of a scan is only parsed the first
+    time it is accessed through self.scans. Status codes are written back
+    through a StatusWriter that keeps the file mapped for as long as the
+    TelrunFile is open. Call close() before the file is replaced or removed.
+    """
 
-        while True:
-            result, scan, offset = read_next_sls(f)
-            if result == 0:
-                scan.status_offset = offset
-                self.scans.append(scan)
-            elif result == -2:
-                break
-            else:
-                logger.warn("Error parsing complete SLS file")
-                break
+    def __init__(self, filename, flush_interval_seconds=5.0):
+        self.filename = filename
+        self.writer = StatusWriter(filename, flush_interval_seconds)
 
-        f.close()
+        # One (start, end, status_offset) entry per complete scan
+        self.index = index_sls(self.writer.data())
+        self.scans = ScanList(self)
+
+        num_skipped = len(STATUS_LINE_PATTERN.findall(self.writer.data())) - len(self.index)
+        if num_skipped > 0:
+            logger.warn("Skipped %d incomplete scans or scans with a bad status code in %s", num_skipped, filename)
 
         logger.info("Read %d scans from %s", len(self.scans), filename)
 
+    def parse_scan(self, scan_index):
+        """
+        Parse the scan at position scan_index of the index and return it as
+        a TelrunScan. A scan with an invalid field is logged and returned with
+        status STATUS_FAIL, so that it is never run.
+        """
+        (start, end, status_offset) = self.index[scan_index]
+        text = bytes(self.writer.data()[start:end]).decode("utf-8", errors="replace")
+
+        # Line values, in order, with comments and line numbers stripped off
+        values = []
+        for line in text.splitlines():
+            if not (line.startswith(COMMENT1) or line.startswith(COMMENT2)):
+                values.append(line[FIRSTCOL:])
+
+        sp = TelrunScan()
+        sp.status = values[0]
+        sp.status_offset = status_offset
+        try:
+            for lineno in range(1, LASTLINE+1):
+                FIELD_PARSERS[lineno](sp, values[lineno])
+        except ValueError as ex:
+            logger.warn("Scan %d of %s: %s; scan will be skipped", scan_index+1, self.filename, ex)
+            sp.status = STATUS_FAIL
+            if sp.obj is None:
+                sp.obj = ephem.FixedBody()
+                sp.obj.name = sp.raw_edb.split(",")[0]
+        return sp
+
+    def read_status_code(self, scan_index):
+        """
+        Return the status code currently in the file for the scan at
+        scan_index, which may have been changed by another process. Does
+        not require the scan to be parsed.
+        """
+        offset = self.index[scan_index][2]
+        return bytes(self.writer.data()[offset:offset+1]).decode("ascii")
+
     def update_status_code(self, scan, code):
         scan.status = code
-        f = open(self.filename, "r+")
-        f.seek(scan.status_offset, 0)
-        f.write(code[0])
-        f.close()
+        self.writer.write(scan.status_offset, code[0])
+
+    def flush(self):
+        "Make sure all status updates are on disk"
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+class ScanList(object):
+    """
+    Read-only list of the TelrunScans in a TelrunFile, parsed on first access
+    """
+
+    def __init__(self, telrun_file):
+        self.telrun_file = telrun_file
+        self._scans = [None] * len(telrun_file.index)
+
+    def __len__(self):
+        return len(self._scans)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self._scans)))]
+
+        scan = self._scans[key]
+        if scan is None:
+            if key < 0:
+                key += len(self._scans)
+            scan = self.telrun_file.parse_scan(key)
+            self._scans[key] = scan
+        return scan
+
+    def __iter__(self):
+        for i in range(len(self._scans)):
+            yield self[i]
+
+class StatusWriter(object):
+    """
+    Writes status codes into a telrun file.
 
+    The file is opened once and memory-mapped, so an update is a single byte
+    store into the shared mapping: other processes that read the file see it
+    at once, without the file being reopened for each scan. The mapping is
+    flushed to disk at most every flush_interval_seconds, and by flush()
+    and close(). If the file cannot be mapped (e.g. it is empty), writes go
+    through the open file handle instead.
+
+    A writer can be shared by several threads.
+    """
+
+    def __init__(self, filename, flush_interval_seconds=5.0):
+        self.filename = filename
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._last_flush_time = time.time()
+        self._dirty = False
+
+        try:
+            self._file = open(filename, "r+b")
+            self.writable = True
+        except PermissionError:
+            self._file = open(filename, "rb")
+            self.writable = False
+
+        try:
+            if self.writable:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE)
+            else:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            self._map = None
+
+    def data(self):
+        "Return the contents of the file, as a memory map or bytes"
+        if self._map is not None:
+            return self._map
+        with self._lock:
+            self._file.seek(0)
+            return self._file.read()
+
+    def write(self, offset, code):
+        if not self.writable:
+            raise IOError("%s is read-only" % self.filename)
+
+        with self._lock:
+            if self._map is not None:
+                self._map[offset:offset+1] = code.encode("ascii")
+            else:
+                self._file.seek(offset)
+                self._file.write(code.encode("ascii"))
+            self._dirty = True
+
+            if time.time() - self._last_flush_time >= self.flush_interval_seconds:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._flush()
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+
+    def _flush(self):
+        if self._dirty:
+            if self._map is not None:
+                self._map.flush()
+            else:
+                self._file.flush()
+            self._dirty = False
+        self._last_flush_time = time.time()
+
+
+def _scan_pattern():
+    """
+    Build the regular expression that matches one complete scan: a status
+    line with a valid status code followed by lines 1-21, with optional
+    comment lines in between
+    """
+    comments = rb"(?:[" + re.escape((COMMENT1 + COMMENT2).encode()) + rb"][^\n]*\n)*"
+    pattern = rb"^(?: 0|00)[^\n]{%d}([NDF])\r?\n" % (FIRSTCOL - 2)
+    for lineno in range(1, LASTLINE+1):
+        if lineno < 10:
+            line_id = rb"(?: %d|0%d)" % (lineno, lineno)
+        else:
+            line_id = rb"%d" % lineno
+        if lineno < LASTLINE:
+            pattern += comments + line_id + rb"[^\n]*\n"
+        else:
+            pattern += comments + line_id + rb"[^\r\n]*"
+    return re.compile(pattern, re.MULTILINE)
+
+SCAN_PATTERN = _scan_pattern()
+STATUS_LINE_PATTERN = re.compile(rb"^(?: 0|00) ", re.MULTILINE)
+
+def index_sls(data):
+    """
+    Find the scans in the contents of a telrun file (bytes or a memory map)
+    in a single pass, without parsing them.
+
+    Returns a list with one (start, end, status_offset) tuple per complete
+    scan: the byte range from its status line to the end of its pathname
+    line, and the offset of its status code character.
+    Incomplete scans and scans with a bad status code are skipped.
+    """
+
+    return [(match.start(), match.end(), match.start(1)) for match in SCAN_PATTERN.finditer(data)]
+
+
+##### Parsers for the fields on each line of a scan #####
+
+# Each takes the TelrunScan being filled in and the text after the field
+# description, and raises ValueError if the value is invalid.
+# Based on readNextSLS() from talon/libmisc/scan.c
+
+def _parse_status(sp, bp):
+    # Sample line:
+    # 0            status: N
+    if bp not in ['N', 'D', 'F']:
+        raise ValueError("Bad .sls status code: %s" % bp)
+    sp.status = bp
+
+def _parse_start_jd(sp, bp):
+    # Sample line:
+    # 1          start JD: 2457137.62014 ( 4/25/2015  2:53 UTC)
+    tmp = _atof_field(bp)
+    # mjd was 25567.5 on 00:00:00 1/1/1970 UTC (UNIX epoch)
+    sp.starttm = (tmp - MJD0 - 25567.5)*SPD + 0.5
+
+def _parse_lstdelta(sp, bp):
+    # Sample line:
+    # 2    lstdelta, mins: 9000  
+    tmp = _atof_field(bp)
+    sp.startdt = int(math.floor(tmp*60+0.5))
+
+def _parse_schedfn(sp, bp):
+    # Sample line:
+    # 3           schedfn: gad97.sch
+    sp.schedfn = bp
+
+def _parse_title(sp, bp):
+    # Sample line:
+    #  4             title: Jupiter Mass
+    sp.title = bp
+
+def _parse_observer(sp, bp):
+    # Sample line:
+    #  5          observer: nick-becker@uiowa.edu
+    sp.observer = bp
+
+def _parse_comment(sp, bp):
+    # Sample line:
+    #  6           comment: 
+    sp.comment = bp
+
+def _parse_edb(sp, bp):
+    # Sample line:
+    #  7               EDB: Jupiter,P
+    sp.raw_edb = bp
+    try:
+        sp.obj = edb_line_to_body(bp)
+    except Exception as ex:
+        raise ValueError("Unable to process target object '%s': '%s'" % (bp, ex))
+
+def _parse_ra_offset(sp, bp):
+    # Sample line:
+    #  8          RAOffset:  0:00:00.0
+    try: 
+        sp.rao = convert.hours_to_rads(convert.from_dms(bp))
+    except Exception:
+        raise ValueError("Unable to parse '%s' as sexagesimal string" % bp)
+
+def _parse_dec_offset(sp, bp):
+    # Sample line:
+    #  9         DecOffset:  0:00:00.0
+    try: 
+        sp.deco = convert.degs_to_rads(convert.from_dms(bp))
+    except Exception:
+        raise ValueError("Unable to parse '%s' as sexagesimal string" % bp)
+
+def _parse_frame_position(sp, bp):
+    # Sample line:
+    # 10    frame position: 0+0
+    try:
+        sx_str, sy_str = bp.split("+")
+        sp.sx = int(sx_str)
+        sp.sy = int(sy_str)
+    except ValueError as ex:
+        raise ValueError("Invalid frame position '%s': %s" % (bp, ex))
+
+def _parse_frame_size(sp, bp):
+    # Sample line:
+    # 11        frame size: 4096x4096
+    try:
+        sw_str, sh_str = bp.split("x")
+        sp.sw = int(sw_str)
+        sp.sh = int(sh_str)
+    except ValueError as ex:
+        raise ValueError("Invalid frame size '%s': %s" % (bp, ex))
+
+def _parse_binning(sp, bp):
+    # Sample line:
+    # 12           binning: 2x2
+    try:
+        binx_str, biny_str = bp.split("x")
+        sp.binx = int(binx_str)
+        sp.biny = int(biny_str)
+    except ValueError as ex:
+        raise ValueError("Invalid frame binning '%s': %s" % (bp, ex))
+
+def _parse_duration(sp, bp):
+    # Sample line:
+    # 13    duration, secs: 1     
+    try:
+        sp.dur = _atof(bp)
+    except ValueError:
+        raise ValueError("Invalid exposure duration '%s'" % bp)
+
+def _parse_shutter(sp, bp):
+    # Sample line:
+    # 14           shutter: Open
+    sp.shutter = ccdStr2SO(bp)
+    if sp.shutter == None:
+        raise ValueError("Invalid shutter option '%s'" % bp)
+
+def _parse_ccdcalib(sp, bp):
+    # Sample line:
+    # 15          ccdcalib: CATALOG
+    sp.ccdcalib = ccdStr2Calib(bp)
+    if sp.ccdcalib == None:
+        raise ValueError("Invalid ccdcalib option '%s'" % bp)
+
+def _parse_filter(sp, bp):
+    # Sample line:
+    # 16            filter: N
+    if len(bp) < 1:
+        raise ValueError("Missing filter")
+    sp.filter = bp[0]
+
+def _parse_cmosmode(sp, bp):
+    # Sample line:
+    # 17             hcomp: 1
+    try:
+        sp.cmosmode = _atoi(bp)
+    except ValueError:
+        raise ValueError("Invalid CMOS readout mode '%s'" % bp)
+
+def _parse_positioning(sp, bp):
+    # Sample line:
+    # 18   Positioning 2048x2048
+    # Anything else (e.g. "None") means no re-positioning will occur
+    try:
+        posx_str, posy_str = bp.split("x")
+        sp.posx = int(posx_str)
+        sp.posy = int(posy_str)
+    except ValueError:
+        sp.posx = None
+        sp.posy = None
+
+def _parse_interrupt_allowed(sp, bp):
+    # Sample line:
+    # 19    Interrupt_Allowed: 1
+    try: sp.interrupt_allowed = bool(int(bp))
+    except ValueError: sp.interrupt_allowed = True
+
+def _parse_priority(sp, bp):
+    # Sample line:
+    # 20          priority: 10
+    try:
+        sp.priority = _atoi(bp)
+    except ValueError:
+        raise ValueError("Invalid priority value '%s'" % bp)
+
+def _parse_pathname(sp, bp):
+    # Sample line:
+    # 21          pathname: /usr/local/telescope/user/images/gad11500.fts
+    sp.imagedn = os.path.dirname(bp)
+    if sp.imagedn == "":
+        raise ValueError("Full image pathname required in '%s'" % bp)
+
+    sp.imagefn = os.path.basename(bp)
+    if sp.imagefn == "":
+        raise ValueError("Filemame missing from path: '%s'" % bp)
+
+# FIELD_PARSERS[lineno] parses line lineno of a scan
+FIELD_PARSERS = [
+    _parse_status,
+    _parse_start_jd,
+    _parse_lstdelta,
+    _parse_schedfn,
+    _parse_title,
+    _parse_observer,
+    _parse_comment,
+    _parse_edb,
+    _parse_ra_offset,
+    _parse_dec_offset,
+    _parse_frame_position,
+    _parse_frame_size,
+    _parse_binning,
+    _parse_duration,
+    _parse_shutter,
+    _parse_ccdcalib,
+    _parse_filter,
+    _parse_cmosmode,
+    _parse_positioning,
+    _parse_interrupt_allowed,
+    _parse_priority,
+    _parse_pathname,
+    ]
 
 
 def read_next_sls(file_stream):
@@ -203,7 +608,9 @@ def read_next_sls(file_stream):
       scan = an instance of TelrunScan, or None if there was a problem
       offset = the offset of the status byte, or 0 if there was a problem
     
-    Based on readNextSLS() from talon/libmisc/scan.c
+    Based on readNextSLS() from talon/libmisc/scan.c.
+    TelrunFile does not use this; it indexes the whole file with index_sls()
+    and parses scans on demand.
     """
 
     return_value_on_error = (-1, None, 0) # The tuple to return if there is a problem
@@ -252,245 +659,22 @@ def read_next_sls(file_stream):
 
         # crack the field
         if lineno == 0:
-            # Sample line:
-            # 0            status: N
-            if bp not in ['N', 'D', 'F']:
-                logger.warn("Bad .sls status code: %s" % bp)
-                lineno = 0
-                continue
-
             sp = TelrunScan()
-            sp.status = bp
             offset = file_stream.tell() - num_stripped_chars - 1 # back up over status code and newline
 
-        elif lineno == 1:
-            # Sample line:
-            # 1          start JD: 2457137.62014 ( 4/25/2015  2:53 UTC)
-            try:
-                tmp = _atof(bp)
-            except:
-                logger.warn("Unable to parse '%s' as float; skipping to next scan", 
-                        bp)
-                lineno = 0
-                continue
-
-            # mjd was 25567.5 on 00:00:00 1/1/1970 UTC (UNIX epoch)
-            sp.starttm = (tmp - MJD0 - 25567.5)*SPD + 0.5
-
-        elif lineno == 2:
-            # Sample line:
-            # 2    lstdelta, mins: 9000  
-            try:
-                tmp = _atof(bp)
-            except:
-                logger.warn("Unable to parse '%s' as float; skipping to next scan", 
-                        bp)
-                lineno = 0
-                continue
-            sp.startdt = int(math.floor(tmp*60+0.5))
-
-        elif lineno == 3:
-            # Sample line:
-            # 3           schedfn: gad97.sch
-            sp.schedfn = bp
-
-        elif lineno == 4:
-            # Sample line:
-            #  4             title: Jupiter Mass
-            sp.title = bp
-
-        elif lineno == 5:
-            # Sample line:
-            #  5          observer: nick-becker@uiowa.edu
-            sp.observer = bp
-
-        elif lineno == 6:
-            # Sample line:
-            #  6           comment: 
-            sp.comment = bp
-
-        elif lineno == 7:
-            # Sample line:
-            #  7               EDB: Jupiter,P
-            try:
-                sp.obj = edb_line_to_body(bp)
-                sp.raw_edb = bp
-            except Exception as ex:
-                logger.warn("Unable to process target object '%s': '%s'; skipping to next scan",
-                        bp,
-                        ex.message)
-                lineno = 0
-                continue
-
-        elif lineno == 8:
-            # Sample line:
-            #  8          RAOffset:  0:00:00.0
-            try: 
-                sp.rao = convert.hours_to_rads(convert.from_dms(bp))
-            except:
-                logger.warn("Unable to parse '%s' as sexagesimal string; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 9:
-            # Sample line:
-            #  9         DecOffset:  0:00:00.0
-            try: 
-                sp.deco = convert.degs_to_rads(convert.from_dms(bp))
-            except:
-                logger.warn("Unable to parse '%s' as sexagesimal string; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 10:
-            # Sample line:
-            # 10    frame position: 0+0
-            try:
-                sx_str, sy_str = bp.split("+")
-                sp.sx = int(sx_str)
-                sp.sy = int(sy_str)
-            except Exception as ex:
-                logger.warn("Invalid frame position '%s': %s; skipping to next scan",
-                        bp,
-                        ex.message)
-                lineno = 0
-                continue
-
-        elif lineno == 11:
-            # Sample line:
-            # 11        frame size: 4096x4096
-            try:
-                sw_str, sh_str = bp.split("x")
-                sp.sw = int(sw_str)
-                sp.sh = int(sh_str)
-            except Exception as ex:
-                logger.warn("Invalid frame size '%s': %s; skipping to next scan",
-                        bp,
-                        ex.message)
-                lineno = 0
-                continue
-
-        elif lineno == 12:
-            # Sample line:
-            # 12           binning: 2x2
-            try:
-                binx_str, biny_str = bp.split("x")
-                sp.binx = int(binx_str)
-                sp.biny = int(biny_str)
-            except Exception as ex:
-                logger.warn("Invalid frame binning '%s': %s; skipping to next scan",
-                        bp,
-                        ex.message)
-                lineno = 0
-                continue
-
-        elif lineno == 13:
-            # Sample line:
-            # 13    duration, secs: 1     
-            try:
-                sp.dur = _atof(bp)
-            except Exception as ex:
-                logger.warn("Invalid exposure duration '%s'; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 14:
-            # Sample line:
-            # 14           shutter: Open
-
-            sp.shutter = ccdStr2SO(bp)
-            if sp.shutter == None:
-                logger.warn("Invalid shutter option '%s'; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 15:
-            # Sample line:
-            # 15          ccdcalib: CATALOG
-
-            sp.ccdcalib = ccdStr2Calib(bp)
-            if sp.ccdcalib == None:
-                logger.warn("Invalid ccdcalib option '%s'; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 16:
-            # Sample line:
-            # 16            filter: N
-            if len(bp) < 1:
-                logger.warn("Missing filter; skipping to next scan")
-                lineno = 0
-                continue
-            sp.filter = bp[0]
-
-        elif lineno == 17:
-            # Sample line:
-            # 17             hcomp: 1
-            try:
-                sp.cmosmode = _atoi(bp)
-            except:
-                logger.warn("Invalid CMOS readout mode '%s'; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 18:
-            # Sample line:
-            # 18   Positioning 2048x2048
-
-            try:
-                posx_str, posy_str = bp.split("x")
-                sp.posx = int(posx_str)
-                sp.posy = int(posy_str)
-            except Exception as ex:
-                # logger.info('Invalid positioning string: %s, no re-positioning will occur', bp)
-                sp.posx = None
-                sp.posy = None
-
-        elif lineno == 19:
-            # Sample line:
-            # 19    Interrupt_Allowed: 1
-            try: sp.interrupt_allowed = bool(int(bp))
-            except: sp.interrupt_allowed = True
-
-        elif lineno == 20:
-            # Sample line:
-            # 20          priority: 10
-
-            try:
-                sp.priority = _atoi(bp)
-            except:
-                logger.warn("Invalid priority value '%s'; skipping to next scan",
-                        bp)
-                lineno = 0
-                continue
-
-        elif lineno == 21:
-            # Sample line:
-            # 21          pathname: /usr/local/telescope/user/images/gad11500.fts
-
-            sp.imagedn = os.path.dirname(bp)
-            if sp.imagedn == "":
-                logger.warn("Full image pathname required in '%s'; aborting", bp)
-                return return_value_on_error
-
-            sp.imagefn = os.path.basename(bp)
-            if sp.imagefn == "":
-                logger.warn("Filemame missing from path: '%s'; aborting", bp)
+        try:
+            FIELD_PARSERS[lineno](sp, bp)
+        except ValueError as ex:
+            if lineno == LASTLINE:
+                logger.warn("%s; aborting", ex)
                 return return_value_on_error
+            logger.warn("%s; skipping to next scan", ex)
+            lineno = 0
+            continue
 
+        if lineno == LASTLINE:
             break # Finished processing scan
 
-        else:
-            logger.warn("BUG! Bogus lineno: '%r'", lineno)
-            return return_value_on_error
-
-        # end of long switch() statement
         lineno += 1
 
     # end while()
@@ -707,6 +891,13 @@ def _atoi(s):
 
     return int(_str_before_whitespace(s))
 
+def _atof_field(s):
+    "_atof() for a required field; raises ValueError with a message suitable for the log"
+    try:
+        return _atof(s)
+    except ValueError:
+        raise ValueError("Unable to parse '%s' as float" % s)
+
 def _str_before_whitespace(s):
     """
     Return the part of the string that comes before any whitespace character
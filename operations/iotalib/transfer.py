@@ -0,0 +1,531 @@
+"""
+Concurrent image transfers for syncfiles.
+
+syncfiles used to copy one image at a time, starting a new pscp process
+(and a new SSH connection) for every file, at most 3 images per pass and
+then a 60 second sleep. TransferEngine instead:
+  - keeps one SSH connection open (PuTTY connection sharing) and sends the
+    images in batches from a bounded pool of worker threads. Each batch is
+    one psftp session plus one plink command over the shared connection.
+  - uploads each image as NAME.part, compares its MD5 on the remote host
+    with the local one, and only then renames it to NAME and moves the
+    local file to transferred/
+  - resumes an interrupted upload (psftp reput) instead of starting over
+  - keeps the pending files, their checksums and retry state in a JSON
+    queue file, so a restarted syncfiles carries on where it stopped
+  - is woken by DirectoryWatcher as soon as new images land, instead of
+    sleeping a fixed 60 seconds
+  - logs the throughput of every batch and of each busy period
+
+LocalTransport has the same interface as SshTransport but copies to a local
+directory, so syncfiles can be exercised without the remote host.
+"""
+
+# Built-in Python imports
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+# iotalib imports
+from . import ssh
+
+def file_md5(path, chunk_bytes=1<<20):
+    "Return the MD5 digest of a file as a hex string"
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def shell_quote(s):
+    "Quote s for the POSIX shell on the remote host"
+    return "'" + s.replace("'", "'\\''") + "'"
+
+class SshTransport:
+    def __init__(self, remote_username, remote_host, remote_dir, remote_port=22, identity_file=None,
+            sftp_executable="psftp", ssh_executable="plink", share=True):
+        """
+        Uploads to remote_dir on remote_host with psftp and runs the checks
+        with plink.
+
+        share: if True, keep one SSH connection open (see ssh.ssh_session())
+          and multiplex every psftp and plink session over it
+        """
+        self.remote_username = remote_username
+        self.remote_host = remote_host
+        self.remote_dir = remote_dir
+        self.remote_port = remote_port
+        self.identity_file = identity_file
+        self.sftp_executable = sftp_executable
+        self.ssh_executable = ssh_executable
+        self.share = share
+        self._session = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        "Start the shared connection if it is not already running"
+        if not self.share:
+            return
+        with self._lock:
+            if self._session is None or self._session.poll() is not None:
+                logging.info("Opening shared SSH connection to %s", self.remote_host)
+                self._session = ssh.ssh_session(
+                    self.remote_username,
+                    self.remote_host,
+                    remote_port=self.remote_port,
+                    ssh_executable=self.ssh_executable,
+                    identity_file=self.identity_file
+                    )
+                time.sleep(1) # Give the connection time to authenticate before the first downstream session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                logging.info("Closing shared SSH connection to %s", self.remote_host)
+                self._session.terminate()
+                self._session = None
+
+    def upload(self, items):
+        """
+        Upload each (local_path, name, resume) in items to remote_dir/name.part
+        in one psftp session.
+        resume: if True, append to a partial name.part left by an earlier attempt
+
+        Returns the psftp return code. Failures of individual files show up
+        in verify().
+        """
+        self.open()
+        commands = ['cd "%s"' % self.remote_dir]
+        for (local_path, name, resume) in items:
+            commands.append('%s "%s" "%s.part"' % ("reput" if resume else "put", local_path, name))
+
+        return ssh.sftp_batch(
+            commands,
+            self.remote_username,
+            self.remote_host,
+            remote_port=self.remote_port,
+            sftp_executable=self.sftp_executable,
+            identity_file=self.identity_file,
+            share=self.share
+            )
+
+    def verify(self, items):
+        """
+        For each (name, md5) in items, compare the MD5 of remote_dir/name.part
+        with md5 and rename the file to name if they match. One plink command
+        checks the whole batch.
+
+        Returns the set of names that matched and were renamed
+        """
+        self.open()
+        checks = []
+        for (name, md5) in items:
+            part = name + ".part"
+            checks.append("if echo %s | md5sum -c --status; then mv -f %s %s && echo %s; fi" % (
+                shell_quote(md5 + "  " + part), shell_quote(part), shell_quote(name), shell_quote("OK:" + name)))
+        command = "cd %s && %s" % (shell_quote(self.remote_dir), "; ".join(checks))
+
+        (return_code, output) = ssh.ssh_command_output(
+            command,
+            self.remote_username,
+            self.remote_host,
+            remote_port=self.remote_port,
+            ssh_executable=self.ssh_executable,
+            identity_file=self.identity_file,
+            share=self.share
+            )
+
+        return set(line[3:] for line in output.splitlines() if line.startswith("OK:"))
+
+class LocalTransport:
+    def __init__(self, remote_dir, session_seconds=0.0, bytes_per_second=None):
+        """
+        Stand-in for SshTransport that "uploads" to a local directory.
+
+        session_seconds: delay added to every upload() and verify() call, like
+          starting a psftp or plink session
+        bytes_per_second: if given, limit the copy rate to this
+        """
+        self.remote_dir = remote_dir
+        self.session_seconds = session_seconds
+        self.bytes_per_second = bytes_per_second
+
+    def open(self):
+        os.makedirs(self.remote_dir, exist_ok=True)
+
+    def close(self):
+        pass
+
+    def upload(self, items):
+        "See SshTransport.upload()"
+        self.open()
+        time.sleep(self.session_seconds)
+        for (local_path, name, resume) in items:
+            part_path = os.path.join(self.remote_dir, name + ".part")
+            offset = 0
+            if resume and os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+            with open(local_path, "rb") as src, open(part_path, "ab" if offset > 0 else "wb") as dst:
+                src.seek(offset)
+                shutil.copyfileobj(src, dst)
+            if self.bytes_per_second:
+                time.sleep((os.path.getsize(local_path) - offset) / self.bytes_per_second)
+        return 0
+
+    def verify(self, items):
+        "See SshTransport.verify()"
+        time.sleep(self.session_seconds)
+        verified = set()
+        for (name, md5) in items:
+            part_path = os.path.join(self.remote_dir, name + ".part")
+            if os.path.exists(part_path) and file_md5(part_path) == md5:
+                os.replace(part_path, os.path.join(self.remote_dir, name))
+                verified.add(name)
+        return verified
+
+class TransferQueue:
+    def __init__(self, queue_path, retry_seconds=60.0, max_retry_seconds=900.0):
+        """
+        Files waiting to be transferred, saved to queue_path (JSON) after
+        every change. Each entry, keyed by file name, holds:
+          path, size, mtime: the local file (a changed file starts over)
+          md5: checksum of the local file, or None until it is computed
+          attempts: failed transfer attempts so far
+          resume: if True, the next upload continues a partial one
+          retry_time: do not try again before this time
+
+        A failed file is retried after retry_seconds, doubling with each
+        failure up to max_retry_seconds.
+        """
+        self.queue_path = queue_path
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        if os.path.isfile(queue_path):
+            try:
+                with open(queue_path) as f:
+                    self._entries = json.load(f)
+                logging.info("Loaded %d pending file(s) from %s", len(self._entries), queue_path)
+            except Exception as ex:
+                logging.warning("Ignoring unreadable transfer queue %s (%s)", queue_path, ex)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def update(self, filepaths):
+        """
+        Add new files in filepaths to the queue and drop entries whose file
+        is gone. Returns the number of files added.
+        """
+        with self._lock:
+            current = {}
+            for path in filepaths:
+                stat = os.stat(path)
+                current[os.path.basename(path)] = (path, stat.st_size, stat.st_mtime)
+
+            added = 0
+            for (name, (path, size, mtime)) in current.items():
+                entry = self._entries.get(name)
+                if entry is None or entry["size"] != size or entry["mtime"] != mtime:
+                    self._entries[name] = {"path": path, "size": size, "mtime": mtime, "md5": None,
+                        "attempts": 0, "resume": False, "retry_time": 0}
+                    added += 1
+
+            removed = [name for name in self._entries if name not in current]
+            for name in removed:
+                del self._entries[name]
+
+            if added > 0 or len(removed) > 0:
+                self._save()
+            return added
+
+    def ready(self, now, exclude=()):
+        "Return the names that can be tried now, oldest file first, skipping names in exclude"
+        with self._lock:
+            names = [name for (name, entry) in self._entries.items()
+                if entry["retry_time"] <= now and name not in exclude]
+            return sorted(names, key=lambda name: self._entries[name]["mtime"])
+
+    def get(self, name):
+        "Return a copy of the entry for name, or None"
+        with self._lock:
+            entry = self._entries.get(name)
+            return None if entry is None else dict(entry)
+
+    def set_md5(self, name, md5):
+        with self._lock:
+            if name in self._entries:
+                self._entries[name]["md5"] = md5
+                self._save()
+
+    def failed(self, name, resumed):
+        """
+        Record a failed attempt. An upload that broke off is resumed next
+        time; if a resumed upload fails its checksum it is sent again from
+        the start.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return
+            entry["attempts"] += 1
+            entry["resume"] = not resumed
+            delay = min(self.retry_seconds * 2**(entry["attempts"] - 1), self.max_retry_seconds)
+            entry["retry_time"] = time.time() + delay
+            self._save()
+
+    def remove(self, name):
+        with self._lock:
+            if self._entries.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        "Write the queue to a temporary file and rename it into place. Called with the lock held."
+        tmp_path = self.queue_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp_path, self.queue_path)
+
+class TransferEngine:
+    def __init__(self, transport, queue, image_dir, transferred_dir, duplicate_dir, valid_extensions,
+            workers=3, batch_size=4, settle_seconds=2.0):
+        """
+        Sends the images in image_dir with transport, using up to workers
+        threads with batch_size files per batch, and moves each image to
+        transferred_dir once it is safely on the remote host (or to
+        duplicate_dir, with a unique name, if transferred_dir already has
+        a file of that name).
+
+        settle_seconds: skip files modified more recently than this (still
+          being written)
+        """
+        self.transport = transport
+        self.queue = queue
+        self.image_dir = image_dir
+        self.transferred_dir = transferred_dir
+        self.duplicate_dir = duplicate_dir
+        self.valid_extensions = valid_extensions
+        self.workers = workers
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._in_flight = set()  # Names in batches that have been submitted and not yet finished
+        self._batches = 0        # Batches submitted and not yet finished
+        self._wakeup = threading.Event()
+        self.unsettled = 0       # Images skipped by the last scan() because they were still being written
+
+        # Statistics for the current busy period (from the first batch after
+        # an empty queue until the queue is empty again)
+        self._busy_start_time = None
+        self._busy_files = 0
+        self._busy_bytes = 0
+        self._busy_failures = 0
+
+    def notify(self):
+        "Wake up wait(), e.g. when a new image has landed"
+        self._wakeup.set()
+
+    def wait(self, timeout_seconds):
+        "Sleep until notify() is called, a batch finishes, or timeout_seconds have passed"
+        self._wakeup.wait(max(timeout_seconds, 0))
+        self._wakeup.clear()
+
+    def scan(self):
+        "Add finished images in image_dir to the queue"
+        now = time.time()
+        files = []
+        self.unsettled = 0
+        for entry in os.scandir(self.image_dir):
+            if not entry.is_file():
+                continue
+            if not any(entry.name.endswith(ext) for ext in self.valid_extensions):
+                continue
+            if now - entry.stat().st_mtime < self.settle_seconds:
+                self.unsettled += 1
+                continue
+            files.append(entry.path)
+
+        added = self.queue.update(files)
+        if added > 0:
+            logging.info("%d new image(s) queued, %d pending", added, len(self.queue))
+        return added
+
+    def submit_ready(self):
+        """
+        Start batches of ready files on the idle workers (never more batches
+        than workers, so later files stay in the queue where they can be
+        retried or resumed). Returns the number of batches started.
+        """
+        with self._lock:
+            idle_workers = self.workers - self._batches
+            if idle_workers <= 0:
+                return 0
+            names = self.queue.ready(time.time(), exclude=self._in_flight)
+            started = 0
+            while names and started < idle_workers:
+                batch = names[:self.batch_size]
+                names = names[self.batch_size:]
+                self._in_flight.update(batch)
+                self._batches += 1
+                if self._busy_start_time is None:
+                    self._busy_start_time = time.time()
+                self._pool.submit(self._transfer_batch, batch)
+                started += 1
+            return started
+
+    def busy(self):
+        "Return True if any batch is still being transferred"
+        with self._lock:
+            return self._batches > 0
+
+    def shutdown(self):
+        "Wait for the batches in progress and close the transport"
+        self._pool.shutdown(wait=True)
+        self.transport.close()
+
+    def _transfer_batch(self, names):
+        "Runs in a worker thread"
+        start_time = time.time()
+        nbytes = 0
+        nsent = 0
+        try:
+            items = []
+            for name in names:
+                entry = self.queue.get(name)
+                if entry is None:
+                    continue
+                if entry["md5"] is None:
+                    entry["md5"] = file_md5(entry["path"])
+                    self.queue.set_md5(name, entry["md5"])
+                items.append((name, entry))
+
+            logging.info("Sending %s", ", ".join(name for (name, entry) in items))
+            return_code = self.transport.upload([(entry["path"], name, entry["resume"]) for (name, entry) in items])
+            if return_code != 0:
+                logging.info("psftp returned %s; checking which files arrived", return_code)
+            verified = self.transport.verify([(name, entry["md5"]) for (name, entry) in items])
+
+            for (name, entry) in items:
+                if name in verified:
+                    self._archive_local(entry["path"])
+                    self.queue.remove(name)
+                    nbytes += entry["size"]
+                    nsent += 1
+                else:
+                    logging.warning("Transfer of %s failed (attempt %d)%s", name, entry["attempts"] + 1,
+                        ", will resume" if not entry["resume"] else ", will start over")
+                    self.queue.failed(name, entry["resume"])
+        except Exception:
+            logging.exception("Error transferring %s", ", ".join(names))
+            for name in names:
+                entry = self.queue.get(name)
+                if entry is not None:
+                    self.queue.failed(name, entry["resume"])
+        finally:
+            seconds = time.time() - start_time
+            if nsent > 0:
+                logging.info("Sent %d image(s), %.1f MB in %.1f s (%.2f MB/s), %d pending",
+                    nsent, nbytes/1e6, seconds, nbytes/1e6/max(seconds, 1e-6), len(self.queue))
+            with self._lock:
+                self._in_flight.difference_update(names)
+                self._batches -= 1
+                self._busy_files += nsent
+                self._busy_bytes += nbytes
+                self._busy_failures += len(names) - nsent
+                if self._batches == 0 and len(self.queue) == 0:
+                    self._log_busy_period()
+            self._wakeup.set()
+
+    def _log_busy_period(self):
+        "Called with the lock held"
+        seconds = time.time() - self._busy_start_time
+        logging.info("Queue empty: sent %d image(s), %.1f MB in %.1f s (%.2f MB/s, %.1f images/min), %d failed attempt(s)",
+            self._busy_files, self._busy_bytes/1e6, seconds, self._busy_bytes/1e6/max(seconds, 1e-6),
+            60.0*self._busy_files/max(seconds, 1e-6), self._busy_failures)
+        self._busy_start_time = None
+        self._busy_files = 0
+        self._busy_bytes = 0
+        self._busy_failures = 0
+
+    def _archive_local(self, filepath):
+        "Move a transferred image to transferred_dir (or duplicate_dir if the name is taken)"
+        for dirpath in (self.transferred_dir, self.duplicate_dir):
+            if not os.path.exists(dirpath):
+                logging.info("Creating %s", dirpath)
+                os.makedirs(dirpath, exist_ok=True)
+
+        filename = os.path.basename(filepath)
+        dest_filepath_transferred = os.path.join(self.transferred_dir, filename)
+        if os.path.exists(dest_filepath_transferred):
+            logging.warning("File %s already exists", dest_filepath_transferred)
+            dest_filepath_duplicate = os.path.join(self.duplicate_dir, filename)
+            for i in range(999):
+                dest_filepath_duplicate_unique = dest_filepath_duplicate + "." + str(i)
+                if not os.path.exists(dest_filepath_duplicate_unique):
+                    break
+            logging.warning("Moving to %s", dest_filepath_duplicate_unique)
+            shutil.move(filepath, dest_filepath_duplicate_unique)
+        else:
+            shutil.move(filepath, dest_filepath_transferred)
+
+class DirectoryWatcher:
+    def __init__(self, watch_dir, on_change, fallback_interval_seconds=2.0):
+        """
+        Calls on_change() when files are created or renamed in watch_dir,
+        using Windows change notifications when pywin32 is available and
+        a directory listing every fallback_interval_seconds otherwise.
+        """
+        self.watch_dir = watch_dir
+        self.on_change = on_change
+        self.fallback_interval_seconds = fallback_interval_seconds
+
+    def start(self):
+        "Launch the watching thread"
+        logging.info("Watching %s for new images", self.watch_dir)
+        thread = threading.Thread(target=self._watch_loop)
+        thread.daemon = True
+        thread.start()
+
+    def _watch_loop(self):
+        try:
+            import win32con
+            import win32event
+            import win32file
+            handle = win32file.FindFirstChangeNotification(self.watch_dir, False,
+                win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        except Exception as ex:
+            logging.info("Directory change notifications not available (%s); listing %s every %.1f seconds",
+                ex, self.watch_dir, self.fallback_interval_seconds)
+            handle = None
+
+        last_listing = None
+        while True:
+            try:
+                if handle is None:
+                    listing = sorted(os.listdir(self.watch_dir))
+                    if listing != last_listing:
+                        last_listing = listing
+                        self.on_change()
+                    time.sleep(self.fallback_interval_seconds)
+                else:
+                    # Time out occasionally anyway, in case a notification is missed
+                    result = win32event.WaitForSingleObject(handle, int(self.fallback_interval_seconds*1000))
+                    if result == win32event.WAIT_OBJECT_0:
+                        self.on_change()
+                        win32file.FindNextChangeNotification(handle)
+            except Exception:
+                logging.exception("Error watching %s", self.watch_dir)
+                time.sleep(self.fallback_interval_seconds)
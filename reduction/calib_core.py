@@ -0,0 +1,67 @@
+# Calibration arithmetic shared by cmos_calib_lib (cmos-calib, process-images) and ccdcalib
+#
+#   calibrated frame = (R - B - s*D) / NF + pedestal, clipped to [0, pmax]
+#
+# Works in float32, in place, a block of rows at a time: the only full-frame arrays are the
+# raw frame, the master frames and the 16-bit result, so peak memory no longer grows with
+# the number of float64 temporaries ((R - B - T), masks, np.floor, ...).
+
+import numpy as np
+
+pmax = 2**16 - 1            # 16-bit output for compatibility with Talon software
+chunk_rows_default = 512    # Rows processed per block
+
+def as_float32(im):
+    ''' Return im as a float32 array (no copy if it already is one)'''
+    return np.asarray(im, dtype=np.float32)
+
+def calibrate_frame(im_raw, im_flat, im_bias=None, im_dark=None, dark_scale=1.0, pedestal=0,
+                    rounding='round', dtype=np.uint16, chunk_rows=chunk_rows_default):
+    ''' Calibrate one frame and return the result as a new array of type dtype.
+        im_raw:     raw frame, any numeric type (typically uint16)
+        im_flat:    normalized flat (float32), im_bias, im_dark: optional float32 masters
+        dark_scale: multiplies im_dark (ratio of exposure times) before it is subtracted
+        pedestal:   added after flat fielding
+        rounding:   'floor', 'round' (half to even, as astropy does when scaling to int16) or None
+        chunk_rows: rows per block (None: whole frame at once)
+        Master frames may be views (e.g. flipped) and are never modified'''
+    nrows = im_raw.shape[0]
+    if not chunk_rows: chunk_rows = nrows
+    chunk_rows = min(chunk_rows, nrows)
+    out = np.empty(im_raw.shape, dtype=dtype)
+    buf = np.empty((chunk_rows,) + im_raw.shape[1:], dtype=np.float32)
+    scratch = None
+    if im_dark is not None and dark_scale != 1.0:
+        scratch = np.empty_like(buf)
+
+    for r0 in range(0, nrows, chunk_rows):
+        r1 = min(r0 + chunk_rows, nrows)
+        b = buf[:r1-r0]
+        if im_bias is not None:
+            np.subtract(im_raw[r0:r1], im_bias[r0:r1], out=b, dtype=np.float32)
+        else:
+            b[...] = im_raw[r0:r1]
+        if im_dark is not None:
+            if scratch is None:
+                np.subtract(b, im_dark[r0:r1], out=b)
+            else:
+                s = scratch[:r1-r0]
+                np.multiply(im_dark[r0:r1], dark_scale, out=s, dtype=np.float32)
+                np.subtract(b, s, out=b)
+        np.divide(b, im_flat[r0:r1], out=b)
+        if pedestal: b += pedestal
+        np.clip(b, 0, pmax, out=b)
+        if rounding == 'floor':
+            np.floor(b, out=b)
+        elif rounding == 'round':
+            np.rint(b, out=b)
+        out[r0:r1] = b
+    return out
+
+def fix_columns(im, bad_columns):
+    ''' Replace bad columns (in place) with the mean of the adjacent columns'''
+    for bc in bad_columns:
+        m = (as_float32(im[:,bc-1]) + im[:,bc+1])/2.
+        if np.issubdtype(im.dtype, np.integer): m = np.rint(m)
+        im[:,bc] = m
+    return im
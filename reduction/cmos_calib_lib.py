@@ -0,0 +1,229 @@
+# Library version of cmos-calib: calibrate many CMOS images in one process
+# Master darks and normalized master flats are kept in memory (LRU cache) so that
+# a batch of images taken with the same binning, readout mode, exposure and filter
+# reads and normalizes each master only once.
+#
+# Calibration scheme (see cmos-calib):  calibrated frame = (R - D) / NF + pedestal
+# The arithmetic is done in float32, in blocks of rows (calib_core.py)
+# Used by cmos-calib (command line) and process-images (long-running service)
+
+import os, glob, time
+from collections import OrderedDict
+import numpy as np
+from astropy.io import fits as pyfits
+
+import astroscrappy
+
+from calib_core import calibrate_frame, fix_columns, as_float32, pmax, chunk_rows_default
+
+# Default directory for calibration images
+calib_dir = '/usr/local/telescope/archive/calib/'
+
+RN = 3.0                # Read noise for AC4040
+pedestal = 1000         # Added to calibrated images
+border = 1024           # Do not use border pixels when normalizing flats
+dark_t_vals = [2**n for n in range(-3,12)]  # List of exposure times of available darks
+
+class CalibrationError(Exception):
+    ''' Raised when an image cannot be calibrated (missing or mismatched master frames)'''
+    pass
+
+class LRUCache:
+    ''' Least-recently-used cache of master frames, holding at most maxsize entries.
+        Each entry remembers the modification time of the file it was read from, so a
+        master that is remade on disk is re-read the next time it is needed'''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (path, mtime, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, path, load):
+        ''' Return the cached value for key, calling load(path) if it is not cached,
+            was read from a different file, or the file has changed since'''
+        mtime = os.path.getmtime(path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == path and entry[1] == mtime:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        value = load(path)
+        self.entries[key] = (path, mtime, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+class MasterDark:
+    def __init__(self, path):
+        ''' Master dark with any PEDESTAL added back'''
+        self.path = path
+        im, hdr = pyfits.getdata(path, header=True)
+        self.data = as_float32(im).copy()
+        if 'PEDESTAL' in hdr: self.data += hdr['PEDESTAL']
+        self.median = np.median(self.data)
+
+class MasterFlat:
+    def __init__(self, path):
+        ''' Master flat normalized to a mean of one (borders excluded), clipped to avoid dividing by bad pixels'''
+        self.path = path
+        im, hdr = pyfits.getdata(path, header=True)
+        self.filter = hdr['filter']
+        im = as_float32(im).copy()
+        self.stats = (np.min(im), np.median(im), np.max(im))
+        ymax, xmax = im.shape[0] - border, im.shape[1] - border
+        # N.B. slice order kept from the original cmos-calib (identical for square sensors)
+        im /= np.float32(np.mean(im[border:xmax,border:ymax], dtype=np.float64))
+        im[im <= 0] = 1
+        im[im >= 65535] = 65535
+        self.data = im
+
+class CMOSCalibrator:
+    def __init__(self, calib_dir=calib_dir, max_darks=4, max_flats=4, chunk_rows=chunk_rows_default, verbose=False):
+        ''' Calibrates CMOS images, keeping up to max_darks master darks and
+            max_flats normalized master flats in memory between images.
+            Darks are cached by (binning, readout mode, exposure), flats by
+            (binning, readout mode, filter), so together the masters for an image are
+            looked up by (binning, readout mode, exposure, filter).
+            chunk_rows: rows calibrated at a time (None: whole frame), bounds peak memory'''
+        self.calib_dir = calib_dir
+        self.darks = LRUCache(max_darks)
+        self.flats = LRUCache(max_flats)
+        self.chunk_rows = chunk_rows
+        self.verbose = verbose
+        self.images = 0
+        self.seconds = 0.0
+
+    def log(self, messages, s):
+        messages.append(s)
+        if self.verbose: print(s)
+
+    def dark_path(self, nbin, rmode, tdark):
+        td = str(tdark).replace('.', '-')
+        return '{0}master_dark_{1:d}x{1:d}_{2}_{3}s.fts'.format(self.calib_dir, nbin, rmode, td)
+
+    def flat_path(self, nbin, rmode, filter_raw):
+        flat_imgstub = '{0}master_flat_{1}_{2:d}x{2:d}_{3}'.format(self.calib_dir, filter_raw.upper(), nbin, rmode)
+        flat_imgs = glob.glob(flat_imgstub + '*.fts')
+        if not flat_imgs:
+            raise CalibrationError('Flat image not found, exiting')
+        return flat_imgs[0]
+
+    def masters(self, hdr_raw, dark_image='', flat_image='', messages=None):
+        ''' Return (MasterDark, MasterFlat) for a raw image header.
+            dark_image, flat_image override the default master frames'''
+        if messages is None: messages = []
+        nbin = hdr_raw['XBINNING']
+        readout_mode = hdr_raw['READOUTM']
+        rmode = readout_mode.replace(' ', '')
+        exptime = round(hdr_raw['EXPTIME'], 2)
+        filter_raw = hdr_raw['filter'][0].upper()
+
+        # Determine which dark to use by selecting dark whose exposure time is closest to science image exposure time
+        tdark = min(dark_t_vals, key=lambda t: abs(t - exptime))
+        if tdark != exptime:
+            self.log(messages, 'Warning: Science image has different exposure time than dark image (%.1f sec vs. %.1f sec)' % (exptime, tdark))
+        self.log(messages, 'Calibrating using mode %s' % readout_mode)
+
+        if dark_image == '': dark_image = self.dark_path(nbin, rmode, tdark)
+        if flat_image == '': flat_image = self.flat_path(nbin, rmode, filter_raw)
+        if not os.path.isfile(dark_image): raise CalibrationError('Dark image %s does not exist, exiting' % dark_image)
+        if not os.path.isfile(flat_image): raise CalibrationError('Flat image %s does not exist, exiting' % flat_image)
+
+        dark = self.darks.get((nbin, rmode, tdark), dark_image, MasterDark)
+        flat = self.flats.get((nbin, rmode, filter_raw), flat_image, MasterFlat)
+        return dark, flat
+
+    def calibrate(self, raw_image, cal_image='', N_iter=1, bad_columns=(), dark_image='', flat_image=''):
+        ''' Calibrate raw_image, writing the result to cal_image (default: overwrite raw_image).
+            Returns the list of messages cmos-calib prints in verbose mode.
+            Raises CalibrationError if the image cannot be calibrated.'''
+        t_start = time.time()
+        messages = []
+        if cal_image == '': cal_image = raw_image
+        if not os.path.isfile(raw_image): raise CalibrationError('Raw image %s does not exist, exiting' % raw_image)
+
+        im_raw, hdr_raw = pyfits.getdata(raw_image, header=True)
+        dark, flat = self.masters(hdr_raw, dark_image, flat_image, messages)
+
+        # Check if flat image has a filter matched to science image
+        filter_raw = hdr_raw['filter']
+        if filter_raw[0] != flat.filter[0]:
+            raise CalibrationError('Raw (%s), flat (%s) filters do not match, exiting' % (filter_raw, flat.filter))
+
+        self.log(messages, 'Used flat image %s' % flat.path)
+        self.log(messages, 'Flat image statistics:  min = %5.1f, median = %5.1f, max = %5.1f' % flat.stats)
+        self.log(messages, 'Calibrating %s using %s, %s' % (raw_image, dark.path, flat.path))
+        self.log(messages, 'Medians:  image = %.1f, dark = %.1f' % (np.median(im_raw), dark.median))
+
+        # Do image arithmetic: subtract dark, divide by normalized flat, add pedestal,
+        # restrict pixel range to 16 bits [0, pmax] and truncate
+        im_cal = calibrate_frame(im_raw, flat.data, im_dark=dark.data, pedestal=pedestal,
+                                 rounding='floor', chunk_rows=self.chunk_rows)
+        del im_raw
+        # Fix bad columns
+        fix_columns(im_cal, bad_columns)
+
+        # Add comments to header documenting calibration
+        hdr_cal = hdr_raw
+        hdr_cal['PEDESTAL'] = pedestal
+        hdr_cal.add_comment('Calibrated using cmos-calib')
+        hdr_cal.add_comment('Dark frame = %s' % dark.path)
+        hdr_cal.add_comment('Flat frame = %s' % flat.path)
+        hdr_cal.add_comment('Pedestal added during calibration = %i' % pedestal)
+
+        # Update CALSTAT keyword so other programs realize this image is calibrated
+        hdr_cal.set('CALSTAT', value='DF', comment='CMOS_calib run', before='INSTRUME')
+
+        # Remove hot pixels if requested
+        if N_iter > 0:
+            t0 = time.time()
+            mask, im_clean = astroscrappy.detect_cosmics(as_float32(im_cal), niter = N_iter, readnoise= RN)
+            im_cal = np.rint(np.clip(im_clean, 0, pmax)).astype(np.uint16)
+            del mask, im_clean
+            hdr_cal.add_comment('Removed hot pixels using astroscrappy, %i iterations' % N_iter)
+
+        # Unsigned 16-bit for Talon (camera,etc): astropy writes int16 with BZERO = 32768
+        for key in ('BSCALE', 'BZERO'): hdr_cal.remove(key, ignore_missing=True)
+        hdu = pyfits.PrimaryHDU(im_cal, hdr_cal)
+        # Write to a temporary file and rename it, so an interrupted calibration never
+        # leaves a partially-written image behind
+        tmp_image = cal_image + '.tmp'
+        hdu.writeto(tmp_image, overwrite=True, output_verify='ignore')
+        os.replace(tmp_image, cal_image)
+        self.log(messages, 'Wrote %s' % cal_image)
+        if N_iter > 0:
+            self.log(messages, 'Hot pixel removal took: %.1f sec' % (time.time() - t0))
+
+        self.images += 1
+        self.seconds += time.time() - t_start
+        return messages
+
+    def calibrate_batch(self, raw_images, **kwargs):
+        ''' Calibrate a list of images in place, grouped so that images sharing
+            master frames are done together. Returns a dict raw_image -> messages,
+            or the CalibrationError/OSError if that image failed.'''
+        def sort_key(img):
+            try:
+                hdr = pyfits.getheader(img)
+                return (hdr['XBINNING'], hdr['READOUTM'], hdr['filter'][0].upper(), round(hdr['EXPTIME'], 2))
+            except Exception:
+                return ()
+        results = {}
+        for img in sorted(raw_images, key=sort_key):
+            try:
+                results[img] = self.calibrate(img, **kwargs)
+            except (CalibrationError, OSError, KeyError) as e:
+                results[img] = e
+        return results
+
+    def stats(self):
+        ''' One-line summary of images calibrated and master frame cache use'''
+        per_image = self.seconds/self.images if self.images else 0
+        return 'Calibrated %i images in %.1f sec (%.2f sec/image); master darks read %i times (%i reused), flats read %i times (%i reused)' % \
+            (self.images, self.seconds, per_image, self.darks.misses, self.darks.hits, self.flats.misses, self.flats.hits)
@@ -0,0 +1,118 @@
+"""Persistent index of FITS headers
+
+Reports such as fitslist and email-summary only need a few header keywords, but
+fits.getdata() reads the whole image. FitsIndex reads just the primary header
+blocks of each file (up to the END card, never the pixel data) and keeps them in
+an SQLite file together with the file's size and modification time. A file is
+only read again when its size or mtime changes, so listing a night or a year of
+images that have been indexed before costs one stat() per file.
+
+    from fitsindex import FitsIndex
+    index = FitsIndex()                        # default index file, see default_index_path()
+    for path, hdr in index.headers(glob.glob('*.fts')):
+        print(path, hdr['OBJECT'])
+    index.close()
+
+Files whose header cannot be read (missing, empty, truncated or not FITS) are
+reported with hdr = None. headers() reads and commits batch files at a time
+before handing them out, so the index is not locked while the caller works.
+"""
+
+import itertools
+import os
+import sqlite3
+import zlib
+from pathlib import Path
+
+from astropy.io import fits
+
+# the first writable location is used
+index_paths = [Path('/usr/local/telescope/archive/fitsindex.db'),
+               Path.home() / '.fitsindex.db']
+
+SCHEMA = """
+create table if not exists headers (
+    path text primary key, size integer, mtime real,
+    date_obs text, object text, filter text, header blob);
+create index if not exists headers_date_obs on headers (date_obs);
+"""
+
+def default_index_path():
+    """Return the first index path whose directory is writable (or ':memory:')"""
+    for path in index_paths:
+        if path.exists() and os.access(path, os.W_OK):
+            return path
+        if not path.exists() and os.access(path.parent, os.W_OK):
+            return path
+    return ':memory:'
+
+def read_header(path):
+    """Read the primary header of a FITS file without reading any data"""
+    with open(path, 'rb') as f:
+        return fits.Header.fromfile(f)
+
+class FitsIndex:
+    def __init__(self, db_path=None):
+        """db_path: SQLite file (default: default_index_path())"""
+        if db_path is None:
+            db_path = default_index_path()
+        self.db = sqlite3.connect(str(db_path))
+        self.db.executescript(SCHEMA)
+        self.reads = 0   # headers read from files
+        self.hits = 0    # headers taken from the index
+
+    def header(self, path):
+        """Return the primary header of path (None if unreadable), reading the file only if it changed"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.db.execute('select size, mtime, header from headers where path = ?', (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            self.hits += 1
+            if row[2] is None:
+                return None
+            return fits.Header.fromstring(zlib.decompress(row[2]).decode('ascii'))
+
+        self.reads += 1
+        try:
+            hdr = read_header(path)
+        except Exception:  # OSError, ValueError, EOFError (empty or truncated file), ...
+            hdr = None
+        if hdr is None:
+            values = (path, st.st_size, st.st_mtime, None, None, None, None)
+        else:
+            values = (path, st.st_size, st.st_mtime, str(hdr.get('DATE-OBS', '')), str(hdr.get('OBJECT', '')),
+                      str(hdr.get('FILTER', '')), zlib.compress(hdr.tostring().encode('ascii')))
+        self.db.execute('insert or replace into headers values (?,?,?,?,?,?,?)', values)
+        return hdr
+
+    def headers(self, paths, batch=100):
+        """Yield (path, header) for each path, updating the index as needed.
+        Each batch of files is indexed and committed before it is yielded"""
+        paths = iter(paths)
+        while True:
+            chunk = [(path, self.header(path)) for path in itertools.islice(paths, batch)]
+            if not chunk:
+                return
+            self.db.commit()
+            yield from chunk
+
+    def update(self, paths):
+        """Bring the index up to date for paths; returns the number of files read"""
+        reads = self.reads
+        for path, hdr in self.headers(paths):
+            pass
+        return self.reads - reads
+
+    def forget_missing(self):
+        """Remove entries for files that no longer exist; returns how many were removed"""
+        gone = [(p,) for (p,) in self.db.execute('select path from headers') if not os.path.exists(p)]
+        with self.db:
+            self.db.executemany('delete from headers where path = ?', gone)
+        return len(gone)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,209 @@
+"""Building blocks for the process-images daemon
+
+DirWatcher  - reports new files in the landing directory as they arrive (Linux
+              inotify, through ctypes; polling on other systems)
+ImageState  - SQLite record of every image seen and how far it got, so the daemon
+              can be restarted at any point without losing or reprocessing frames.
+              It is also the queue: images wait there, not in memory, until a
+              worker is free (backpressure)
+Metrics     - queue depth and per-stage latency, logged and written as JSON
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import sqlite3
+import struct
+import time
+from pathlib import Path
+
+# inotify event masks (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct('iIII')
+
+class DirWatcher:
+    """Watch a directory for new files matching a glob pattern
+
+    Files are reported once they have been closed after writing or renamed
+    into the directory, so partially-written files are never returned.
+    Without inotify the directory is globbed every poll_seconds instead.
+    """
+
+    def __init__(self, directory, pattern='*.fts', poll_seconds=5):
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.poll_seconds = poll_seconds
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            if libc.inotify_add_watch(fd, str(self.directory).encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f'cannot watch {self.directory}')
+            self.fd = fd
+        except (OSError, AttributeError, TypeError):
+            self.fd = None
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else f'polling every {self.poll_seconds} s'
+
+    def scan(self):
+        """Return every file currently matching the pattern"""
+        return sorted(self.directory.glob(self.pattern))
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds; return the list of files that arrived"""
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_seconds))
+            return self.scan()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        files = []
+        try:
+            while True:
+                data = os.read(self.fd, 65536)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    name = data[offset:offset+length].rstrip(b'\0').decode(errors='replace')
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        return self.scan() # events were lost
+                    path = self.directory / name
+                    if name and path.match(self.pattern) and path not in files:
+                        files.append(path)
+        except BlockingIOError:
+            pass
+        return files
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+SCHEMA = """
+create table if not exists images (
+    name text primary key, state text, attempts integer,
+    seen real, started real, finished real, message text);
+create index if not exists images_state on images (state, seen);
+"""
+
+class ImageState:
+    """Per-image processing state, kept in an SQLite file
+
+    States: queued -> processing -> done | failed
+    Every transition is committed before the work it describes starts or
+    after it has finished, so after a crash an image is either still
+    queued, finished, or marked processing (and retried by recover()).
+    """
+
+    def __init__(self, db_path, max_attempts=3):
+        self.db = sqlite3.connect(str(db_path))
+        self.db.executescript(SCHEMA)
+        self.max_attempts = max_attempts
+
+    def add(self, name, now=None):
+        """Queue an image unless it is already known; returns True if it was new"""
+        now = now or time.time()
+        with self.db:
+            cur = self.db.execute("insert or ignore into images values (?, 'queued', 0, ?, null, null, null)", (name, now))
+        return cur.rowcount > 0
+
+    def next_queued(self, limit):
+        """Names of up to limit queued images, oldest first"""
+        rows = self.db.execute("select name from images where state = 'queued' order by seen limit ?", (limit,))
+        return [r[0] for r in rows]
+
+    def start(self, name):
+        with self.db:
+            self.db.execute("update images set state = 'processing', attempts = attempts + 1, started = ? where name = ?",
+                            (time.time(), name))
+
+    def finish(self, name, state, message=None):
+        with self.db:
+            self.db.execute("update images set state = ?, finished = ?, message = ? where name = ?",
+                            (state, time.time(), message, name))
+
+    def get(self, name):
+        """Return (state, attempts, seen) or None"""
+        return self.db.execute("select state, attempts, seen from images where name = ?", (name,)).fetchone()
+
+    def recover(self):
+        """Requeue images left in 'processing' by a crash; those that have already
+        been tried max_attempts times are marked failed. Returns (requeued, failed) names."""
+        rows = self.db.execute("select name, attempts from images where state = 'processing'").fetchall()
+        requeued = [name for name, attempts in rows if attempts < self.max_attempts]
+        failed = [name for name, attempts in rows if attempts >= self.max_attempts]
+        with self.db:
+            self.db.executemany("update images set state = 'queued' where name = ?", [(n,) for n in requeued])
+            self.db.executemany("update images set state = 'failed', message = 'too many attempts' where name = ?",
+                                [(n,) for n in failed])
+        return requeued, failed
+
+    def finished_before(self, t):
+        """Names of done/failed images finished before time t"""
+        rows = self.db.execute("select name from images where state in ('done', 'failed') and finished < ?", (t,))
+        return [r[0] for r in rows]
+
+    def forget(self, names):
+        with self.db:
+            self.db.executemany("delete from images where name = ?", [(n,) for n in names])
+
+    def counts(self):
+        """Dict state -> number of images"""
+        return dict(self.db.execute("select state, count(*) from images group by state").fetchall())
+
+    def close(self):
+        self.db.close()
+
+class Metrics:
+    """Queue depth and per-stage latency (seconds) since the daemon started"""
+
+    def __init__(self, json_path=None):
+        self.json_path = json_path
+        self.stages = {}  # stage -> [count, total, max]
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.images = 0
+        self.started = time.time()
+
+    def record(self, timings):
+        """Add a dict of stage -> seconds for one image"""
+        self.images += 1
+        for stage, seconds in timings.items():
+            s = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            s[0] += 1; s[1] += seconds; s[2] = max(s[2], seconds)
+
+    def set_depth(self, queue_depth, in_flight):
+        self.queue_depth = queue_depth
+        self.in_flight = in_flight
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def summary(self):
+        stages = ', '.join(f'{stage} {s[1]/s[0]:.1f}/{s[2]:.1f}' for stage, s in self.stages.items())
+        return (f'queue {self.queue_depth} (max {self.max_queue_depth}), in progress {self.in_flight}, '
+                f'{self.images} images done; mean/max seconds: {stages}')
+
+    def write(self):
+        """Write the metrics as JSON (for monitoring), if a path was given"""
+        if self.json_path is None:
+            return
+        data = dict(time=time.time(), uptime=time.time() - self.started,
+                    queue_depth=self.queue_depth, max_queue_depth=self.max_queue_depth,
+                    in_flight=self.in_flight, images=self.images,
+                    stages={stage: dict(count=s[0], mean=s[1]/s[0], max=s[2]) for stage, s in self.stages.items()})
+        tmp = str(self.json_path) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.json_path)
@@ -0,0 +1,73 @@
+'''
+Indexed store for XEphem EDB catalogs (asteroids.edb, asteroids_dim.edb, comets.edb)
+
+The catalogs run to hundreds of thousands of lines, so instead of reading them into
+lists on every run, an SQLite index of (catalog, lower case name) -> (byte offset, length)
+is built once. A lookup is one indexed query plus one seek into the .edb file, and
+callers run ephem.readdb on the returned line only for the objects actually scheduled. A catalog is
+re-indexed when its size or modification time changes.
+'''
+
+import os, sqlite3
+from objcache import normalize_name
+
+SCHEMA = '''
+create table if not exists files (catalog text primary key, mtime real, size integer);
+create table if not exists names (catalog text, name text, offset integer, length integer, primary key (catalog, name));
+'''
+
+class EdbCatalog:
+    '''
+    catalogs:   list of .edb files, searched in order
+    index_path: SQLite index file; if it cannot be opened, an in-memory index is used
+    '''
+    def __init__(self, catalogs, index_path):
+        self.catalogs = [os.path.abspath(c) for c in catalogs]
+        try:
+            self.db = sqlite3.connect(index_path)
+            self.db.executescript(SCHEMA)
+        except sqlite3.Error:
+            self.db = sqlite3.connect(':memory:')
+            self.db.executescript(SCHEMA)
+        self.files = {}
+        self.update()
+
+    def update(self):
+        ''' Re-index every catalog whose size or mtime differs from the indexed one '''
+        for path in self.catalogs:
+            if not os.path.isfile(path): continue
+            st = os.stat(path)
+            row = self.db.execute('select mtime, size from files where catalog = ?', (path,)).fetchone()
+            if row is not None and row[0] == st.st_mtime and row[1] == st.st_size: continue
+            with self.db:
+                self.db.execute('delete from names where catalog = ?', (path,))
+                self.db.executemany('insert or ignore into names values (?,?,?,?)', self._scan(path))
+                self.db.execute('insert or replace into files values (?,?,?)', (path, st.st_mtime, st.st_size))
+
+    def _scan(self, path):
+        # Yield (catalog, name, offset, length) for each non-comment line
+        offset = 0
+        with open(path, 'rb') as fn:
+            for line in fn:
+                if not line.startswith(b'#') and line.strip():
+                    name = line.split(b',')[0].decode('utf-8', errors='ignore')
+                    yield (path, normalize_name(name), offset, len(line))
+                offset += len(line)
+
+    def lookup(self, objname):
+        ''' Return the EDB line for objname (first catalog that has it), or None '''
+        name = normalize_name(objname)
+        for path in self.catalogs:
+            row = self.db.execute('select offset, length from names where catalog = ? and name = ?', (path, name)).fetchone()
+            if row is None: continue
+            fn = self.files.get(path)
+            if fn is None:
+                fn = self.files[path] = open(path, 'rb')
+            fn.seek(row[0])
+            return fn.read(row[1]).decode('utf-8', errors='ignore').strip()
+        return None
+
+    def close(self):
+        for fn in self.files.values(): fn.close()
+        self.files = {}
+        self.db.close()
@@ -0,0 +1,178 @@
+'''
+Vectorized time-slice grid for schedtel
+
+The night is divided into Nslice equal time slices. Instead of calling
+object.compute(observatory) for every (scan, slice) pair, the altitude of every
+distinct target is computed for all slices at once:
+
+    - LST and UT of each slice are linear in the slice index, so they are computed
+      from one ephem evaluation at the first slice
+    - Fixed targets get their apparent (epoch of date) RA/Dec from one ephem compute,
+      then alt = asin(sin(lat) sin(dec) + cos(lat) cos(dec) cos(LST - RA)) plus refraction
+    - Moving targets (asteroid/comet EDB) are computed by ephem on a coarse node grid
+      and interpolated onto the slices
+
+Free windows are found from a cumulative sum of the occupied slices. Because the
+vectorized altitudes differ from ephem by a few arcsec, the best slot is confirmed
+by re-evaluating the few candidate slices within TOL_DEG of the maximum with ephem,
+so the slot chosen is the same one the slice-by-slice loop in schedtel picked.
+'''
+
+import ephem as ep
+import numpy as np
+from math import pi
+
+deg = pi/180.
+sidereal_rate = 1.00273790935   # Sidereal days per solar day
+TOL_DEG = 0.01                  # Max. error of vectorized altitudes [deg]
+TOL_HR  = 1.e-5                 # Max. error of vectorized UT/LST [hr]
+NODE_TIME = 15*ep.minute        # Node spacing for moving targets
+
+def exact_times(observatory, t):
+    ''' UT and LST (fractional hr) at ephem date t, as computed by schedtel get_times() '''
+    observatory.date = t
+    y,m,d = t.triple()
+    ut_hr  = (d % 1) * 24.
+    lst_hr = float(observatory.sidereal_time()) * 12./np.pi
+    return ut_hr, lst_hr
+
+def exact_alt(observatory, obj, t):
+    ''' Altitude [deg] of ephem body obj at ephem date t '''
+    observatory.date = t
+    obj.compute(observatory)
+    return float(obj.alt)/deg
+
+def refraction(alt, pressure, temp):
+    ''' Refraction [rad] to add to true altitude alt [rad], same model as libastro '''
+    altdeg = np.degrees(alt)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        high = 7.888888e-5 * pressure / ((273. + temp) * np.tan(alt))
+        low  = np.radians((0.1594 + 0.0196*altdeg + 2e-5*altdeg**2) * pressure / \
+               ((273. + temp) * (1. + 0.505*altdeg + 0.0845*altdeg**2)))
+    r = np.where(altdeg >= 15., high, low)
+    return np.where(np.isfinite(r), r, 0.)
+
+def lst_hours(observatory, ep_times):
+    ''' LST [hr] at ephem dates ep_times, from one ephem evaluation at the first time '''
+    ep_times = np.asarray(ep_times, dtype=float)
+    ut0, lst0 = exact_times(observatory, ep.Date(ep_times.flat[0]))
+    return np.mod(lst0 + (ep_times - ep_times.flat[0]) * sidereal_rate * 24., 24.)
+
+def horizon_coords(observatory, lst_hr, ra, dec):
+    ''' Altitude (refracted) and azimuth [deg] of apparent (epoch of date) ra, dec [rad] at LST lst_hr [hr] '''
+    lat = float(observatory.lat)
+    H = lst_hr * np.pi/12. - ra
+    alt = np.arcsin(np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(H))
+    az  = np.arctan2(-np.cos(dec)*np.sin(H), np.sin(dec)*np.cos(lat) - np.cos(dec)*np.cos(H)*np.sin(lat))
+    alt += refraction(alt, observatory.pressure, observatory.temp)
+    return np.degrees(alt), np.mod(np.degrees(az), 360.)
+
+def airmass(alt):
+    ''' Airmass (sec z) at altitude alt [deg], NaN below the horizon '''
+    return np.where(alt > 0, 1./np.sin(np.maximum(alt, 1.e-6)*deg), np.nan)
+
+class NightGrid:
+    '''
+    Slice grid for one night
+
+    observatory: ephem.Observer (lat, long, pressure, temp are used; date is overwritten)
+    jd_slice:    Start JD of each slice
+    free:        Initial slice status, True = available (e.g. False for focus runs)
+    '''
+    def __init__(self, observatory, jd_slice, free):
+        self.observatory = observatory
+        self.jd_slice = np.asarray(jd_slice, dtype=float)
+        self.ep_slice = self.jd_slice - 2415020
+        self.Nslice = len(self.jd_slice)
+        self.free = np.array(free, dtype=bool)
+        self.lat = float(observatory.lat)
+
+        # LST, UT of each slice [hr]
+        self.lst_hr = lst_hours(observatory, self.ep_slice)
+        self.ut_hr  = np.mod(self.ep_slice + 0.5, 1.) * 24.
+        self.rows = {}
+        self.alt = np.zeros((0, self.Nslice))
+
+    def add_targets(self, edbs):
+        ''' Compute altitude rows [deg] for all EDB strings not yet in the grid '''
+        new = [edb for edb in dict.fromkeys(edbs) if edb not in self.rows]
+        if not new: return
+        ra = np.empty((len(new), self.Nslice)); dec = np.empty_like(ra)
+        tmid = ep.Date(self.ep_slice[self.Nslice//2])
+        nodes = np.arange(self.ep_slice[0], self.ep_slice[-1] + NODE_TIME, NODE_TIME)
+        for i, edb in enumerate(new):
+            obj = ep.readdb(edb)
+            if isinstance(obj, ep.FixedBody):
+                self.observatory.date = tmid
+                obj.compute(self.observatory)
+                ra[i] = float(obj.ra); dec[i] = float(obj.dec)
+            else:
+                node_ra = []; node_dec = []
+                for t in nodes:
+                    self.observatory.date = ep.Date(t)
+                    obj.compute(self.observatory)
+                    node_ra.append(float(obj.ra)); node_dec.append(float(obj.dec))
+                ra[i]  = np.interp(self.ep_slice, nodes, np.unwrap(node_ra))
+                dec[i] = np.interp(self.ep_slice, nodes, node_dec)
+        alt, az = horizon_coords(self.observatory, self.lst_hr, ra, dec)
+        nrow = len(self.rows)
+        for i, edb in enumerate(new):
+            self.rows[edb] = nrow + i
+        self.alt = np.vstack([self.alt, alt])
+
+    def altitudes(self, edb):
+        ''' Altitude [deg] of target edb in every slice '''
+        if edb not in self.rows: self.add_targets([edb])
+        return self.alt[self.rows[edb]]
+
+    def airmass(self, edb):
+        ''' Airmass (sec z) of target edb in every slice, NaN below the horizon '''
+        return airmass(self.altitudes(edb))
+
+    def free_windows(self, nslice):
+        '''
+        Boolean array, True where slices k..k+nslice-1 are all free,
+        for the start slices k = 0..Nslice-nslice-3 searched by schedtel
+        '''
+        n = self.Nslice - nslice - 2
+        if n <= 0: return np.zeros(0, dtype=bool)
+        busy = np.concatenate(([0], np.cumsum(~self.free)))
+        return (busy[nslice:nslice+n] - busy[:n]) == 0
+
+    def allocate(self, kstart, nslice):
+        ''' Mark slices kstart..kstart+nslice as taken '''
+        self.free[kstart:kstart+nslice+1] = False
+
+    def best_slot(self, edb, nslice, schedule_type='', start_hr=None, eldeg_min=0.):
+        '''
+        Find the start slice for a scan of nslice slices.
+        schedule_type '' picks the highest altitude above eldeg_min, 'ut'/'lst' the slice
+        closest to start_hr. Returns (kmax, eldeg_max); kmax == 0 means not scheduled.
+        '''
+        windows = self.free_windows(nslice)
+        k = np.flatnonzero(windows)
+        if len(k) == 0: return 0, 0
+        obj = ep.readdb(edb)
+        if schedule_type in ('ut', 'lst'):
+            hr = self.ut_hr if schedule_type == 'ut' else self.lst_hr
+            diff = np.abs(start_hr - hr[k])
+            cands = k[diff <= diff.min() + TOL_HR]
+            kmax = 0; diff_max = 99
+            for kc in cands:
+                ut_hr, lst_hr = exact_times(self.observatory, ep.Date(self.ep_slice[kc]))
+                d = np.abs(start_hr - (ut_hr if schedule_type == 'ut' else lst_hr))
+                if d < diff_max:
+                    kmax = kc; diff_max = d
+            return int(kmax), exact_alt(self.observatory, obj, ep.Date(self.ep_slice[kmax]))
+        alt = self.altitudes(edb)[k]
+        ok = alt >= max(eldeg_min, 0.) - TOL_DEG
+        if not ok.any(): return 0, 0
+        k = k[ok]; alt = alt[ok]
+        cands = k[alt >= alt.max() - 2*TOL_DEG]
+        kmax = 0; eldeg_max = 0
+        for kc in cands:
+            eldeg = exact_alt(self.observatory, obj, ep.Date(self.ep_slice[kc]))
+            if eldeg < eldeg_min: continue
+            if eldeg > eldeg_max:
+                kmax = kc; eldeg_max = eldeg
+        return int(kmax), eldeg_max
@@ -0,0 +1,76 @@
+'''
+Persistent object-resolution cache for schedtel
+
+Resolved coordinates are stored in a JSON file, keyed by normalized object name.
+Positions of solar-system objects (planets, catalog asteroids/comets, JPL Horizons)
+depend on the night, so those entries are also keyed by epoch; Simbad positions
+are fixed and shared by all nights. Each source type has its own time-to-live.
+Failed lookups are remembered for a short time so a missing name is not
+re-queried for every scan that repeats it.
+'''
+
+import json, os, time
+
+# Time-to-live of cache entries by source type [sec]
+TTL = {'catalog': 12*3600, 'horizons': 12*3600, 'simbad': 30*86400, 'failed': 3600}
+
+# Sources whose positions are valid for one epoch only
+EPOCH_SOURCES = ('catalog', 'horizons')
+
+def normalize_name(objname):
+    ''' Lower case, single blanks: "  NGC   7000 " -> "ngc 7000" '''
+    return ' '.join(objname.lower().split())
+
+class ObjectCache:
+    '''
+    Resolution cache backed by a JSON file. Entries are loaded once and
+    written back by save(); a missing or unreadable file starts an empty cache.
+    '''
+    def __init__(self, path, ttl=TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0; self.misses = 0
+        self.changed = False
+        if path and os.path.isfile(path):
+            try:
+                with open(path, 'r') as fn:
+                    self.entries = json.load(fn)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def _key(self, name, epoch, source):
+        if source in EPOCH_SOURCES: return '%s|%s' % (name, epoch)
+        return name
+
+    def get(self, objname, epoch):
+        ''' Return cached (success, fixed, ra_str, dec_str, edb) for objname at epoch, or None '''
+        name = normalize_name(objname)
+        now = time.time()
+        for key in ('%s|%s' % (name, epoch), name):
+            entry = self.entries.get(key)
+            if entry is None: continue
+            if now - entry['time'] > self.ttl.get(entry['source'], 0):
+                del self.entries[key]; self.changed = True
+                continue
+            self.hits += 1
+            return tuple(entry['result'])
+        self.misses += 1
+        return None
+
+    def put(self, objname, epoch, source, result):
+        ''' Store result (success, fixed, ra_str, dec_str, edb) found from source '''
+        name = normalize_name(objname)
+        self.entries[self._key(name, epoch, source)] = {'source': source, 'time': time.time(), 'result': list(result)}
+        self.changed = True
+
+    def save(self):
+        ''' Write cache back to disk, dropping expired entries '''
+        if not self.path or not self.changed: return
+        now = time.time()
+        entries = {k:e for k,e in self.entries.items() if now - e['time'] <= self.ttl.get(e['source'], 0)}
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, 'w') as fn:
+            json.dump(entries, fn)
+        os.replace(tmpfile, self.path)
+        self.changed = False
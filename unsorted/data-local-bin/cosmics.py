@@ -54,10 +54,13 @@ Ideas for future improvements :
 Malte Tewes, January 2010
 
 v.0.41 RLM 27 Apr 2018: Fixed if self.satstars != None: test to: if self.satstars.any() != 'False': (3 instances)
+v.0.42 17 Oct 2026: clean() computes all masked medians at once and keeps its padded buffer between iterations
+        (same masks and cleaned values as before); findsatstars() selects the saturated islands in one pass;
+        None tests use "is None"; np.cast and np.alen (removed from numpy) replaced
 
 """
 
-__version__ = '0.41'
+__version__ = '0.42'
 
 import os
 import numpy as np
@@ -115,7 +118,7 @@ class cosmicsimage:
         """
         self.rawarray = rawarray + pssl # internally, we will always work "with sky".
         self.cleanarray = self.rawarray.copy() # In lacosmiciteration() we work on this guy
-        self.mask = np.cast['bool'](np.zeros(self.rawarray.shape)) # All False, no cosmics yet
+        self.mask = np.zeros(self.rawarray.shape, dtype=bool) # All False, no cosmics yet
         
         self.gain = gain
         self.readnoise = readnoise
@@ -130,6 +133,7 @@ class cosmicsimage:
             
         self.backgroundlevel = None # only calculated and used if required.
         self.satstars = None # a mask of the saturated stars, only calculated if required
+        self.padarray = None # Inf-padded copy of cleanarray used by clean(), kept between iterations
 
     def __str__(self):
         """
@@ -143,7 +147,7 @@ class cosmicsimage:
         if self.pssl != 0.0:
             stringlist.append("Using a previously subtracted sky level of %f" % self.pssl)
             
-        if self.satstars != None:
+        if self.satstars is not None:
             stringlist.append("Saturated star mask : %i pixels" % np.sum(self.satstars))
         
         return "\n".join(stringlist)
@@ -200,70 +204,71 @@ class cosmicsimage:
     def clean(self, mask = None, verbose = None):
         """
         Given the mask, we replace the actual problematic pixels with the masked 5x5 median value.
-        This mimics what is done in L.A.Cosmic, but it's a bit harder to do in python, as there is no
-        readymade masked median. So for now we do a loop...
-        Saturated stars, if calculated, are also masked : they are not "cleaned", but their pixels are not
-        used for the interpolation.
-        
+        This mimics what is done in L.A.Cosmic : the median skips the cosmic pixels, the saturated
+        stars (if calculated, they are not "cleaned", but their pixels are not used for the interpolation)
+        and the area outside the image.
+        All the medians are computed at once : the 25 neighbours of every cosmic pixel are gathered from
+        an Inf-padded copy of the image, each row is sorted (the Infs go to the end) and the median is
+        taken from its good values, exactly as np.median would do.
+
         We will directly change self.cleanimage. Instead of using the self.mask, you can supply your
         own mask as argument. This might be useful to apply this cleaning function iteratively.
         But for the true L.A.Cosmic, we don't use this, i.e. we use the full mask at each iteration.
 
         """
-        if verbose == None:
+        if verbose is None:
             verbose = self.verbose
-        if mask == None:
+        if mask is None:
             mask = self.mask
-            
+
         if verbose:
             print("Cleaning cosmic affected pixels ...")
-        
+
         # So... mask is a 2D array containing False and True, where True means "here is a cosmic"
-        # We want to loop through these cosmics one by one.
-        cosmicindices = np.argwhere(mask)
-        # This is a list of the indices of cosmic affected pixels.
-        #print cosmicindices
-        
-        # We put cosmic ray pixels to np.Inf to flag them :
-        self.cleanarray[mask] = np.Inf
-        
-        # Now we want to have a 2 pixel frame of Inf padding around our image.
+        (cx, cy) = np.nonzero(mask)
+
+        # The medians are evaluated in a copy of cleanarray with a 2 pixel frame of Inf padding,
+        # in which the cosmic ray pixels and the saturated stars are also put to np.Inf.
+        # The buffer (and its frame) is kept for the next iterations.
         w = self.cleanarray.shape[0]
         h = self.cleanarray.shape[1]
-        padarray = np.zeros((w+4,h+4))+np.Inf
-        padarray[2:w+2,2:h+2] = self.cleanarray.copy() # that copy is important, we need 2 independent arrays
-        
-        # The medians will be evaluated in this padarray, skipping the np.Inf.
-        # Now in this copy called padarray, we also put the saturated stars to np.Inf, if available :
-        #if self.satstars != None:
-        if self.satstars.any() != 'False':
-            padarray[2:w+2,2:h+2][self.satstars] = np.Inf
-            # Viva python, I tested this one, it works...
-        
-        # A loop through every cosmic pixel :
-        for cosmicpos in cosmicindices:
-            x = cosmicpos[0]
-            y = cosmicpos[1]
-            cutout = padarray[x:x+5, y:y+5].ravel() # remember the shift due to the padding !
-            #print cutout
-            # Now we have our 25 pixels, some of them are np.Inf, and we want to take the median
-            goodcutout = cutout[cutout != np.Inf]
-            #print np.alen(goodcutout)
-            
-            if np.alen(goodcutout) >= 25 :
+        if self.padarray is None or self.padarray.shape != (w+4, h+4):
+            self.padarray = np.full((w+4, h+4), np.inf)
+        inner = self.padarray[2:w+2,2:h+2]
+        inner[...] = self.cleanarray
+        inner[mask] = np.inf
+        if self.satstars is not None:
+            inner[self.satstars] = np.inf
+
+        # The 5x5 cutouts of the cosmic pixels, in chunks to limit the memory used
+        (dx, dy) = np.mgrid[0:5, 0:5]
+        dx = dx.ravel(); dy = dy.ravel()
+        chunk = 100000
+        for start in range(0, len(cx), chunk):
+            x = cx[start:start+chunk]
+            y = cy[start:start+chunk]
+            cutouts = self.padarray[x[:,None] + dx, y[:,None] + dy] # remember the shift due to the padding !
+            cutouts.sort(axis=1)
+            ngood = np.sum(cutouts != np.inf, axis=1)
+
+            if np.any(ngood >= 25):
                 # This never happened, but you never know ...
                 raise RuntimeError("Mega error in clean !")
-            elif np.alen(goodcutout) > 0 :
-                replacementvalue = np.median(goodcutout)
-            else :  
+
+            rows = np.arange(len(x))
+            k = ngood // 2
+            replacementvalues = cutouts[rows, k]
+            even = (ngood % 2 == 0) & (ngood > 0)
+            replacementvalues[even] = (cutouts[rows[even], k[even] - 1] + cutouts[rows[even], k[even]]) / 2.0
+            if np.any(ngood == 0):
                 # i.e. no good pixels : Shit, a huge cosmic, we will have to improvise ...
                 print("OH NO, I HAVE A HUUUUUUUGE COSMIC !!!!!")
-                replacementvalue = self.guessbackgroundlevel()
-            
+                replacementvalues[ngood == 0] = self.guessbackgroundlevel()
+
             # We update the cleanarray,
             # but measure the medians in the padarray, so to not mix things up...
-            self.cleanarray[x, y] = replacementvalue
-            
+            self.cleanarray[x, y] = replacementvalues
+
         # That's it.
         if verbose:
             print("Cleaning done")
@@ -333,17 +338,9 @@ class cosmicsimage:
         if verbose:
                 print("We have %i saturated stars." % nsat)
         
-        # The ouput, False for now :
-        outmask = np.zeros(self.rawarray.shape)
-        
-        for i in range(1,nsat+1): # we go through the islands of saturated pixels
-            thisisland = dilsatlabels == i # gives us a boolean array
-            # Does this intersect with satstarscenters ?
-            overlap = np.logical_and(thisisland, satstarscenters)
-            if np.sum(overlap) > 0:
-                outmask = np.logical_or(outmask, thisisland) # we add thisisland to the mask
-            
-        self.satstars = np.cast['bool'](outmask)
+        # The mask is made of the islands that intersect with satstarscenters :
+        satislands = np.unique(dilsatlabels[satstarscenters])
+        self.satstars = np.isin(dilsatlabels, satislands[satislands > 0])
         
         if verbose:
                 print("Mask of saturated stars done")
@@ -357,7 +354,7 @@ class cosmicsimage:
             verbose = self.verbose
         if not self.satlevel > 0:
             raise RuntimeError("Cannot determine satstars : you gave satlevel <= 0 !") 
-        if self.satstars == None:
+        if self.satstars is None:
             self.findsatstars(verbose = verbose)
         return self.satstars
 
@@ -381,7 +378,7 @@ class cosmicsimage:
         """
         Estimates the background level. This could be used to fill pixels in large cosmics.
         """
-        if self.backgroundlevel == None:
+        if self.backgroundlevel is None:
             self.backgroundlevel = np.median(self.rawarray.ravel())
         return self.backgroundlevel
         
@@ -448,8 +445,7 @@ class cosmicsimage:
             print("  %5i candidate pixels" % nbcandidates)
         
         # At this stage we use the saturated stars to mask the candidates, if available :
-        #if self.satstars != None:
-        if self.satstars.any() != 'False':
+        if self.satstars is not None:
             if verbose:
                 print("Masking saturated stars ...")
             candidates = np.logical_and(np.logical_not(self.satstars), candidates)
@@ -490,7 +486,7 @@ class cosmicsimage:
             print("Finding neighboring pixels affected by cosmic rays ...")
             
         # We grow these cosmics a first time to determine the immediate neighborhod  :
-        growcosmics = np.cast['bool'](signal.convolve2d(np.cast['float32'](cosmics), growkernel, mode="same", boundary="symm"))
+        growcosmics = signal.convolve2d(cosmics.astype('float32'), growkernel, mode="same", boundary="symm").astype(bool)
         
         # From this grown set, we keep those that have sp > sigmalim
         # so obviously not requiring sp/f > objlim, otherwise it would be pointless
@@ -498,12 +494,11 @@ class cosmicsimage:
         
         # Now we repeat this procedure, but lower the detection limit to sigmalimlow :
             
-        finalsel = np.cast['bool'](signal.convolve2d(np.cast['float32'](growcosmics), growkernel, mode="same", boundary="symm"))
+        finalsel = signal.convolve2d(growcosmics.astype('float32'), growkernel, mode="same", boundary="symm").astype(bool)
         finalsel = np.logical_and(sp > self.sigcliplow, finalsel)
         
         # Again, we have to kick out pixels on saturated stars :
-        #if self.satstars != None:
-        if self.satstars.any() != 'False':
+        if self.satstars is not None:
             if verbose:
                 print("Masking saturated stars ...")
             finalsel = np.logical_and(np.logical_not(self.satstars), finalsel)
@@ -597,7 +592,7 @@ class cosmicsimage:
         Stops if no cosmics are found or if maxiter is reached.
         """
             
-        if self.satlevel > 0 and self.satstars == None:
+        if self.satlevel > 0 and self.satstars is None:
             self.findsatstars(verbose=True)
             
         print("Starting %i L.A.Cosmic iterations ..." % maxiter)
@@ -664,12 +659,12 @@ def tofits(outfilename, pixelarray, hdr = None, verbose = True):
         print("FITS export shape : (%i, %i)" % (pixelarrayshape[0], pixelarrayshape[1]))
 
     if pixelarray.dtype.name == "bool":
-        pixelarray = np.cast["uint8"](pixelarray)
+        pixelarray = pixelarray.astype("uint8")
 
     if os.path.isfile(outfilename):
         os.remove(outfilename)
     
-    if hdr == None: # then a minimal header will be created 
+    if hdr is None: # then a minimal header will be created 
         hdu = pyfits.PrimaryHDU(pixelarray.transpose())
     else: # this if else is probably not needed but anyway ...
         hdu = pyfits.PrimaryHDU(pixelarray.transpose(), hdr)
@@ -7,6 +7,7 @@ import sys
 import numpy as np
 import pyfits
 from time import gmtime, strftime  # for utc
+from stack_lib import Stacker
 
 if len(sys.argv) == 1:
   print " "
@@ -28,36 +29,22 @@ else:
 
 clobberflag = True  
 
-# Build an image stack in memory
+# Memory map the image stack, it is combined a strip of rows at a time
 # Test that all the images are the same shape and exit if not
 
-inlists = []
-inhdrs = []
-inimages = []
-nimages = 0
-for infile in infiles:
-  inlist = pyfits.open(infile)
-  inimage = inlist[0].data
-  inhdr = inlist[0].header
-  if nimages == 0:
-    inshape0 = inimage.shape
-  else:
-    inshape = inimage.shape
-    if inshape != inshape0:
-      sys.exit('File %s not the same shape as %s \n' %(infile, infiles[0]) )  
-  inlists.append(inlist)
-  inimages.append(inimage)  
-  inhdrs.append(inhdr)
-  inlist.close()
-  nimages = nimages + 1
-  
+try:
+  stack = Stacker(infiles)
+except ValueError as e:
+  sys.exit('%s \n' % (e,))
+nimages = len(infiles)
+
 # Use numpy to calculate the median of the stack as a new image
 
-outimage = np.median(inimages,axis=0)
+outimage = stack.combine('median')
 
 # Create the fits ojbect for this image using the header of the first image
 
-outlist = pyfits.PrimaryHDU(outimage,inhdrs[0])
+outlist = pyfits.PrimaryHDU(outimage,pyfits.getheader(infiles[0]))
 
 # Provide a new date stamp
 
@@ -70,6 +57,8 @@ outhdr['DATE'] = file_time
 outhdr['history'] = 'Median of %d images by fits_median' %(nimages,)
 outhdr['history'] = 'First image '+  infiles[0]
 outhdr['history'] = 'Last image  '+  infiles[nimages-1]
+stack.add_metadata(outhdr, 'median')
+stack.close()
 
 # Write the fits file
 
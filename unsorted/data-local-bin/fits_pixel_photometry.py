@@ -3,6 +3,7 @@
 # Aperture photometry on a fits image file 
 # Accepts input list of pixel or ds9 coordinates
 # Returns a file with photometry and coordinates
+# Measures all targets in one call to photometry_lib, with sub-pixel aperture edges
 
 from __future__ import division # Use true division everywhere
 
@@ -12,6 +13,7 @@ import math as ma
 import numpy as np
 import pyfits
 from time import gmtime, strftime  # for utc
+from photometry_lib import Photometer
 
 
 def hms(hours):
@@ -54,154 +56,6 @@ def dms(degrees):
   return anglestr
 
 
-def apphot(scidata, px, py, r0, r1, r2):
-
-  # AIJ or ds9 floating point pixel coordinates (px,py) indexed from 1.0
-  # Photometry aperture r0
-  # Photometry inner radius r1
-  # Photometry outer radius r2
-  # Finds the signal inside the inner radius centered at  (px,py)
-  # Subtracts a background from the outer annulus with outlier removal
-  # The numpy array scidata is a fits image in the usual flipped numpy format
-
-  # Calculate squares once
-  
-  r02 = r0*r0
-  r12 = r1*r1
-  r22 = r2*r2
-  
-  # What are the image limits inside the outer annulus
-  
-  ny, nx = scidata.shape
-  
-  pxmin = max(1,  int(px - r2))
-  pxmax = min(nx, int(px + r2))
-  pymin = max(1,  int(py - r2))
-  pymax = min(ny, int(py + r2))
-  
-  # Initialize sums in the aperture and in the annulus
-    
-  sum_ap = 0.0
-  sum_an = 0.0
-  sum_an2 = 0.0
-  
-  # Initialize pixel counts in aperture and in annulus
-  
-  count_ap = 0
-  count_an = 0
-
-  # Find totals inside aperture and annulus
-  # Note numpy image array scidata has first index y, second x 
-  
-  for j in range(pxmin, pxmax + 1):
-    for k in range(pymin, pymax + 1):
-      dpx = (j - px)
-      dpy = (k - py)
-      dp2 = dpx*dpx + dpy*dpy
-      pixval = scidata[k-1, j-1]
-      if dp2 < r02:
-        sum_ap = sum_ap + pixval
-        count_ap = count_ap + 1
-      elif dp2 >= r12 and dp2 <= r22:
-        sum_an = sum_an + pixval
-        sum_an2 = sum_an2 + pixval*pixval
-        count_an = count_an + 1
-
-  # When there are no pixels this prevents a divide by zero error
-  
-  count_ap = max(1, count_ap)
-  count_an = max(1, count_an)
-
-  # Determine average values in the annulus
-  
-  average_an = sum_an/float(count_an)
-  average_an2 = sum_an2/float(count_an)
-  
-  # Estimate the standard deviation for the annulus
-    
-  sigma_an = ma.sqrt(abs(average_an2 - average_an*average_an))
-
-  # Make several more passes to exclude outliers in the annulus
-  
-  npasses = 10
-  
-  for i in range (npasses):
-    sum_an = 0.0
-    sum_an2 = 0.0
-    count_an = 0
-    for j in range(pxmin, pxmax + 1):
-      for k in range(pymin, pymax + 1):
-        dpx = (j - px)
-        dpy = (k - py)
-        dp2 = dpx*dpx + dpy*dpy
-        pixval = scidata[k-1, j-1] 
-        if dp2 >= r12 and dp2 <= r22 and abs(pixval - average_an) <= 2.*sigma_an:
-          sum_an = sum_an + pixval
-          sum_an2 = sum_an2 + pixval*pixval
-          count_an = count_an + 1  
-    count_an = max(1, count_an)
-    average_an = sum_an/float(count_an)
-    average_an2 = sum_an2/float(count_an)
-    sigma_an = ma.sqrt(abs(average_an2 - average_an*average_an))
-
-  # Calculate target signal - background and return
-  
-  signal  = sum_ap - float(count_ap)*average_an
-  
-  return signal
-
-def apphot_nobkg(scidata, px, py, r0):
-
-  # AIJ or ds9 floating point pixel coordinates (px,py) indexed from 1.0
-  # Photometry aperture r0
-  # Finds the signal inside the inner radius centered at  (px,py)
-  # The numpy array scidata is a fits image in the usual flipped numpy format
-
-  # Calculate squares once
-  
-  r02 = r0*r0
-  
-  # What are the image limits inside the radius
-  
-  ny, nx = scidata.shape
-  
-  pxmin = max(1,  int(px - r02))
-  pxmax = min(nx, int(px + r02))
-  pymin = max(1,  int(py - r02))
-  pymax = min(ny, int(py + r02))
-  
-  # Initialize sums in the aperture
-    
-  sum_ap = 0.0
-  
-  # Initialize pixel counts in aperture and in annulus
-  
-  count_ap = 0
-
-  # Find totals inside aperture 
-  # Note numpy image array scidata has first index y, second x 
-  
-  for j in range(pxmin, pxmax + 1):
-    for k in range(pymin, pymax + 1):
-      dpx = (j - px)
-      dpy = (k - py)
-      dp2 = dpx*dpx + dpy*dpy
-      pixval = scidata[k-1, j-1]
-      if dp2 < r02:
-        sum_ap = sum_ap + pixval
-        count_ap = count_ap + 1
-
-  # When there are no pixels this prevents a divide by zero error
-  
-  count_ap = max(1, count_ap)
-  
-  # Calculate target signal - background and return
-  
-  signal  = sum_ap
-  
-  return signal
-
-
 # Main code begins here
 
 
@@ -347,13 +201,19 @@ if nsky < 1:
 # Open the output file for appending 
 skyfp = open(skyfile, 'a')
 
+# Measure all the targets at once
+# The background annulus is sigma-clipped to exclude outliers
+
+if bkgflag == 1:
+  phot = Photometer(rphot, rinner, router)
+else:
+  phot = Photometer(rphot)
+signal = phot.measure(fitsdata, pix_coord[:,0], pix_coord[:,1])['flux'][:,0]
+
 for i in range(nsky):
   x = pix_coord[i,0]
   y = pix_coord[i,1]
-  if bkgflag == 1:
-    sky = apphot(fitsdata, x, y, rphot, rinner, router)    
-  else:
-    sky = apphot_nobkg(fitsdata, x, y, rphot)
+  sky = signal[i]
   skyline = "%5.2f  %5.2f  %f \n" % (x, y, sky)
   skyfp.write(skyline)
 
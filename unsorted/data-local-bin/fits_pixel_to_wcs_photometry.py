@@ -4,6 +4,7 @@
 # Accepts input list of pixel or ds9 coordinates
 # Requires an image with a WCS header
 # Returns a file with photometry and RA, Dec coordinates
+# Measures all targets in one call to photometry_lib, with sub-pixel aperture edges
 
 from __future__ import division # Use true division everywhere
 
@@ -14,6 +15,7 @@ import numpy as np
 import pyfits
 import pywcs
 from time import gmtime, strftime  # for utc
+from photometry_lib import Photometer
 
 
 def hms(hours):
@@ -56,103 +58,6 @@ def dms(degrees):
   return anglestr
 
 
-def apphot(scidata, px, py, r0, r1, r2):
-
-  # AIJ or ds9 floating point pixel coordinates (px,py) indexed from 1.0
-  # Photometry aperture r0
-  # Photometry inner radius r1
-  # Photometry outer radius r2
-  # Finds the signal inside the inner radius centered at  (px,py)
-  # Subtracts a background from the outer annulus with outlier removal
-  # The numpy array scidata is a fits image in the usual flipped numpy format
-
-  # Calculate squares once
-  
-  r02 = r0*r0
-  r12 = r1*r1
-  r22 = r2*r2
-  
-  # What are the image limits inside the outer annulus
-  
-  ny, nx = scidata.shape
-  
-  pxmin = max(1,  int(px - r2))
-  pxmax = min(nx, int(px + r2))
-  pymin = max(1,  int(py - r2))
-  pymax = min(ny, int(py + r2))
-  
-  # Initialize sums in the aperture and in the annulus
-    
-  sum_ap = 0.0
-  sum_an = 0.0
-  sum_an2 = 0.0
-  
-  # Initialize pixel counts in aperture and in annulus
-  
-  count_ap = 0
-  count_an = 0
-
-  # Find totals inside aperture and annulus
-  # Note numpy image array scidata has first index y, second x 
-  
-  for j in range(pxmin, pxmax + 1):
-    for k in range(pymin, pymax + 1):
-      dpx = (j - px)
-      dpy = (k - py)
-      dp2 = dpx*dpx + dpy*dpy
-      pixval = scidata[k-1, j-1]
-      if dp2 < r02:
-        sum_ap = sum_ap + pixval
-        count_ap = count_ap + 1
-      elif dp2 >= r12 and dp2 <= r22:
-        sum_an = sum_an + pixval
-        sum_an2 = sum_an2 + pixval*pixval
-        count_an = count_an + 1
-
-  # When there are no pixels this prevents a divide by zero error
-  
-  count_ap = max(1, count_ap)
-  count_an = max(1, count_an)
-
-  # Determine average values in the annulus
-  
-  average_an = sum_an/float(count_an)
-  average_an2 = sum_an2/float(count_an)
-  
-  # Estimate the standard deviation for the annulus
-    
-  sigma_an = ma.sqrt(abs(average_an2 - average_an*average_an))
-
-  # Make several more passes to exclude outliers in the annulus
-  
-  npasses = 10
-  
-  for i in range (npasses):
-    sum_an = 0.0
-    sum_an2 = 0.0
-    count_an = 0
-    for j in range(pxmin, pxmax + 1):
-      for k in range(pymin, pymax + 1):
-        dpx = (j - px)
-        dpy = (k - py)
-        dp2 = dpx*dpx + dpy*dpy
-        pixval = scidata[k-1, j-1] 
-        if dp2 >= r12 and dp2 <= r22 and abs(pixval - average_an) <= 2.*sigma_an:
-          sum_an = sum_an + pixval
-          sum_an2 = sum_an2 + pixval*pixval
-          count_an = count_an + 1  
-    count_an = max(1, count_an)
-    average_an = sum_an/float(count_an)
-    average_an2 = sum_an2/float(count_an)
-    sigma_an = ma.sqrt(abs(average_an2 - average_an*average_an))
-
-  # Calculate target signal - background and return
-  
-  signal  = sum_ap - float(count_ap)*average_an
-  
-  return signal
-
-
 # Main code begins here
 
 
@@ -309,13 +214,19 @@ if nsky < 1:
 # Open the output file for appending 
 skyfp = open(skyfile, 'a')
 
+# Measure all the targets at once
+# The background annulus is sigma-clipped to exclude outliers
+
+phot = Photometer(rphot, rinner, router)
+signal = phot.measure(wcsdata, pix_coord[:,0], pix_coord[:,1])['flux'][:,0]
+
 if decimalflag: 
   for i in range(nsky):
     ra = sky_coord[i,0] / 15.
     dec = sky_coord[i,1]
     x = pix_coord[i,0]
     y = pix_coord[i,1]
-    sky = apphot(wcsdata, x, y, rphot, rinner, router)
+    sky = signal[i]
     if verboseflag:
       print ra, dec
     skyline = "%5.2f  %5.2f  %f  %f  %f \n" % (x, y, ra, dec, sky)   
@@ -326,7 +237,7 @@ else:
     dec = sky_coord[i,1]
     x = pix_coord[i,0]
     y = pix_coord[i,1]
-    sky = apphot(wcsdata, x, y, rphot, rinner, router)    
+    sky = signal[i]
     if verboseflag:
       print hms(ra), dms(dec)
     skyline = "%5.2f  %5.2f  %s  %s  %f \n" % (x, y, hms(ra), dms(dec), sky)
@@ -21,6 +21,7 @@ import numpy as np
 import pyfits
 from scipy.optimize import curve_fit
 from time import gmtime, strftime  # for utc
+from photometry_lib import Photometer, cutouts
 
 # Set background parameters
 
@@ -53,226 +54,6 @@ def psfg(x, y, h, a):
   return f
 
 
-# Define functions for handling photometry at each star
-
-def centroid(imdata, x, y, r):
-  
-  # Find the signal weighted centroid of a specfied aperture in a numpy array
-  # Search within the radius r around the floating point coordinates (x, y)
-  # Return the floating point centroid pair 
-  
-  # Trap for r less than 0.5 and return the same pixel
-  
-  if r < 0.5:
-    return x, y    
-
-  # How big is this image?
-  # Numpy images have the y-axis first
-  
-  ysize, xsize = imdata.shape
-
-  # Define search limits around the target
-
-  xmin = x - r
-  xmax = x + r
-  ymin = y - r
-  ymax = y + r
-  
-  imin = int(np.floor(xmin - 0.5))
-  imax = int(np.floor(xmax - 0.5))
-  jmin = int(np.floor(ymin - 0.5))
-  jmax = int(np.floor(ymax - 0.5))
-  
-  imin = max(0, imin)
-  jmin = max(0, jmin)
-  imax = min(xsize - 1, imax)
-  jmax = min(ysize - 1, jmax)
-  
-  # Initialize sums and constants for the centroid evaluation
-  
-  tsig = 0.0
-  txsig = 0.0
-  tysig = 0.0
-  r2 = r*r
-  
-  # Run over this box and perform the weighted sums
-  
-  for i in range(imin, imax):
-    for j in range(jmin, jmax):
-      xp = float(i) + 1.0
-      yp = float(j) + 1.0
-      dx = xp - x
-      dy = yp - y
-      dx2 = dx * dx
-      dy2 = dy * dy
-      a2 = dx2 + dy2
-      if a2 <= r2:
-        txsig = dx * imdata[j, i] + txsig
-        tysig = dy * imdata[j, i] + tysig
-        tsig = imdata[j, i] + tsig
-  
-  # Finish by calculating the new centroid coordinates
-  
-  tsig = max(tsig, 1.)
-  xc = txsig/tsig + x
-  yc = tysig/tsig + y
-  
-  return xc, yc
-
-
-def apphot(imdata, x, y, rinner, router):
-	
-  # Single star aperture photometry 
-  # Input image, star center, aperture radii
-  # Return total signal, background per pixel, and Gaussian psf hwhm
-  
-  # P(x,y) is a floating point coordinate in the image space
-  # P(x,y) referenced to the lower left pixel that is 1,1 at its center
-
-  ysize, xsize = imdata.shape
-  rinner2 = rinner * rinner
-  router2 = router * router
-
-  # Define limits around the target
-
-  xmin = x - rinner
-  xmax = x + rinner
-  ymin = y - rinner
-  ymax = y + rinner
-  
-  imin = int(np.floor(xmin - 0.5))
-  imax = int(np.floor(xmax - 0.5))
-  jmin = int(np.floor(ymin - 0.5))
-  jmax = int(np.floor(ymax - 0.5))
-
-  imin = max(0, imin)
-  jmin = max(0, jmin)
-  imax = min(xsize - 1, imax)
-  jmax = min(ysize - 1, jmax)
-      
-  inner = 0.
-  innercount = 0.
-  outer = 0.0
-  outer2 = 0.0
-  outercount = 0.0
-  
-  # Find the first pass background in the annulus
-  
-  for i in range(imin, imax):
-    for j in range(jmin, jmax):      
-      xp = float(i) + 1.0
-      yp = float(j) + 1.0
-      dx = xp - x
-      dy = yp - y
-      dx2 = dx * dx
-      dy2 = dy * dy
-      dr2 = dx2 + dy2
-      value = imdata[j, i]
-      if dr2 < router2 and dr2 >= rinner2:
-        outer = outer + value
-        outer2 = outer2 + value*value
-        outercount = outercount + 1.0
-      else:
-        pass
-
-  outercount = max(outercount, 1.)
-  outeravg = outer/outercount
-  outer2avg = outer2/outercount
-  outeravg2 = outeravg*outeravg
-  outerdelta = max(outer2avg - outeravg2, 0.)
-  sigma = ma.sqrt(outerdelta) 
-
-  # Now iterate over the annulus and remove outliers
-  # Stop the iteration after maxpasses or when the average converges
-  
-  maxpasses = 10
-  
-  for k in range (maxpasses):
-    
-    # Break if sigma is nearly zero (all pixels equal)
-    
-    if sigma < 0.1:
-      break
-    
-    lastouteravg = outeravg
-    outer = 0.0
-    outer2 = 0.0
-    outercount = 0.0
-    for i in range(imin, imax):
-      for j in range(jmin, jmax):      
-        xp = float(i) + 1.0
-        yp = float(j) + 1.0
-        dx = xp - x
-        dy = yp - y
-        dx2 = dx * dx
-        dy2 = dy * dy
-        dr2 = dx2 + dy2
-        value = imdata[j, i]
-        if (dr2 < router2 and dr2 >= rinner2) and (abs(value - outeravg) < 2.*sigma):
-          outer = outer + value
-          outer2 = outer2 + value*value
-          outercount = outercount + 1.0
-    
-    # Break if only a few pixels remain
-    
-    if outercount < 2:
-      break
-
-    outeravg = outer/outercount
-
-    # Break from the loop once the outer average has stabilized
-    # This is ad hoc and would work for 16-bit data where each value is 1 photon
-    # It would probably have to be scaled for larger dynamic range
-    
-    if abs(lastouteravg - outeravg) < 0.1:
-      break
-
-    outer2avg = outer2/outercount
-    outeravg2 = outeravg*outeravg
-    outerdelta = max(abs(outer2avg - outeravg2), 0.)
-    sigma = ma.sqrt(outerdelta)
-
-  
-  # This establishes the background per pixel with stars and outlier pixels removed
-  
-  pixbackground = outeravg
-          
-  # Fit the psf for the star within this aperture
-  
-  rnlist = []
-  snlist = []
-    
-  for i in range(imin, imax):
-    for j in range(jmin, jmax):      
-      xp = float(i) + 1.0
-      yp = float(j) + 1.0
-      dx = xp - x
-      dy = yp - y
-      dx2 = dx * dx
-      dy2 = dy * dy
-      dr2 = dx2 + dy2
-      dr = ma.sqrt(dr2)
-      if dr <= rinner:
-        pixsignal = imdata[j, i] - pixbackground
-        rnlist.append(dr)
-        snlist.append(pixsignal)
-      else:
-        pass
-        
-  rndata = np.array(rnlist, dtype=np.float64)
-  sndata = np.array(snlist, dtype=np.float64)
-  h = psfh
-  a = psfa
-  psfp, covarp = curve_fit(fitg, rndata, sndata, p0=(h,a))
-  h = psfp[0]
-  a = psfp[1]  
-  pixsignal = h*a*ma.sqrt(ma.pi)
-  psfhwhm = a/ma.sqrt(2.)
-    
-  return pixsignal, pixbackground, psfhwhm
-	
-# End of function definitions
-
 if len(sys.argv) != 4:
   print " "
   print "Usage: fits_remove_stars.py infile.fits pixels.txt outfile.fits"
@@ -373,59 +154,57 @@ npixels = k
 if npixels < k:
   sys.exit('No objects found in %s' % (pixfile,))
 
+# Centroid on each location inside the outer radius and find the background for all stars at once
+
+phot = Photometer(rin, rin, rout)
+stars = phot.measure(inimage, [p[0] for p in pixels], [p[1] for p in pixels], recenter=1, rcentroid=rout)
+
+# Cut out the pixels within the inner radius of every star for the psf fits
+
+half = int(np.ceil(rin + 1.))
+stack, sdx, sdy = cutouts(inimage, stars['x'], stars['y'], half)
+rstack = np.sqrt(sdx[:, None, :]**2 + sdy[:, :, None]**2)
+
 # Clean the image
 
+ny, nx = outimage.shape
 for k in range(npixels):
 
-  # Look at the next pixel
-  x, y = pixels[k]
-    
-  # Centroid on this location inside an outer radius
-  xc, yc = centroid(outimage, x, y, rout)
-  
-  # Find the background and the halfwidth at half maximum in pixels
-  signal, bkg, hwhm = apphot(outimage, xc, yc, rin, rout)
-  
-  a = hwhm*ma.sqrt(2.)
-  h = signal/(a*ma.sqrt(ma.pi))
-  
+  xc = stars['x'][k]
+  yc = stars['y'][k]
+  bkg = stars['bkg'][k]
+
+  # Fit the psf for the star within this aperture
+
+  inside = (rstack[k] <= rin) & np.isfinite(stack[k])
+  try:
+    psfp, covarp = curve_fit(fitg, rstack[k][inside], stack[k][inside] - bkg, p0=(psfh, psfa))
+  except RuntimeError:
+    continue
+  h = psfp[0]
+  a = abs(psfp[1])
+
   # Print useful diagnostics
-  
-  # print xc, yc, h, a
-  # print x, xc, y, yc, signal, bkg, hwhm
-    
-  # Define the region to be replaced in numpy indices 
+
+  # print xc, yc, h, a, bkg
+
+  # Define the region to be replaced in numpy indices
   rc = psfax * a
-  rc2 = rc * rc
-  xmin = xc - rc
-  xmax = xc + rc
-  ymin = yc - rc
-  ymax = yc + rc
-  
-  imin = int(np.floor(xmin - 0.5))
-  imax = int(np.floor(xmax - 0.5))
-  jmin = int(np.floor(ymin - 0.5))
-  jmax = int(np.floor(ymax - 0.5))
-
-  imin = max(0, imin)
-  jmin = max(0, jmin)
-  imax = min(xsize - 1, imax)
-  jmax = min(ysize - 1, jmax)
-      
+  imin = max(0, int(np.floor(xc - rc - 0.5)))
+  imax = min(nx - 1, int(np.floor(xc + rc - 0.5)))
+  jmin = max(0, int(np.floor(yc - rc - 0.5)))
+  jmax = min(ny - 1, int(np.floor(yc + rc - 0.5)))
+  if imax < imin or jmax < jmin:
+    continue
+
   # Remove the psf from this region
-    
-  for i in range(imin, imax):
-    for j in range(jmin, jmax):
-
-      xp = float(i) + 1.0
-      yp = float(j) + 1.0
-      dx = xp - x
-      dy = yp - y
-      dx2 = dx * dx
-      dy2 = dy * dy
-      a2 = dx2 + dy2
-      if a2 <= rc2:
-        outimage[j,i] =  outimage[j,i] - psfg(dx, dy, h, a)
+
+  yp, xp = np.mgrid[jmin:jmax + 1, imin:imax + 1] + 1.0
+  dx = xp - xc
+  dy = yp - yc
+  region = outimage[jmin:jmax + 1, imin:imax + 1]
+  inpsf = dx*dx + dy*dy <= rc*rc
+  region[inpsf] = region[inpsf] - psfg(dx[inpsf], dy[inpsf], h, a)
 
 # Create the fits ojbect for this image using the header of the first image
 # Use float32 for output type
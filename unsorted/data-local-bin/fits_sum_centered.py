@@ -34,18 +34,11 @@ def centroid(imdata, region):
   xmax = int(round(x + xhw))
   ymin = int(round(y - yhw))
   ymax = int(round(y + yhw))  
-  pix_sum = 0.0
-  pix_x_sum = 0.0
-  pix_y_sum = 0.0
-  pix_count = 0.0
   pix_bkg = np.median(imdata[ymin:ymax,xmin:xmax])
-  for j in range(xmin, xmax + 1):
-    for i in range(ymin, ymax + 1):
-      pix = imdata[i, j] - pix_bkg
-      pix_x_sum += (float(j) - x) * pix
-      pix_y_sum += (float(i) - y) * pix
-      pix_sum   += pix
-      pix_count += 1.0
+  pix = imdata[ymin:ymax + 1, xmin:xmax + 1] - pix_bkg
+  pix_sum = pix.sum()
+  pix_x_sum = (pix.sum(axis=0) * (np.arange(xmin, xmax + 1) - x)).sum()
+  pix_y_sum = (pix.sum(axis=1) * (np.arange(ymin, ymax + 1) - y)).sum()
       
   dx = pix_x_sum/pix_sum
   dy = pix_y_sum/pix_sum
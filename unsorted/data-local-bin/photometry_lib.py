@@ -0,0 +1,212 @@
+# Module photometry_lib
+
+# Vectorized aperture photometry of many stars in one call
+# Shared by fits_pixel_photometry, fits_pixel_to_wcs_photometry and fits_remove_stars
+
+# Pixel coordinates are the AIJ / ds9 convention used by those scripts:
+# (x, y) floating point, referenced to the lower left pixel that is 1,1 at its center
+# Note the numpy image array has first index y, second x
+
+# All stars are cut out of the image at once into a stack of small square arrays
+# and the centroid, sigma-clipped annulus background, aperture sums and psf width
+# are computed on the whole stack with array operations, so there are no Python
+# loops over pixels or stars. Aperture edges are treated with sub-pixel accuracy
+# using masks precomputed for a grid of fractional star positions.
+
+#   phot = Photometer([4., 6., 8.], rin=12., rout=20.)
+#   result = phot.measure(imdata, x, y, recenter=1)
+#   result['flux'][:, 0]   # signal - background in the 4 pixel aperture
+
+from __future__ import division # Use true division everywhere
+
+import numpy as np
+
+
+def cutouts(imdata, x, y, half):
+
+  # Cut a (2 half + 1) x (2 half + 1) stack of pixels around each (x, y)
+  # Cutouts are centered on the pixel containing (x, y); pixels off the image are NaN
+  # Returns the stack [star, y, x] and the offsets dx [star, x], dy [star, y]
+  # of the cutout pixel centers from (x, y)
+
+  x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+  y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+  ny, nx = imdata.shape
+  k = np.arange(-half, half + 1)
+  ii = np.rint(x).astype(int)[:, None] - 1 + k
+  jj = np.rint(y).astype(int)[:, None] - 1 + k
+  stack = imdata[np.clip(jj, 0, ny - 1)[:, :, None], np.clip(ii, 0, nx - 1)[:, None, :]].astype(np.float64)
+  on_image = ((jj >= 0) & (jj < ny))[:, :, None] & ((ii >= 0) & (ii < nx))[:, None, :]
+  stack[~on_image] = np.nan
+  dx = (ii + 1) - x[:, None]
+  dy = (jj + 1) - y[:, None]
+  return stack, dx, dy
+
+
+def aperture_table(r, half, subpix, nfrac):
+
+  # Fraction of each cutout pixel inside radius r, for star positions on a grid
+  # of nfrac steps per pixel relative to the central pixel center
+  # Each pixel is sampled subpix x subpix times
+  # table[qy, qx, y, x] is for a star offset by (qx/nfrac - 0.5, qy/nfrac - 0.5)
+
+  k = np.arange(-half, half + 1)
+  f = np.arange(nfrac + 1)/nfrac - 0.5
+  s = (np.arange(subpix) + 0.5)/subpix - 0.5
+  u2 = (k[None, :, None] + s[None, None, :] - f[:, None, None])**2
+  r2 = r*r
+  n = len(k)
+  table = np.empty((nfrac + 1, nfrac + 1, n, n), dtype=np.float32)
+  for qy in range(nfrac + 1):
+    inside = u2[qy][None, :, None, :, None] + u2[:, None, :, None, :] < r2
+    table[qy] = inside.mean(axis=(3, 4))
+  return table
+
+
+class Photometer:
+
+  # r_ap         aperture radius or list of radii [pixels]
+  # rin, rout    background annulus radii [pixels]; rin = None for no background
+  # subpix       sub-pixel samples per pixel side for aperture edges
+  #              1 uses whole pixels with centers inside the aperture as the older scripts did
+  # nfrac        star positions are rounded to 1/nfrac pixel to look up the aperture masks
+  # nsigma       annulus pixels further than nsigma standard deviations from the mean are rejected
+  # maxpasses    maximum number of clipping passes
+  # chunk        number of stars measured at a time, to bound the memory used
+
+  def __init__(self, r_ap, rin=None, rout=None, subpix=5, nfrac=20, nsigma=2., maxpasses=10, chunk=2000):
+    self.radii = np.atleast_1d(np.asarray(r_ap, dtype=np.float64))
+    self.rin = rin
+    self.rout = rout
+    self.subpix = int(subpix)
+    self.nfrac = int(nfrac)
+    self.nsigma = nsigma
+    self.maxpasses = maxpasses
+    self.chunk = chunk
+    self.half_ap = int(np.ceil(self.radii.max() + 1.))
+    if rin is not None:
+      self.half = max(self.half_ap, int(np.ceil(rout + 1.)))
+    else:
+      self.half = self.half_ap
+    if self.subpix > 1:
+      self.tables = [aperture_table(r, self.half_ap, self.subpix, self.nfrac) for r in self.radii]
+
+  def _masks(self, dx, dy, r, table):
+
+    # Aperture weights [star, y, x] for the central half_ap part of the cutouts
+
+    if self.subpix == 1:
+      return (dx[:, None, :]**2 + dy[:, :, None]**2 < r*r).astype(np.float64)
+    qx = np.clip(np.rint((0.5 - dx[:, self.half_ap])*self.nfrac).astype(int), 0, self.nfrac)
+    qy = np.clip(np.rint((0.5 - dy[:, self.half_ap])*self.nfrac).astype(int), 0, self.nfrac)
+    return table[qy, qx]
+
+  def _background(self, stack, dx, dy):
+
+    # Sigma-clipped mean, standard deviation and pixel count in the annulus for each star
+
+    n = len(stack)
+    if self.rin is None:
+      return np.zeros(n), np.zeros(n), np.zeros(n, dtype=int)
+    d2 = dx[:, None, :]**2 + dy[:, :, None]**2
+    annulus = (d2 >= self.rin**2) & (d2 <= self.rout**2) & np.isfinite(stack)
+    values = np.where(annulus, stack, 0.)
+    count = annulus.sum(axis=(1, 2))
+    mean = values.sum(axis=(1, 2))/np.maximum(count, 1)
+    sigma = np.sqrt(np.abs((values**2).sum(axis=(1, 2))/np.maximum(count, 1) - mean**2))
+    for i in range(self.maxpasses):
+      keep = annulus & (np.abs(stack - mean[:, None, None]) <= self.nsigma*sigma[:, None, None])
+      values = np.where(keep, stack, 0.)
+      count = keep.sum(axis=(1, 2))
+      new_mean = values.sum(axis=(1, 2))/np.maximum(count, 1)
+      sigma = np.sqrt(np.abs((values**2).sum(axis=(1, 2))/np.maximum(count, 1) - new_mean**2))
+      converged = np.all(new_mean == mean)
+      mean = new_mean
+      if converged:
+        break
+    return mean, sigma, count
+
+  def centroid(self, imdata, x, y, r, bkg=None):
+
+    # Signal weighted centroid within radius r of each (x, y)
+    # If bkg (per star) is given it is subtracted and negative pixels are ignored
+
+    x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+    y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+    half = int(np.ceil(r + 1.))
+    xc = x.copy(); yc = y.copy()
+    for start in range(0, len(x), self.chunk):
+      s = slice(start, start + self.chunk)
+      stack, dx, dy = cutouts(imdata, x[s], y[s], half)
+      inside = (dx[:, None, :]**2 + dy[:, :, None]**2 <= r*r) & np.isfinite(stack)
+      w = np.where(inside, stack, 0.)
+      if bkg is not None:
+        w = np.maximum(w - np.asarray(bkg, dtype=np.float64)[s][:, None, None], 0.)*inside
+      tsig = w.sum(axis=(1, 2))
+      ok = tsig > 0
+      xc[s][ok] = x[s][ok] + (w.sum(axis=1)*dx).sum(axis=1)[ok]/tsig[ok]
+      yc[s][ok] = y[s][ok] + (w.sum(axis=2)*dy).sum(axis=1)[ok]/tsig[ok]
+    return xc, yc
+
+  def measure(self, imdata, x, y, recenter=0, rcentroid=None):
+
+    # Photometry of the stars at (x, y)
+    # recenter   number of centroiding passes before measuring (radius rcentroid,
+    #            default the largest aperture), with the annulus background subtracted
+    # Returns a dictionary of arrays, one entry per star:
+    #   x, y          position used
+    #   flux          [star, aperture] sum in the aperture minus area x background
+    #   area          [star, aperture] number of pixels in the aperture and on the image
+    #   bkg, bkg_sigma, bkg_count   clipped annulus mean, standard deviation and pixel count
+    #   hwhm          psf size: rms radius weighted by the squared signal in the largest aperture
+
+    x = np.atleast_1d(np.asarray(x, dtype=np.float64)).copy()
+    y = np.atleast_1d(np.asarray(y, dtype=np.float64)).copy()
+    if rcentroid is None:
+      rcentroid = self.radii.max()
+    for i in range(recenter):
+      bkg = self.background(imdata, x, y)[0]
+      x, y = self.centroid(imdata, x, y, rcentroid, bkg)
+
+    n = len(x); nap = len(self.radii)
+    result = dict(x=x, y=y, flux=np.zeros((n, nap)), area=np.zeros((n, nap)),
+                  bkg=np.zeros(n), bkg_sigma=np.zeros(n), bkg_count=np.zeros(n, dtype=int), hwhm=np.zeros(n))
+    h = self.half - self.half_ap
+    for start in range(0, n, self.chunk):
+      s = slice(start, start + self.chunk)
+      stack, dx, dy = cutouts(imdata, x[s], y[s], self.half)
+      bkg, sigma, count = self._background(stack, dx, dy)
+      result['bkg'][s] = bkg; result['bkg_sigma'][s] = sigma; result['bkg_count'][s] = count
+
+      # Apertures use the central part of the cutouts
+      if h > 0:
+        stack = stack[:, h:-h, h:-h]; dx = dx[:, h:-h]; dy = dy[:, h:-h]
+      on_image = np.isfinite(stack)
+      signal = np.where(on_image, stack - bkg[:, None, None], 0.)
+      for a in range(nap):
+        table = self.tables[a] if self.subpix > 1 else None
+        mask = self._masks(dx, dy, self.radii[a], table)
+        result['area'][s, a] = (mask*on_image).sum(axis=(1, 2))
+        result['flux'][s, a] = (mask*signal).sum(axis=(1, 2))
+
+      # Psf size from the largest aperture
+      s2 = mask*signal**2
+      r2 = dx[:, None, :]**2 + dy[:, :, None]**2
+      norm = s2.sum(axis=(1, 2))
+      result['hwhm'][s] = np.sqrt((s2*r2).sum(axis=(1, 2))/np.maximum(norm, 1e-30))
+    return result
+
+  def background(self, imdata, x, y):
+
+    # Clipped annulus background (mean, standard deviation, count) at each (x, y)
+
+    x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+    y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+    out = [np.zeros(len(x)), np.zeros(len(x)), np.zeros(len(x), dtype=int)]
+    half = self.half if self.rin is None else int(np.ceil(self.rout + 1.))
+    for start in range(0, len(x), self.chunk):
+      s = slice(start, start + self.chunk)
+      stack, dx, dy = cutouts(imdata, x[s], y[s], half)
+      for o, v in zip(out, self._background(stack, dx, dy)):
+        o[s] = v
+    return out
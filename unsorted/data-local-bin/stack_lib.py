@@ -0,0 +1,195 @@
+# Module stack_lib
+
+# Out-of-core combining of a stack of FITS images of the same size
+# Shared by fits_median, fits_mean, fits_sum, avg-fits and avg-fits-new
+
+# The input files are memory mapped rather than read into a list of arrays, and
+# the stack is reduced in strips of rows: only nframes x (rows in a strip) pixels
+# are in memory at a time, so 50 or more 16 megapixel frames can be combined in a
+# few hundred MB. The strip height follows from a memory budget. Strips can be
+# combined by several threads at once (numpy sorts release the GIL).
+
+# Methods
+#   median    pixel by pixel median
+#   mean      pixel by pixel mean
+#   sum       pixel by pixel sum
+#   sigclip   mean after iteratively rejecting values more than nsigma standard
+#             deviations from the median of each pixel (at most maxiter passes)
+#   minmax    mean after rejecting the nlow lowest and nhigh highest values of each pixel
+
+#   stack = Stacker(infiles, memory=256)
+#   outimage = stack.combine('median')
+#   outhdr = pyfits.getheader(infiles[0])
+#   stack.add_metadata(outhdr, 'median')
+#   stack.close()
+
+from __future__ import division # Use true division everywhere
+
+import os
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+try:
+  import astropy.io.fits as pyfits
+except ImportError:
+  import pyfits
+
+methods = ('median', 'mean', 'sum', 'sigclip', 'minmax')
+
+# Work space of each method in units of the strip being combined
+workspace = {'median': 3., 'mean': 2., 'sum': 2., 'sigclip': 6., 'minmax': 2.}
+
+
+def combine_strip(strip, method, nsigma=3., maxiter=5, nlow=1, nhigh=1):
+
+  # Combine strip [frame, row, ...] along the frame axis
+  # strip is float64 and belongs to the caller; sigclip and minmax sort it in place
+
+  if method == 'median':
+    return np.median(strip, axis=0)
+  elif method == 'mean':
+    return np.mean(strip, axis=0)
+  elif method == 'sum':
+    return np.sum(strip, axis=0)
+  elif method == 'sigclip':
+    # Sorted, the values kept for a pixel are always those between two indices lo and hi,
+    # so medians come from the sorted values and means and deviations from cumulative sums
+    # (NaNs sort last and are never used)
+    n = len(strip)
+    strip.sort(axis=0)
+    offset = strip[0].copy()
+    offset[~np.isfinite(offset)] = 0.
+    strip -= offset
+    cs = np.zeros((n + 1,) + strip.shape[1:])
+    np.cumsum(np.nan_to_num(strip), axis=0, out=cs[1:])
+    cs2 = np.zeros((n + 1,) + strip.shape[1:])
+    np.cumsum(np.nan_to_num(strip)**2, axis=0, out=cs2[1:])
+    lo = np.zeros((1,) + strip.shape[1:], dtype=int)
+    hi = np.sum(np.isfinite(strip), axis=0, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      for i in range(maxiter + 1):
+        count = hi - lo
+        mean = (np.take_along_axis(cs, hi, 0) - np.take_along_axis(cs, lo, 0))/count
+        if i == maxiter:
+          break
+        sigma = np.sqrt(np.maximum((np.take_along_axis(cs2, hi, 0) - np.take_along_axis(cs2, lo, 0))/count - mean**2, 0.))
+        k = np.clip(lo + (count - 1)//2, 0, n - 1)
+        center = (np.take_along_axis(strip, k, 0) + np.take_along_axis(strip, np.clip(lo + count//2, 0, n - 1), 0))/2.
+        newlo = np.maximum(lo, np.sum(strip < center - nsigma*sigma, axis=0, keepdims=True))
+        newhi = np.minimum(hi, np.sum(strip <= center + nsigma*sigma, axis=0, keepdims=True))
+        if np.array_equal(newlo, lo) and np.array_equal(newhi, hi):
+          break
+        lo, hi = newlo, newhi
+    return mean[0] + offset
+  elif method == 'minmax':
+    strip.sort(axis=0)
+    return np.mean(strip[nlow:len(strip) - nhigh], axis=0)
+  raise ValueError('Unknown combine method %s, use one of %s' % (method, ', '.join(methods)))
+
+
+class Stacker:
+
+  # files        FITS files, the primary images are combined
+  # memory       memory budget for the strips being combined [MB]
+  # nthreads     number of strips combined at once
+
+  def __init__(self, files, memory=256., nthreads=1):
+    self.files = list(files)
+    self.memory = memory
+    self.nthreads = max(1, int(nthreads))
+    self.hdulists = []
+    self.scaling = []
+    self.shape = None
+    for infile in self.files:
+      # Raw memory mapped data; BSCALE and BZERO are applied strip by strip
+      hdulist = pyfits.open(infile, memmap=True, do_not_scale_image_data=True)
+      self.hdulists.append(hdulist)
+      hdu = hdulist[0]
+      if hdu.data is None:
+        self.close()
+        raise ValueError('File %s has no primary image' % (infile,))
+      if self.shape is None:
+        self.shape = hdu.data.shape
+      elif hdu.data.shape != self.shape:
+        self.close()
+        raise ValueError('File %s not the same shape as %s' % (infile, self.files[0]))
+      self.scaling.append((hdu.header.get('BSCALE', 1.), hdu.header.get('BZERO', 0.)))
+
+  def strip_rows(self, method='median'):
+
+    # Rows per strip that keep nthreads strips and their work space within the budget
+
+    rowbytes = 8.*len(self.files)*int(np.prod(self.shape[1:]))
+    return int(max(1, min(self.shape[0], self.memory*2**20/(workspace[method]*rowbytes*self.nthreads))))
+
+  def read(self, i, row0, row1):
+
+    # Rows row0:row1 of frame i as float64, scaled to physical values
+
+    strip = self.hdulists[i][0].data[row0:row1].astype(np.float64)
+    bscale, bzero = self.scaling[i]
+    if bscale != 1:
+      strip *= bscale
+    if bzero != 0:
+      strip += bzero
+    return strip
+
+  def frame_medians(self):
+
+    # Median of each frame, one frame in memory at a time
+
+    return np.array([np.median(self.read(i, 0, self.shape[0])) for i in range(len(self.files))])
+
+  def combine(self, method='median', norm=None, nsigma=3., maxiter=5, nlow=1, nhigh=1):
+
+    # Combine the stack with method; returns a float64 image
+    # norm   optional per frame divisors applied before combining (e.g. frame_medians())
+
+    if method not in methods:
+      raise ValueError('Unknown combine method %s, use one of %s' % (method, ', '.join(methods)))
+    if method == 'minmax' and nlow + nhigh >= len(self.files):
+      raise ValueError('Cannot reject %i low and %i high values of %i images' % (nlow, nhigh, len(self.files)))
+    outimage = np.empty(self.shape, dtype=np.float64)
+    rows = self.strip_rows(method)
+
+    def do_strip(row0):
+      row1 = min(row0 + rows, self.shape[0])
+      strip = np.empty((len(self.files), row1 - row0) + tuple(self.shape[1:]), dtype=np.float64)
+      for i in range(len(self.files)):
+        strip[i] = self.read(i, row0, row1)
+        if norm is not None:
+          strip[i] /= norm[i]
+      outimage[row0:row1] = combine_strip(strip, method, nsigma, maxiter, nlow, nhigh)
+
+    starts = range(0, self.shape[0], rows)
+    if self.nthreads > 1:
+      pool = ThreadPool(self.nthreads)
+      try:
+        pool.map(do_strip, starts)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      for row0 in starts:
+        do_strip(row0)
+    return outimage
+
+  def add_metadata(self, hdr, method, nsigma=3., maxiter=5, nlow=1, nhigh=1):
+
+    # Record how the stack was combined, IRAF imcombine style
+
+    hdr['NCOMBINE'] = (len(self.files), 'Number of images combined')
+    hdr['COMBTYPE'] = (method, 'Combine method')
+    if method == 'sigclip':
+      hdr['COMBSIG'] = (nsigma, 'Sigma clipping limit')
+      hdr['COMBITER'] = (maxiter, 'Maximum sigma clipping passes')
+    elif method == 'minmax':
+      hdr['COMBNLO'] = (nlow, 'Low values rejected per pixel')
+      hdr['COMBNHI'] = (nhigh, 'High values rejected per pixel')
+    for i, infile in enumerate(self.files[:999]):
+      hdr['IMCMB%03i' % (i + 1)] = os.path.basename(infile)
+
+  def close(self):
+    for hdulist in self.hdulists:
+      hdulist.close()
+    self.hdulists = []
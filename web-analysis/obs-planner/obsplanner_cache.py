@@ -0,0 +1,74 @@
+'''
+17 Oct 2026
+Server-side caches shared by all obsplanner sessions (pywebio runs each session as a thread
+of one server process). Object lookups (CDS, Simbad, JPL Horizons) and nightly Horizons
+ephemeris tables are kept for a time-to-live, so a class of students planning the same
+object makes one set of queries. A session asking for an entry that another session is
+already computing waits for that result instead of repeating the query.
+'''
+import threading
+import time
+
+class TTLCache:
+    def __init__(self, ttl, negative_ttl=None, maxsize=1000):
+        ''' Thread-safe dictionary of values that expire ttl seconds after they were computed.
+        Values of None (e.g. failed lookups) expire after negative_ttl seconds (default ttl) '''
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.maxsize = maxsize
+        self.entries = {}   # key: (expiry time, value)
+        self.pending = {}   # key: threading.Event set when the computation in progress finishes
+        self.lock = threading.Lock()
+        self.hits = 0 ; self.misses = 0
+
+    def get(self, key, compute):
+        ''' Return the value for key, calling compute() if it is missing or expired.
+        Exceptions raised by compute() are passed to the caller and nothing is cached '''
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > time.time():
+                    self.hits += 1
+                    return entry[1]
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()  # Another session is computing this entry
+        try:
+            value = compute()
+            ttl = self.negative_ttl if value is None else self.ttl
+            with self.lock:
+                if len(self.entries) >= self.maxsize:
+                    self.expire()
+                self.entries[key] = (time.time() + ttl, value)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    def expire(self):
+        ''' Drop expired entries; if the cache is still full, drop the half closest to expiry.
+        Called with the lock held '''
+        now = time.time()
+        for key in [k for k, (expiry, _) in self.entries.items() if expiry <= now]:
+            del self.entries[key]
+        if len(self.entries) >= self.maxsize:
+            keys = sorted(self.entries, key=lambda k: self.entries[k][0])
+            for key in keys[:len(keys)//2 + 1]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# Fixed objects resolved by CDS/Simbad rarely change; failed lookups are retried after 10 minutes
+fixed_targets = TTLCache(ttl=30*86400, negative_ttl=600)
+
+# Names JPL Horizons accepts (or not)
+horizons_names = TTLCache(ttl=86400, negative_ttl=600)
+
+# Horizons ephemeris tables keyed by (object, site, night)
+ephemerides = TTLCache(ttl=6*3600)
@@ -2,6 +2,9 @@
 4 Feb 2022 RLM
 This class is instantiated by obsplanner
 N.B. Requires astroquery version 4.3 or higher
+17 Oct 2026: object lookups and nightly Horizons ephemerides are cached for all sessions
+(obsplanner_cache); one epoch-range Horizons request per object and night; object_up
+evaluates all times in one astroplan call
 '''
 import numpy as np
 import astroplan,io
@@ -27,6 +30,8 @@ from time import strftime
 
 from pprint import pprint
 
+from obsplanner_cache import fixed_targets, horizons_names, ephemerides
+
 import warnings
 warnings.filterwarnings("ignore")  # Suppress annoying warnings
 matplotlib.use('agg')  # required, use a non-interactive backend
@@ -51,6 +56,83 @@ objtype_dict = \
 simbad = Simbad()
 simbad.add_votable_fields('dim', 'main_id','flux(V)','dimensions','otype','typed_id','otype','morphtype','sptype')
 
+def horizons_target(object_name):
+    ''' JPL Horizons id, id_type (None: Horizons default) and object type of a solar system object name '''
+    if object_name.lower() == 'moon':
+        return '301', None, 'Moon'
+    elif object_name.lower() in planet_dict:
+        return '%s Barycenter' % object_name, None, 'Planet'  # Planet name alone is ambiguous in lookup
+    else:
+        return object_name, 'smallbody', 'Minor solar system body'
+
+def horizons_query(object_name, location, epochs):
+    ''' Horizons object for object_name at location (observatory code) and epochs '''
+    obj_id, id_type, objtype = horizons_target(object_name)
+    if id_type is None:
+        return Horizons(id=obj_id, location=location, epochs=epochs)
+    return Horizons(id=obj_id, location=location, id_type=id_type, epochs=epochs)
+
+def resolve_fixed(object_name):
+    ''' Coordinates (SkyCoord) and Simbad object type, V magnitude, spectral type and diameter
+    of a fixed object, or None if CDS does not know the name. Shared by all sessions '''
+    def lookup():
+        try:
+            # Lookup using CDS - this is more comprehensive than Simbad, but doesn't provide as much information
+            coord = FixedTarget.from_name(object_name, name=object_name).coord
+        except:
+            return None
+
+        # Now try SIMBAD lookup to retrieve more information
+        try:
+            t = simbad.query_object(object_name)
+            objtype = t['OTYPE'][0]
+            try:
+                objtype = objtype.decode()   # objtype is a byte or string type depending on astroquery version !
+            except (UnicodeDecodeError, AttributeError):
+                pass
+
+            V =  t['FLUX_V'][0]
+            if hasattr(V,'mask'): V = np.nan
+            sp_type = t['SP_TYPE'][0]
+            if hasattr(sp_type,'mask'): sp_type ='' 
+            diameter = t['GALDIM_MAJAXIS'][0]
+            if hasattr(diameter,'mask'): diameter = np.nan 
+            if objtype in objtype_dict: objtype = objtype_dict[objtype]
+        except:
+            objtype =''; V =np.nan; sp_type =''; diameter =np.nan   
+        return coord, objtype, V, sp_type, diameter
+    return fixed_targets.get(object_name.strip().lower(), lookup)
+
+def horizons_name_valid(object_name):
+    ''' True if JPL Horizons knows object_name. Shared by all sessions '''
+    def lookup():
+        try:
+            horizons_query(object_name, 857, 2450000).ephemerides() # location and epochs are dummies
+            return True
+        except:
+            return None
+    return horizons_names.get(object_name.strip().lower(), lookup) is not None
+
+def night_ephemeris(object_name, obscode, night, start, stop, step='10m'):
+    ''' Horizons ephemeris of a solar system object from start to stop (astropy Time) in one
+    epoch-range request, shared by all sessions for the same (object, site, night).
+    Returns arrays of JD, RA, Dec [deg] and V magnitude (None if Horizons gives none) '''
+    def query():
+        epochs = {'start': start.iso[:16], 'stop': stop.iso[:16], 'step': step}
+        table = horizons_query(object_name, obscode, epochs).ephemerides()
+        V = np.ma.filled(table['V'], np.nan).astype(float) if 'V' in table.colnames else None
+        return np.array(table['datetime_jd']), np.array(table['RA']), np.array(table['DEC']), V
+    return ephemerides.get((object_name.strip().lower(), obscode, night), query)
+
+def ephemeris_at(ephemeris, times):
+    ''' RA, Dec [deg] and V magnitude of a night_ephemeris interpolated to times (astropy Time) '''
+    jd, ra, dec, V = ephemeris
+    t = times.jd
+    ra_t = np.mod(np.degrees(np.interp(t, jd, np.unwrap(np.radians(ra)))), 360)
+    dec_t = np.interp(t, jd, dec)
+    V_t = np.interp(t, jd, V) if V is not None else np.full(np.shape(t), np.nan)
+    return ra_t, dec_t, V_t
+
 class obs_planner:
     def __init__(self, telescope, camera, object_name, myfilter, fwhm, time):
         ''' Methods for calculating coordinates,rise/set times, airmass plot, etc 
@@ -117,66 +199,36 @@ class obs_planner:
                 self.ZPmag   = {'B':20.1, 'V':20.1, 'G':21.4, 'R':21.1, 'I':20.2, 
                  'V':20.1, 'H':17.6, 'O':17.6, 'L':21.8,'1':21.1,'8':9.5,'9':10.0} # Guesses ! Needs verification
         
+        '''sunset, sunrise, local midnight'''
+        sunset            = observer.twilight_evening_nautical(time, which='nearest')
+        sunrise           = observer.twilight_morning_nautical(time, which='next')
+        midnight          = observer.midnight(time)
+
         # Retrieve object coordinates from CDS; magnitude, and description from either Simbad or JPL Horizons
-        solar_system_object = False
-        try:
-            # Lookup using CDS - this is more comprehensive than Simbad, but doesn't provide as much information
-            target = FixedTarget.from_name(object_name, name=object_name) # Astroplan FixedTarget object
-            
-            # Now try SIMBAD lookup to retrieve more information
-            try:
-                t = simbad.query_object(object_name)
-                objtype = t['OTYPE'][0]
-                try:
-                    objtype = objtype.decode()   # objtype is a byte or string type depending on astroquery version !
-                except (UnicodeDecodeError, AttributeError):
-                    pass
-    
-                V =  t['FLUX_V'][0]
-                if hasattr(V,'mask'): V = np.nan
-                sp_type = t['SP_TYPE'][0]
-                if hasattr(sp_type,'mask'): sp_type ='' 
-                diameter = t['GALDIM_MAJAXIS'][0]
-                if hasattr(diameter,'mask'): diameter = np.nan 
-                if objtype in objtype_dict: objtype = objtype_dict[objtype]
-            except:
-                objtype =''; V =np.nan; sp_type =''; diameter =np.nan   
+        fixed = resolve_fixed(object_name)
+        if fixed is not None:
+            coord, objtype, V, sp_type, diameter = fixed
+            target = FixedTarget(coord, name=object_name) # Astroplan FixedTarget object
             self.objtype = objtype
             self.is_extended = diameter != np.nan and diameter > 0.1
             self.magnitude = V
             self.diameter = diameter
             self.sp_type = sp_type
-            
-        except:
-            ''' Solar system object'''
+            solar_system_object = False
+            self.ephemeris = None
+        else:
+            ''' Solar system object: one Horizons request covers the night, from the requested time to sunrise '''
             solar_system_object = True
-            
-            ''' Parse object name so JPL Horizons understands it'''
-            if object_name.lower() == 'moon':
-                obj_id = '301'
-                obj = Horizons(id=obj_id, location=self.obscode, epochs=observer.midnight(time))
-                obj_table = obj.ephemerides()
-                self.objtype = 'Moon'
-            elif object_name.lower() in planet_dict:
-                planet = '%s Barycenter' % object_name  # Planet name alone is ambiguous in lookup
-                obj = Horizons(id=planet, location=self.obscode, epochs=time.jd)
-                obj_table = obj.ephemerides()  # NB Astropy Table object 
-                self.objtype = 'Planet'
-            else:
-                obj = Horizons(id=object_name,location=self.obscode, id_type='smallbody', epochs=time.jd)
-                obj_table = obj.ephemerides()
-                self.objtype = 'Minor solar system body'
-            
-            ra =  obj_table['RA'][0] 
-            dec = obj_table['DEC'][0]
+            _, _, self.objtype = horizons_target(object_name)
+            start = min(time, sunset, key=lambda t: t.jd) - 10*u.min
+            self.ephemeris = night_ephemeris(object_name, self.obscode, time.iso[:10], start, sunrise + 10*u.min)
+            epoch = midnight if self.objtype == 'Moon' else time
+            ra, dec, V = ephemeris_at(self.ephemeris, epoch)
             target = FixedTarget(SkyCoord(ra,dec, unit="deg"), name=object_name) # Convert target to FixedTarget object
             self.is_extended = False
             self.diameter = np.nan
             self.sp_type = np.nan
-            try:
-                self.magnitude =  obj_table['V'][0]
-            except:
-                self.magnitude = np.nan
+            self.magnitude = float(V)
             
         self.object_name = object_name
         self.solar_system_object = solar_system_object
@@ -187,10 +239,7 @@ class obs_planner:
         self.coords = coords
         self.solar_system_object = solar_system_object
         
-        '''sunset, sunrise, local midnight, and rise/set times for object. '''
-        sunset            = observer.twilight_evening_nautical(time, which='nearest')
-        sunrise           = observer.twilight_morning_nautical(time, which='next')
-        midnight          = observer.midnight(time)
+        '''rise/set times for object. '''
         obj_rise_time     = observer.target_rise_time(sunset,coords,horizon = self.min_elevation)
         obj_transit_time  = observer.target_meridian_transit_time(sunset,coords,which='nearest')
         obj_set_time      = observer.target_set_time(sunset,coords,horizon = self.min_elevation,which='next')
@@ -226,13 +275,9 @@ class obs_planner:
         dtime_hr = dtime.to_value('hr')
         ntimes = int(ntimes_per_hr * dtime_hr)
         observe_times = self.sunset + dtime * np.linspace(0,1,ntimes)
-        #observe_times = [x for x in observe_times]
-        object_up = [self.observer.target_is_up(t,self.coords, horizon=self.min_elevation) for t in observe_times]
-        A = []
-        for i,observe_time in enumerate(observe_times):
-            if object_up[i]: A.append(observe_time)
-        object_up_times = A
-        object_up_hr = sum(object_up) / ntimes_per_hr
+        object_up = np.atleast_1d(self.observer.target_is_up(observe_times,self.coords, horizon=self.min_elevation))
+        object_up_times = observe_times[object_up]
+        object_up_hr = np.sum(object_up) / ntimes_per_hr
         return object_up_times, object_up_hr
 
     def rise_set_table(self):
@@ -263,18 +308,13 @@ class obs_planner:
         ''' Create a table of position vs UT (useful for solar system objects with varying coords) '''
         up_times, _ = self.object_up(ntimes_per_hr = ntimes_per_hr)
         A = [['UT Date/Time', 'J2000 Coordinates']]
-        object_name = self.object_name
-        for t in up_times: 
+        if len(up_times) == 0 or self.ephemeris is None:
+            return A
+        # Interpolate the night's ephemeris (one cached Horizons request) to all times
+        ra, dec, _ = ephemeris_at(self.ephemeris, up_times)
+        coords_strs = SkyCoord(ra,dec, unit="deg").to_string(style ='hmsdms', precision=1, sep=':', decimal =False)
+        for t, coords_str in zip(up_times, coords_strs): 
             ut,local,lst = self.hm(t,full = True)
-            if self.objtype == 'Planet':
-                planet = '%s Barycenter' % object_name
-                obj = Horizons(id=planet, location=self.obscode, epochs=t)
-            elif self.objtype == 'Minor solar system body':
-                obj = Horizons(id=object_name,location=self.obscode, id_type='smallbody', epochs=t)
-            ephem_table = obj.ephemerides()
-            ra =  ephem_table['RA'][0]  ; dec = ephem_table['DEC'][0]
-            c = SkyCoord(ra,dec, unit="deg")
-            coords_str = c.to_string(style ='hmsdms', precision=1, sep=':', decimal =False)
             s = [ut,coords_str]
             A.append(s)
         return A
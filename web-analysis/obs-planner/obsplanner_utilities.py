@@ -10,10 +10,11 @@ from pywebio.output import put_table
 
 import astropy.units as u
 from astropy.time import Time
-from astroquery.jplhorizons import Horizons
-from astroplan import FixedTarget, Observer, moon_illumination
+from astroplan import Observer, moon_illumination
 from time import strftime
 
+from obsplanner_lib import resolve_fixed, horizons_name_valid
+
 planet_dict = \
 {'mercury':1, 'venus':2,'mars':4,'jupiter':5,'saturn':6,'uranus':7,'neptune':8,'pluto':9}
 
@@ -30,21 +31,10 @@ def check_form(ans):
         
         if object_name.upper() == 'MOON':  # special case!
             return
-        try: 
-            fixed_target = FixedTarget.from_name(object_name, name=object_name)
+        # Lookups are cached (obsplanner_cache) and reused when obs_planner is instantiated
+        if resolve_fixed(object_name) is not None or horizons_name_valid(object_name):
             return
-        except:
-            try: 
-                if object_name.lower() in planet_dict:
-                    planet = '%s Barycenter' % object_name  # Planet name alone is ambiguous in lookup
-                    obj = Horizons(id=planet, location=857, epochs=2450000) # location and epochs are dummies
-                    obj_table = obj.ephemerides()  # NB Astropy Table object
-                else:
-                    obj = Horizons(id=object_name,location=857, id_type='smallbody', epochs=2450000)
-                    obj_table = obj.ephemerides()
-                return
-            except:
-                return('target', err_msg)
+        return('target', err_msg)
 #put_link('Inputs (Click for compatible solar system object names'\,url='https://ssd.jpl.nasa.gov/horizons/app.html#/')  
 
 def get_inputs():
@@ -1,16 +1,68 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import astropy.io.fits as pyfits; from scipy.ndimage.interpolation import rotate
+import astropy.io.fits as pyfits; from scipy.ndimage.interpolation import rotate; from scipy.ndimage import affine_transform; from scipy.special import cosdg, sindg
 from statsmodels.nonparametric.smoothers_lowess import lowess; from scipy.interpolate import interp1d
 from scipy.signal import medfilt, medfilt2d,find_peaks; from scipy.optimize import curve_fit
-from datetime import datetime; import matplotlib.pyplot as plt, matplotlib as mpl; import sys
+from datetime import datetime; import matplotlib.pyplot as plt, matplotlib as mpl; import sys, os
 from matplotlib.backends.backend_pdf import PdfPages
 import io
 
 plt.switch_backend('Agg')
 mpl.rcParams['axes.prop_cycle'] = mpl.cycler('color', ['#377eb8', '#4daf4a', '#e41a1c', '#dede00', '#ff7f00', '#999999', '#984ea3', '#f781bf', '#a65628'])
 
+# Parsed calibration files, {cal_file: (mtime, calibration)}
+calibrations = {}
+
+def read_calibration(cal_file):
+    ''' Parse a grism calibration file, returns angle, wavelength coeffs [c1,c2,c3],
+        subimage box [xmin,xmax,ymin,ymax], gain curve wavelengths and gains.
+        Parsed files are kept until their modification time changes '''
+    mtime = os.path.getmtime(cal_file)
+    if cal_file in calibrations and calibrations[cal_file][0] == mtime:
+        return calibrations[cal_file][1]
+    with open(cal_file,'r') as fn:
+        lines = fn.readlines()
+    angle,c1,c2,c3 = [float(x) for x in lines[1].split(',')]
+    subimage_box = tuple(int(x) for x in lines[2].split(','))
+    wavelength_gain = []; gain_curve = []
+    for line in lines[5:]:
+        w,g = [float(x) for x in line.split()]
+        wavelength_gain.append(w); gain_curve.append(g)
+    calibration = (angle, (c1,c2,c3), subimage_box, np.array(wavelength_gain), np.array(gain_curve))
+    calibrations[cal_file] = (mtime, calibration)
+    return calibration
+
+def rotated_subimage(im, angle, box, margin=30):
+    ''' Same as rotate(im, angle, reshape=False)[ymin:ymax, xmin:xmax] with box = [xmin,xmax,ymin,ymax],
+        but only the box is resampled: one affine map takes box pixels to image coordinates and only the
+        image region they fall in is used, plus a margin where the spline prefilter has settled '''
+    xmin,xmax,ymin,ymax = box
+    ny,nx = im.shape
+    r0,r1,_ = slice(ymin,ymax).indices(ny); c0,c1,_ = slice(xmin,xmax).indices(nx)
+    shape = (max(r1-r0,0), max(c1-c0,0))
+    if 0 in shape: return np.zeros(shape, dtype=im.dtype)
+    # rotate() maps output pixel o to input M o + offset about the image center
+    c, s = cosdg(angle), sindg(angle)
+    M = np.array([[c, s], [-s, c]])
+    center = (np.array([ny, nx]) - 1) / 2
+    offset = center - M @ center + M @ [r0, c0]
+    corners = M @ np.array([[0, 0, shape[0]-1, shape[0]-1], [0, shape[1]-1, 0, shape[1]-1]]) + offset[:,None]
+    i0 = max(int(np.floor(corners[0].min())) - margin, 0); i1 = min(int(np.ceil(corners[0].max())) + margin + 1, ny)
+    j0 = max(int(np.floor(corners[1].min())) - margin, 0); j1 = min(int(np.ceil(corners[1].max())) + margin + 1, nx)
+    return affine_transform(im[i0:i1, j0:j1], M, offset - [i0, j0], shape, output=im.dtype, order=3, mode='constant', cval=0.0)
+
+def column_baselines(subim):
+    ''' Linear baselines of all columns of subim, fitted to the first and last quartiles of each column.
+        Every column shares the same design matrix, so one least squares solve fits them all '''
+    yindex = np.arange(subim.shape[0])
+    n1 = int(len(yindex)/4); n2 = 3*n1
+    X = np.concatenate((yindex[0:n1], yindex[n2:]))
+    Y = np.concatenate((subim[0:n1], subim[n2:]), axis=0).astype(float)
+    A = np.vstack((X, np.ones(len(X)))).T
+    (m, b), _, _, _ = np.linalg.lstsq(A, Y, rcond=None)
+    return np.outer(yindex, m) + b
+
 ''' Utilities for plotting and calibrating grism spectra
         -If both a calibration and reference spectrum are passed, apply the calibration to the image 
         and then the reference spectrum may be called when plotting a 2x2. 
@@ -67,21 +119,14 @@ class grism_tools:
     def apply_calibration(self, cal_file, ywidth=-1, ycenter=-1):
         # Crack calibration file, extract params
         try:
-            fn = open(self.cal_file,'r')
-        except:
+            angle, wavelength_calibration_coeffs, subimage_box, wavelength_gain, gain_curve = read_calibration(self.cal_file)
+        except (OSError, IOError):
             sys.exit('Calibration file %s not found, exiting' % cal_file)
         
-        # Parse header line, coeffs, subimage box
-        lines = fn.readlines()
-        hdr_line = lines[0]
-        angle,c1,c2,c3 = [float(x) for x in lines[1].split(',')]
-        wavelength_calibration_coeffs = [c1,c2,c3]
-        
         # Wavelength calibration: create pixel to wavelength function
         f_wave = np.poly1d(wavelength_calibration_coeffs) # Usage: wave = f_wave(pixels)
         
         # Subimage box to extract raw spectrum
-        subimage_box = [int(x) for x in lines[2].split(',')]
         xmin,xmax,ymin,ymax = subimage_box
 
         if ycenter != -1:
@@ -94,13 +139,6 @@ class grism_tools:
             ymax -= int(ywidth/2)
         
         # Amplitude calibration: create gain curve function
-        lines = lines[3:]
-        wavelength_gain = []; gain_curve = []
-        for line in lines[2:]:
-            w,g = [float(x) for x in line.split()]
-            wavelength_gain.append(w); gain_curve.append(g)
-        wavelength_gain = np.array(wavelength_gain)
-        fn.close()
         wmin = wavelength_gain[0]; wmax = wavelength_gain[-1]                                                  
         f_gain = interp1d(wavelength_gain,gain_curve) # Usage: gain = f_gain(any_wave)
 
@@ -110,9 +148,8 @@ class grism_tools:
         ymax_idx = yvals.index(max(yvals))
         ymin = ymin + ymax_idx - yw; ymax = ymin + ymax_idx + yw '''
         
-        # Create rotated subimage                                             
-        im_rot = rotate(self.im, angle, reshape=False)
-        subim = im_rot[ymin:ymax, xmin:xmax]
+        # Create rotated subimage, resampling only the subimage box
+        subim = rotated_subimage(self.im, angle, [xmin,xmax,ymin,ymax])
         
         # Calculate raw spectrum
         pixels,raw_spectrum_full = self.calc_spectrum(im=subim)
@@ -156,11 +193,8 @@ class grism_tools:
         if len(np.shape(im))==1: im = self.subim
         xsize = im.shape[1]
         pixels = np.arange(xsize)
-        S = []
-        for pixel in pixels:
-                ymax,signal,signal_max,_ = self.calc_channel_signal(im, pixel, do_plot=False)
-                S.append(signal)
-        pixels = np.array(pixels) ; S = np.array(S)
+        # Subtract the baselines of all vertical slices at once (see calc_channel_signal) and sum
+        S = np.sum(im - column_baselines(im), axis=0)
         self.pixels = pixels
         self.raw_spec = S
         return pixels, S